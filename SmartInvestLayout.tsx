@@ -88,6 +88,11 @@ interface Recommendation {
   score: number;
   price?: number;
 }
+interface ForecastPoint {
+  date: string;
+  Close: number | null;
+  Forecast: number | null;
+}
 const generalSections = [
   { icon: Home, label: "Home" },
   { icon: TrendingUp, label: "Company Overview" },
@@ -125,7 +130,7 @@ export default function SmartInvestPro() {
   const [showUserMenu, setShowUserMenu] = useState(false);
   const [loading, setLoading] = useState(false);
   const [newsQuery, setNewsQuery] = useState(""); // for user-entered ticker
-  const [forecastData, setForecastData] = useState<{ [ticker: string]: string }>({});
+  const [forecastData, setForecastData] = useState<{ [ticker: string]: ForecastPoint[] }>({});
   const [alerts, setAlerts] = useState<string[]>([]);
   const [calendar, setCalendar] = useState<any[]>([]);
   const [filters, setFilters] = useState({ pe: 0, sector: "", sentiment: 0 });
@@ -177,11 +182,12 @@ const fetchStockHealth = async () => {
   };
 
   const fetchForecastChart = async () => {
-    const result: { [ticker: string]: string } = {};
+    // Data-only mode: the chart is drawn here instead of rendered to PNG on the server
+    const result: { [ticker: string]: ForecastPoint[] } = {};
     for (const ticker of tickers) {
-      const res = await fetch(`http://localhost:8000/forecast?ticker=${ticker}`);
+      const res = await fetch(`http://localhost:8000/forecast?ticker=${ticker}&format=series`);
       const data = await res.json();
-      result[ticker] = data.image;
+      result[ticker] = data.points || [];
     }
     setForecastData(result);
   };
@@ -1006,10 +1012,20 @@ const fetchStockHealth = async () => {
           {active === "Forecasting" && (
             <>
               <button onClick={fetchForecastChart} className="mb-4 bg-cyan-500 text-white px-4 py-2 rounded">Get Forecast</button>
-              {Object.entries(forecastData).map(([ticker, img]) => (
+              {Object.entries(forecastData).map(([ticker, points]) => (
   <div key={ticker} className="mb-6">
-    <h3 className="text-lg font-semibold mb-2">{ticker} Forecast</h3>
-    <img src={`data:image/png;base64,${img}`} alt={`${ticker} Forecast`} className="rounded shadow-lg w-full max-w-4xl" />
+    <h3 className="text-lg font-semibold mb-2">{ticker} Forecast (Close vs 7-day SMA)</h3>
+    <div className="rounded shadow-lg w-full max-w-4xl h-80">
+      <ResponsiveContainer width="100%" height="100%">
+        <LineChart data={points}>
+          <XAxis dataKey="date" minTickGap={24} />
+          <YAxis domain={["auto", "auto"]} />
+          <Tooltip />
+          <Line type="monotone" dataKey="Close" name="Close Price" stroke="#06b6d4" dot={false} />
+          <Line type="monotone" dataKey="Forecast" name="7-day SMA Forecast" stroke="#f97316" dot={false} connectNulls />
+        </LineChart>
+      </ResponsiveContainer>
+    </div>
   </div>
 ))}
 
@@ -2,28 +2,41 @@ from fastapi import FastAPI, Request, Form, Query, APIRouter
 from fastapi.middleware.cors import CORSMiddleware
 from pydantic import BaseModel
 from fastapi.responses import JSONResponse
-from transformers import pipeline
 from dotenv import load_dotenv
 import yfinance as yf
 import os, re, json, csv, io, feedparser
 import pandas as pd
-import matplotlib.pyplot as plt
 import base64
 from io import BytesIO
 from datetime import datetime, timedelta
 from urllib.parse import quote_plus
-from google.cloud import storage
+from google.api_core.exceptions import NotFound, PreconditionFailed
 import requests
 from datetime import datetime
 import random
 from collections import Counter
 from statistics import mean
-from fpdf import FPDF
-from typing import List
-import matplotlib
-from fastapi.responses import FileResponse
+from typing import List, Literal, Optional
+from fastapi.responses import FileResponse, StreamingResponse, Response
 import tempfile
-matplotlib.use('Agg')
+import glob
+import threading
+import time
+import asyncio
+import functools
+import httpx
+import heapq
+import math
+import bisect
+import itertools
+import hashlib
+import queue
+import sqlite3
+import uuid
+import secrets
+from collections import OrderedDict, deque
+from concurrent.futures import ThreadPoolExecutor, Future
+from contextlib import contextmanager, asynccontextmanager
 
 # === Setup ===
 load_dotenv()
@@ -41,69 +54,1462 @@ app.add_middleware(
     allow_headers=["*"],
 )
 
-sentiment_model = pipeline("sentiment-analysis", model="ProsusAI/finbert")
-sp500 = pd.read_html("https://en.wikipedia.org/wiki/List_of_S%26P_500_companies")[0]
-sp500_lookup = {row['Security'].lower(): row['Symbol'] for _, row in sp500.iterrows()}
-session_histories = {}  # username -> list of queries
+
+# === Metrics ===
+# Latency histograms and error counters for every endpoint, request stage and dependency, exposed with
+# cache gauges in Prometheus text format on /metrics
+METRICS_BUCKETS = (0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0, 30.0)
+PROFILE_SAMPLE_RATE = float(os.getenv("PROFILE_SAMPLE_RATE", "0"))  # fraction of requests profiled; 0 disables
+PROFILE_MIN_MS = float(os.getenv("PROFILE_MIN_MS", "1000"))  # profiles of faster requests are discarded
+PROFILE_DIR = os.getenv("PROFILE_DIR", os.path.join(tempfile.gettempdir(), "smartinvest_profiles"))
+PROFILE_KEEP = 50
+PROFILE_TOKEN = os.getenv("PROFILE_TOKEN", "")  # required to read /debug/profiles; unset keeps them hidden
+
+
+class Metrics:
+    """Thread-safe counters, gauges and fixed-bucket histograms keyed by metric name and labels."""
+
+    def __init__(self, buckets=METRICS_BUCKETS):
+        self.buckets = buckets
+        self._histograms = {}  # (name, labels) -> [per-bucket counts..., +Inf count, sum]
+        self._counters = {}
+        self._gauges = {}
+        self._lock = threading.Lock()
+
+    @staticmethod
+    def _key(name, labels):
+        return name, tuple(sorted(labels.items()))
+
+    def observe(self, name, seconds, **labels):
+        key = self._key(name, labels)
+        with self._lock:
+            hist = self._histograms.get(key)
+            if hist is None:
+                hist = self._histograms[key] = [0] * (len(self.buckets) + 1) + [0.0]
+            hist[bisect.bisect_left(self.buckets, seconds)] += 1
+            hist[-1] += seconds
+
+    def inc(self, name, value=1, **labels):
+        key = self._key(name, labels)
+        with self._lock:
+            self._counters[key] = self._counters.get(key, 0) + value
+
+    def set(self, name, value, **labels):
+        with self._lock:
+            self._gauges[self._key(name, labels)] = value
+
+    @staticmethod
+    def _labels(labels, extra=()):
+        pairs = list(labels) + list(extra)
+        if not pairs:
+            return ""
+        escape = lambda v: str(v).replace("\\", "\\\\").replace('"', '\\"').replace("\n", "\\n")
+        return "{" + ",".join(f'{k}="{escape(v)}"' for k, v in pairs) + "}"
+
+    def render(self):
+        with self._lock:
+            histograms = {key: list(hist) for key, hist in self._histograms.items()}
+            counters, gauges = dict(self._counters), dict(self._gauges)
+        lines, typed = [], set()
+
+        def declare(name, kind):
+            if name not in typed:
+                typed.add(name)
+                lines.append(f"# TYPE {name} {kind}")
+
+        for (name, labels), hist in sorted(histograms.items()):
+            declare(name, "histogram")
+            cumulative = 0
+            for bound, count in zip(list(self.buckets) + ["+Inf"], hist[:-1]):
+                cumulative += count
+                lines.append(f"{name}_bucket{self._labels(labels, [('le', bound)])} {cumulative}")
+            lines.append(f"{name}_sum{self._labels(labels)} {hist[-1]:.6f}")
+            lines.append(f"{name}_count{self._labels(labels)} {cumulative}")
+        for kind, values in (("counter", counters), ("gauge", gauges)):
+            for (name, labels), value in sorted(values.items()):
+                declare(name, kind)
+                lines.append(f"{name}{self._labels(labels)} {value}")
+        return "\n".join(lines) + "\n"
+
+
+metrics = Metrics()
+
+@contextmanager
+def span(dependency, operation):
+    # Times one dependency call; exceptions count as errors and are re-raised
+    start = time.perf_counter()
+    try:
+        yield
+    except Exception:
+        metrics.inc("smartinvest_dependency_errors_total", dependency=dependency, operation=operation)
+        raise
+    finally:
+        metrics.observe("smartinvest_dependency_seconds", time.perf_counter() - start,
+                        dependency=dependency, operation=operation)
+
+@contextmanager
+def stage(route, name):
+    # Times one stage of a request handler; recorded apart from the dependency metrics
+    start = time.perf_counter()
+    try:
+        yield
+    except Exception:
+        metrics.inc("smartinvest_stage_errors_total", route=route, stage=name)
+        raise
+    finally:
+        metrics.observe("smartinvest_stage_seconds", time.perf_counter() - start, route=route, stage=name)
+
+def traced(dependency, operation=None):
+    # Decorator form of span for sync functions; the operation defaults to the function name
+    def decorate(fn):
+        @functools.wraps(fn)
+        def wrapper(*args, **kwargs):
+            with span(dependency, operation or fn.__name__):
+                return fn(*args, **kwargs)
+        return wrapper
+    return decorate
+
+
+_profile_lock = threading.Lock()  # one profile at a time
+
+def start_profile():
+    if not _profile_lock.acquire(blocking=False):
+        return None
+    try:
+        from pyinstrument import Profiler
+    except ImportError:
+        print("⚠️ PROFILE_SAMPLE_RATE is set but pyinstrument is not installed")
+        return None  # the lock stays held, so the import is not retried
+    profiler = Profiler(async_mode="enabled")
+    profiler.start()
+    return profiler
+
+def finish_profile(profiler, route, elapsed):
+    # Keeps the HTML flame graph when the request was slow; sync endpoints' threadpool work is not sampled
+    try:
+        profiler.stop()
+        if elapsed * 1000 < PROFILE_MIN_MS:
+            return
+        os.makedirs(PROFILE_DIR, exist_ok=True)
+        slug = re.sub(r"[^A-Za-z0-9]+", "_", route).strip("_") or "root"
+        name = f"{datetime.utcnow():%Y%m%dT%H%M%S}-{slug}-{int(elapsed * 1000)}ms.html"
+        with open(os.path.join(PROFILE_DIR, name), "w") as f:
+            f.write(profiler.output_html())
+        for old in sorted(glob.glob(os.path.join(PROFILE_DIR, "*.html")), key=os.path.getmtime)[:-PROFILE_KEEP]:
+            os.remove(old)
+    finally:
+        _profile_lock.release()
+
+@app.middleware("http")
+async def record_request_metrics(request: Request, call_next):
+    profiler = start_profile() if PROFILE_SAMPLE_RATE and random.random() < PROFILE_SAMPLE_RATE else None
+    start = time.perf_counter()
+    status = 500
+    try:
+        response = await call_next(request)
+        status = response.status_code
+        return response
+    finally:
+        # Streaming responses are timed to their first byte; labels use the route template
+        elapsed = time.perf_counter() - start
+        route = getattr(request.scope.get("route"), "path", "unmatched")
+        metrics.observe("smartinvest_request_seconds", elapsed, method=request.method, route=route)
+        metrics.inc("smartinvest_requests_total", method=request.method, route=route, status=str(status))
+        if status >= 500:
+            metrics.inc("smartinvest_request_errors_total", method=request.method, route=route)
+        if profiler is not None:
+            finish_profile(profiler, route, elapsed)
+
+
+# === Lazy Components ===
+# Heavy pieces (FinBERT, the S&P 500 table, matplotlib, fpdf, GCS) load on first use or
+# in the background after startup, so the API starts accepting requests straight away
+component_status = {}  # name -> {"ready", "seconds", "error"}
+
+@contextmanager
+def timed_component(name):
+    component_status.setdefault(name, {"ready": False})
+    start = time.perf_counter()
+    try:
+        yield
+    except Exception as e:
+        component_status[name] = {"ready": False, "seconds": round(time.perf_counter() - start, 3), "error": str(e)}
+        raise
+    component_status[name] = {"ready": True, "seconds": round(time.perf_counter() - start, 3),
+                              "loaded_at": datetime.utcnow().isoformat()}
+
+
+_figure_classes = None
+
+def new_figure():
+    # Object-oriented Figure on its own Agg canvas: no pyplot global state, so renders can run in parallel
+    global _figure_classes
+    if _figure_classes is None:
+        with timed_component("matplotlib"):
+            from matplotlib.figure import Figure
+            from matplotlib.backends.backend_agg import FigureCanvasAgg
+            _figure_classes = (Figure, FigureCanvasAgg)
+    Figure, FigureCanvasAgg = _figure_classes
+    fig = Figure()
+    FigureCanvasAgg(fig)
+    return fig
+
+
+SP500_URL = "https://en.wikipedia.org/wiki/List_of_S%26P_500_companies"
+SP500_CACHE_PATH = os.getenv("SP500_CACHE_PATH", os.path.join(tempfile.gettempdir(), "smartinvest_sp500.csv"))
+SP500_MAX_AGE = int(os.getenv("SP500_MAX_AGE", str(24 * 3600)))
+SP500_RETRY_AFTER = int(os.getenv("SP500_RETRY_AFTER", "60"))  # seconds between fetches while on the fallback list
+# Largest constituents, served when there is no snapshot and Wikipedia is unreachable
+SP500_FALLBACK = [
+    ("Apple Inc.", "AAPL"), ("Microsoft", "MSFT"), ("Nvidia", "NVDA"), ("Amazon", "AMZN"),
+    ("Meta Platforms", "META"), ("Alphabet Inc. (Class A)", "GOOGL"), ("Alphabet Inc. (Class C)", "GOOG"),
+    ("Berkshire Hathaway", "BRK.B"), ("Broadcom", "AVGO"), ("Tesla, Inc.", "TSLA"), ("Eli Lilly and Company", "LLY"),
+    ("JPMorgan Chase", "JPM"), ("Visa Inc.", "V"), ("UnitedHealth Group", "UNH"), ("ExxonMobil", "XOM"),
+    ("Mastercard", "MA"), ("Walmart", "WMT"), ("Johnson & Johnson", "JNJ"), ("Procter & Gamble", "PG"),
+    ("Home Depot (The)", "HD"), ("Costco", "COST"), ("Oracle Corporation", "ORCL"), ("AbbVie", "ABBV"),
+    ("Merck & Co.", "MRK"), ("Chevron Corporation", "CVX"), ("Coca-Cola Company (The)", "KO"),
+    ("Bank of America", "BAC"), ("Netflix", "NFLX"), ("Adobe Inc.", "ADBE"), ("PepsiCo", "PEP"),
+    ("Advanced Micro Devices", "AMD"), ("Salesforce", "CRM"), ("Cisco", "CSCO"), ("Intel", "INTC"),
+    ("Walt Disney Company (The)", "DIS"), ("McDonald's", "MCD"), ("Pfizer", "PFE"), ("Nike, Inc.", "NKE"),
+    ("Boeing", "BA"), ("Goldman Sachs", "GS"), ("IBM", "IBM"), ("Qualcomm", "QCOM"),
+]
+
+
+class Sp500Universe:
+    """S&P 500 constituents, loaded on first use from a local snapshot.
+
+    Every successful Wikipedia fetch rewrites the snapshot at SP500_CACHE_PATH. A snapshot
+    older than SP500_MAX_AGE is still served and refreshed in the background; Wikipedia is
+    only fetched inline when no snapshot exists yet. If that fetch fails, the bundled
+    SP500_FALLBACK list is served and the fetch retried in the background every
+    retry_after seconds. Async code calls aload() so a cold load never runs on the event loop.
+    """
+    def __init__(self, cache_path=SP500_CACHE_PATH, max_age=SP500_MAX_AGE, retry_after=SP500_RETRY_AFTER):
+        self.cache_path = cache_path
+        self.max_age = max_age
+        self.retry_after = retry_after
+        self.fallback = False
+        self._failed_at = None
+        self.table = None
+        self._lookup = None
+        self._index = None
+        self._lock = threading.Lock()
+        self._refreshing = False
+
+    def load(self):
+        if self.table is None:
+            with self._lock:
+                if self.table is None:
+                    with timed_component("sp500"):
+                        if os.path.exists(self.cache_path):
+                            table = pd.read_csv(self.cache_path)
+                            if time.time() - os.path.getmtime(self.cache_path) > self.max_age:
+                                self.refresh_in_background()
+                        else:
+                            try:
+                                table = self._fetch()
+                            except Exception as e:
+                                print(f"⚠️ S&P 500 list unavailable, serving {len(SP500_FALLBACK)} bundled tickers: {e}")
+                                table = pd.DataFrame(SP500_FALLBACK, columns=["Security", "Symbol"])
+                                self.fallback, self._failed_at = True, time.monotonic()
+                        self._set(table)
+                    component_status["sp500"]["fallback"] = self.fallback
+        elif self.fallback and time.monotonic() - self._failed_at >= self.retry_after:
+            self.refresh_in_background()
+        return self
+
+    async def aload(self):
+        if self.table is None:
+            await run_blocking(self.load)
+        return self
+
+    @property
+    def lookup(self):
+        return self.load()._lookup
+
+    @property
+    def index(self):
+        return self.load()._index
+
+    def _fetch(self):
+        table = pd.read_html(SP500_URL)[0]
+        os.makedirs(os.path.dirname(self.cache_path), exist_ok=True)
+        tmp_path = self.cache_path + ".tmp"
+        table.to_csv(tmp_path, index=False)
+        os.replace(tmp_path, self.cache_path)
+        return table
+
+    def _set(self, table):
+        lookup = {row['Security'].lower(): row['Symbol'] for _, row in table.iterrows()}
+        self._index = TickerIndex(lookup)
+        self._lookup = lookup
+        self.table = table
+
+    def refresh(self):
+        try:
+            with timed_component("sp500_refresh"):
+                self._set(self._fetch())
+            self.fallback = False
+            component_status["sp500"]["fallback"] = False
+        except Exception as e:
+            self._failed_at = time.monotonic()
+            print(f"⚠️ S&P 500 refresh failed, keeping the current snapshot: {e}")
+        finally:
+            self._refreshing = False
+
+    def refresh_in_background(self):
+        if not self._refreshing:
+            self._refreshing = True
+            threading.Thread(target=self.refresh, name="sp500-refresh", daemon=True).start()
+
+
+universe = Sp500Universe()
+
+# === Ticker Index ===
+# Common names that do not appear in the Wikipedia "Security" column
+TICKER_ALIASES = {
+    "google": "GOOGL", "alphabet": "GOOGL", "facebook": "META", "berkshire": "BRK.B",
+    "berkshire hathaway": "BRK.B", "coca cola": "KO", "coke": "KO", "pepsi": "PEP",
+    "johnson and johnson": "JNJ", "j&j": "JNJ", "jpmorgan": "JPM", "jp morgan": "JPM",
+    "exxon": "XOM", "mcdonalds": "MCD", "p&g": "PG", "at&t": "T", "goldman": "GS",
+    "disney": "DIS", "walmart": "WMT", "netflix": "NFLX", "nvidia": "NVDA", "tesla": "TSLA", "ford": "F",
+}
+# Corporate suffixes stripped to derive short names ("Apple Inc." -> "apple")
+NAME_SUFFIXES = {"inc", "inc.", "corp", "corp.", "corporation", "co", "co.", "company", "plc",
+                 "ltd", "ltd.", "group", "holdings", "incorporated", "the", "&", "and"}
+# Short names / lowercase symbols that are everyday words; only their full forms match
+AMBIGUOUS_WORDS = {
+    "a", "all", "are", "it", "on", "now", "key", "low", "see", "has", "cat", "day", "fast", "well",
+    "news", "target", "ball", "match", "best", "general", "first", "public", "global", "american",
+    "united", "international", "southern", "national", "live", "block", "digital", "host", "ice",
+    "cost", "pay", "big", "one", "tech", "hum", "real", "gen", "ready", "stock", "market",
+    "dow", "ups",
+}
+
+
+class TickerIndex:
+    """Aho-Corasick automaton over S&P 500 symbols, security names and aliases.
+
+    scan() makes a single pass over the lowercased query and returns non-overlapping
+    matches with a rank: explicit symbols ($TSLA or TSLA in capitals) and full names
+    rank highest, aliases and short names next, lowercase symbols last.
+    """
+    SCORES = {"symbol": 4, "name": 4, "alias": 3, "short": 3, "symbol_lower": 1}
+
+    def __init__(self, lookup, aliases=TICKER_ALIASES):
+        self.symbols = set(lookup.values())
+        self.symbol_to_name = {}
+        self._goto = [{}]
+        self._fail = [0]
+        self._out = [[]]  # state -> [(length, symbol, kind)]
+        for name, symbol in lookup.items():
+            self.symbol_to_name.setdefault(symbol, name.title())
+            self._add(name, symbol, "name")
+            short = self._short_name(name)
+            if short and short != name and short not in AMBIGUOUS_WORDS:
+                self._add(short, symbol, "short")
+        for alias, symbol in aliases.items():
+            if symbol in self.symbols:
+                self._add(alias, symbol, "alias")
+        for symbol in self.symbols:
+            self._add(symbol.lower(), symbol, "symbol")
+            if "." in symbol:
+                self._add(symbol.lower().replace(".", "-"), symbol, "symbol")
+        self._build()
+
+    @staticmethod
+    def _short_name(name):
+        name = re.sub(r"\(.*?\)", "", name).replace(",", " ")
+        words = name.split()
+        while words and words[-1] in NAME_SUFFIXES:
+            words.pop()
+        return " ".join(words)
+
+    def _add(self, pattern, symbol, kind):
+        state = 0
+        for ch in pattern:
+            nxt = self._goto[state].get(ch)
+            if nxt is None:
+                nxt = len(self._goto)
+                self._goto[state][ch] = nxt
+                self._goto.append({})
+                self._fail.append(0)
+                self._out.append([])
+            state = nxt
+        if all(out[1] != symbol or out[0] != len(pattern) for out in self._out[state]):
+            self._out[state].append((len(pattern), symbol, kind))
+
+    def _build(self):
+        # Breadth-first failure links; each state inherits the outputs of its failure state
+        queue = list(self._goto[0].values())
+        for state in queue:
+            for ch, nxt in self._goto[state].items():
+                fail = self._fail[state]
+                while fail and ch not in self._goto[fail]:
+                    fail = self._fail[fail]
+                self._fail[nxt] = self._goto[fail].get(ch, 0)
+                self._out[nxt] = self._out[nxt] + self._out[self._fail[nxt]]
+                queue.append(nxt)
+
+    def scan(self, query):
+        # Returns [(start, end, symbol, score)] ordered by position
+        text = query.lower()
+        goto, fail, out = self._goto, self._fail, self._out
+        candidates = []
+        state = 0
+        for i, ch in enumerate(text):
+            while state and ch not in goto[state]:
+                state = fail[state]
+            state = goto[state].get(ch, 0)
+            for length, symbol, kind in out[state]:
+                start, end = i - length + 1, i + 1
+                if (start > 0 and text[start - 1].isalnum()) or (end < len(text) and text[end].isalnum()):
+                    continue
+                if kind == "symbol":
+                    # Single letters need "$" (A, T, V ...); lowercase symbols rank lowest
+                    explicit = start > 0 and text[start - 1] == "$"
+                    if not explicit and (length == 1 or not query[start:end].isupper()):
+                        if length < 3 or text[start:end] in AMBIGUOUS_WORDS:
+                            continue
+                        kind = "symbol_lower"
+                candidates.append((start, end, symbol, self.SCORES[kind]))
+        # Leftmost-longest, non-overlapping
+        candidates.sort(key=lambda m: (m[0], -(m[1] - m[0]), -m[3]))
+        matches, last_end = [], 0
+        for match in candidates:
+            if match[0] >= last_end:
+                matches.append(match)
+                last_end = match[1]
+        return matches
+
+    def tickers(self, query, min_score=2):
+        # Unique symbols in query order
+        seen = []
+        for _, _, symbol, score in self.scan(query):
+            if score >= min_score and symbol not in seen:
+                seen.append(symbol)
+        return seen
+
+    def best(self, query, min_score=2):
+        # Lowercase symbols alone ("ups", "dow") are ordinary words, not a target
+        matches = [m for m in self.scan(query) if m[3] >= min_score]
+        if not matches:
+            return None
+        return max(matches, key=lambda m: (m[3], -m[0]))[2]
+
+
+# === Market Data Cache ===
+class _Flight:
+    """A fetch in progress; concurrent callers for the same key wait on it."""
+    def __init__(self):
+        self.event = threading.Event()
+        self.value = None
+        self.error = None
+
+
+class TTLCache:
+    """Thread-safe LRU cache with per-entry TTL and single-flight loading."""
+    def __init__(self, name, ttl, maxsize):
+        self.name = name
+        self.ttl = ttl
+        self.maxsize = maxsize
+        self._data = OrderedDict()  # key -> (expires_at, value)
+        self._inflight = {}
+        self._lock = threading.Lock()
+        self.hits = 0
+        self.misses = 0
+        self.coalesced = 0
+
+    def get_or_load(self, key, loader):
+        leader = False
+        with self._lock:
+            entry = self._data.get(key)
+            if entry is not None and entry[0] > time.monotonic():
+                self._data.move_to_end(key)
+                self.hits += 1
+                return entry[1]
+            flight = self._inflight.get(key)
+            if flight is None:
+                flight = self._inflight[key] = _Flight()
+                self.misses += 1
+                leader = True
+            else:
+                self.coalesced += 1
+
+        if not leader:
+            flight.event.wait()
+            if flight.error is not None:
+                raise flight.error
+            return flight.value
+
+        try:
+            flight.value = loader()
+        except Exception as e:
+            flight.error = e
+            raise
+        finally:
+            with self._lock:
+                if flight.error is None:
+                    self._data[key] = (time.monotonic() + self.ttl, flight.value)
+                    self._data.move_to_end(key)
+                    while len(self._data) > self.maxsize:
+                        self._data.popitem(last=False)
+                self._inflight.pop(key, None)
+            flight.event.set()
+        return flight.value
+
+    def invalidate(self, key=None):
+        with self._lock:
+            if key is None:
+                self._data.clear()
+            else:
+                self._data.pop(key, None)
+
+    def stats(self):
+        with self._lock:
+            size = len(self._data)
+        lookups = self.hits + self.misses + self.coalesced
+        return {
+            "size": size,
+            "maxsize": self.maxsize,
+            "ttl": self.ttl,
+            "hits": self.hits,
+            "misses": self.misses,
+            "coalesced": self.coalesced,
+            "hit_ratio": round((self.hits + self.coalesced) / lookups, 4) if lookups else 0.0,
+        }
+
+
+class YFinanceProvider:
+    """Live market data from yfinance. Swap for a fake in tests via market_data.set_provider()."""
+    @traced("yfinance")
+    def quote(self, ticker):
+        fast_info = yf.Ticker(ticker).fast_info
+        return {"lastPrice": fast_info.get("lastPrice"), "previousClose": fast_info.get("previousClose")}
+
+    @traced("yfinance")
+    def info(self, ticker):
+        return yf.Ticker(ticker).info
+
+    @traced("yfinance")
+    def history(self, ticker, period):
+        return yf.Ticker(ticker).history(period=period)
+
+    @traced("yfinance")
+    def income_stmt(self, ticker):
+        return yf.Ticker(ticker).income_stmt
+
+
+class MarketData:
+    # kind -> (ttl seconds, max entries)
+    DEFAULTS = {
+        "quote": (30, 1024),
+        "info": (6 * 3600, 1024),
+        "history": (300, 2048),
+        "income_stmt": (24 * 3600, 512),
+    }
+
+    def __init__(self, provider, config=None):
+        self.provider = provider
+        config = {**self.DEFAULTS, **(config or {})}
+        self.caches = {kind: TTLCache(kind, ttl, maxsize) for kind, (ttl, maxsize) in config.items()}
+
+    def set_provider(self, provider):
+        self.provider = provider
+        for cache in self.caches.values():
+            cache.invalidate()
+
+    def quote(self, ticker):
+        ticker = ticker.upper()
+        return self.caches["quote"].get_or_load(ticker, lambda: self.provider.quote(ticker))
+
+    def info(self, ticker):
+        ticker = ticker.upper()
+        return self.caches["info"].get_or_load(ticker, lambda: self.provider.info(ticker))
+
+    def history(self, ticker, period):
+        ticker = ticker.upper()
+        return self.caches["history"].get_or_load((ticker, period), lambda: self.provider.history(ticker, period))
+
+    def income_stmt(self, ticker):
+        ticker = ticker.upper()
+        return self.caches["income_stmt"].get_or_load(ticker, lambda: self.provider.income_stmt(ticker))
+
+    def stats(self):
+        return {kind: cache.stats() for kind, cache in self.caches.items()}
+
+
+market_data = MarketData(YFinanceProvider())
+
+# === Sentiment Engine ===
+SENTIMENT_THREADS = int(os.getenv("SENTIMENT_THREADS", "2"))
+SENTIMENT_MAX_BATCH = int(os.getenv("SENTIMENT_MAX_BATCH", "16"))
+SENTIMENT_MAX_WAIT_MS = float(os.getenv("SENTIMENT_MAX_WAIT_MS", "10"))
+SENTIMENT_CACHE_SIZE = int(os.getenv("SENTIMENT_CACHE_SIZE", "4096"))
+
+
+class SentimentEngine:
+    """FinBERT scoring with micro-batching across concurrent requests and a result memo.
+
+    submit() queues a text and returns a Future. A single worker thread drains up to
+    max_batch queued texts, waiting at most max_wait_ms for the batch to fill, and runs
+    one truncated pipeline call for the whole batch. Results are memoized by text hash.
+    The model itself is built by load_model on first use (or by warm()).
+    """
+    def __init__(self, load_model, max_batch=SENTIMENT_MAX_BATCH, max_wait_ms=SENTIMENT_MAX_WAIT_MS,
+                 cache_size=SENTIMENT_CACHE_SIZE, max_length=512):
+        self.load_model = load_model
+        self.model = None
+        self._model_lock = threading.Lock()
+        self.max_batch = max_batch
+        self.max_wait = max_wait_ms / 1000
+        self.cache_size = cache_size
+        self.max_length = max_length
+        self._queue = queue.Queue()
+        self._memo = OrderedDict()  # sha1(text) -> {"label", "score"}
+        self._lock = threading.Lock()
+        self._worker = None
+        self.hits = 0
+        self.misses = 0
+        self.batches = 0
+
+    @staticmethod
+    def _key(text):
+        return hashlib.sha1(text.encode("utf-8")).hexdigest()
+
+    def submit(self, text):
+        key = self._key(text)
+        future = Future()
+        with self._lock:
+            if key in self._memo:
+                self._memo.move_to_end(key)
+                self.hits += 1
+                future.set_result(self._memo[key])
+                return future
+            self.misses += 1
+            if self._worker is None:
+                self._worker = threading.Thread(target=self._run, name="finbert", daemon=True)
+                self._worker.start()
+        self._queue.put((key, text, future))
+        return future
+
+    def warm(self):
+        if self.model is None:
+            with self._model_lock:
+                if self.model is None:
+                    self.model = self.load_model()
+        return self.model
+
+    def score(self, text):
+        return self.submit(text).result()
+
+    def score_many(self, texts):
+        futures = [self.submit(text) for text in texts]
+        return [future.result() for future in futures]
+
+    async def score_async(self, text):
+        return await asyncio.wrap_future(self.submit(text))
+
+    async def score_many_async(self, texts):
+        return await asyncio.gather(*(asyncio.wrap_future(self.submit(text)) for text in texts))
+
+    def _next_batch(self):
+        batch = [self._queue.get()]
+        deadline = time.monotonic() + self.max_wait
+        while len(batch) < self.max_batch:
+            remaining = deadline - time.monotonic()
+            if remaining <= 0:
+                break
+            try:
+                batch.append(self._queue.get(timeout=remaining))
+            except queue.Empty:
+                break
+        return batch
+
+    def _run(self):
+        # Must never die: submit() only starts one worker, so a dead one would hang every caller
+        while True:
+            try:
+                self._score_batch(self._next_batch())
+            except Exception as e:
+                print(f"⚠️ FinBERT worker error: {e}")
+
+    def _score_batch(self, batch):
+        # Claim each future first; ones cancelled by their caller (e.g. a closed SSE stream) are dropped
+        batch = [item for item in batch if item[2].set_running_or_notify_cancel()]
+        if not batch:
+            return
+        texts = {}  # key -> text, duplicates in one batch are scored once
+        for key, text, _ in batch:
+            texts.setdefault(key, text)
+        keys = list(texts)
+        try:
+            with span("finbert", "batch"):
+                results = self.warm()([texts[k] for k in keys], batch_size=len(keys),
+                                     truncation=True, max_length=self.max_length)
+        except Exception as e:
+            for _, _, future in batch:
+                future.set_exception(e)
+            return
+        by_key = dict(zip(keys, results))
+        with self._lock:
+            self.batches += 1
+            for key, result in by_key.items():
+                self._memo[key] = result
+            while len(self._memo) > self.cache_size:
+                self._memo.popitem(last=False)
+        for key, _, future in batch:
+            future.set_result(by_key[key])
+
+    def stats(self):
+        with self._lock:
+            return {"hits": self.hits, "misses": self.misses, "batches": self.batches,
+                    "memo_size": len(self._memo), "queued": self._queue.qsize()}
+
+
+def load_finbert():
+    with timed_component("sentiment_model"):
+        import torch
+        from transformers import pipeline
+        torch.set_num_threads(SENTIMENT_THREADS)  # bound FinBERT's CPU inference threads
+        return pipeline("sentiment-analysis", model="ProsusAI/finbert", device=-1)
+
+
+sentiment_engine = SentimentEngine(load_finbert)
+WARM_SENTIMENT_MODEL = os.getenv("WARM_SENTIMENT_MODEL", "1") == "1"
+
+
+@app.on_event("startup")
+def warm_components():
+    # Runs once the server is up; requests are served while these load
+    threading.Thread(target=universe.load, name="warm-sp500", daemon=True).start()
+    if isinstance(store, GCSStore):
+        threading.Thread(target=store.connect, name="warm-gcs", daemon=True).start()
+    if WARM_SENTIMENT_MODEL:
+        threading.Thread(target=sentiment_engine.warm, name="warm-finbert", daemon=True).start()
+
+
+@app.get("/ready")
+def readiness():
+    required = ["storage", "sp500"] + (["sentiment_model"] if WARM_SENTIMENT_MODEL else [])
+    ready = all(component_status.get(name, {}).get("ready") for name in required)
+    body = {"ready": ready, "components": component_status}
+    return body if ready else JSONResponse(status_code=503, content=body)
 
 # === GCS Helpers ===
-def append_to_gcs_csv(filename, row):
-    client = storage.Client()
-    bucket = client.bucket(gcs_bucket)
-    blob = bucket.blob(filename)
-    rows = []
-    if blob.exists():
-        content = blob.download_as_text()
-        reader = csv.reader(content.splitlines())
-        rows = list(reader)
-    rows.append(row)
-    buffer = io.StringIO()
-    writer = csv.writer(buffer)
-    writer.writerows(rows)
-    buffer.seek(0)
-    blob.upload_from_string(buffer.read(), content_type='text/csv')
+GCS_POOL_SIZE = int(os.getenv("GCS_POOL_SIZE", "32"))
+
+
+class GCSStore:
+    """One storage client and bucket handle, shared by every GCS read and write.
+
+    The client is built on first use (or by the startup warm-up), so importing the app
+    needs no GCP credentials.
+    """
+    def __init__(self, bucket_name, pool_size=GCS_POOL_SIZE):
+        self.bucket_name = bucket_name
+        self.pool_size = pool_size
+        self._handles = None
+        self._lock = threading.Lock()
+        self._executor = ThreadPoolExecutor(max_workers=pool_size, thread_name_prefix="gcs")
+
+    def connect(self):
+        if self._handles is None:
+            with self._lock:
+                if self._handles is None:
+                    with timed_component("storage"):
+                        from google.cloud import storage
+                        client = storage.Client()
+                        # The default requests pool keeps 10 connections; size it for the threadpool
+                        adapter = requests.adapters.HTTPAdapter(pool_connections=self.pool_size,
+                                                                pool_maxsize=self.pool_size)
+                        client._http.mount("https://", adapter)
+                        self._handles = (client, client.bucket(self.bucket_name))
+        return self._handles
+
+    @property
+    def client(self):
+        return self.connect()[0]
+
+    @property
+    def bucket(self):
+        return self.connect()[1]
+
+    @traced("gcs")
+    def read_bytes(self, name):
+        # Single GET; a missing object is a result, not an extra exists() round trip
+        try:
+            return self.bucket.blob(name).download_as_bytes()
+        except NotFound:
+            return None
+
+    def read_text(self, name):
+        data = self.read_bytes(name)
+        return None if data is None else data.decode("utf-8")
+
+    @traced("gcs")
+    def read_with_generation(self, name):
+        # Returns (None, 0) when missing; 0 is also the "must not exist" precondition
+        blob = self.bucket.blob(name)
+        try:
+            data = blob.download_as_bytes()
+        except NotFound:
+            return None, 0
+        return data, blob.generation
+
+    @traced("gcs")
+    def write(self, name, data, content_type=None, if_generation_match=None):
+        # Raises PreconditionFailed when if_generation_match no longer holds
+        blob = self.bucket.blob(name)
+        blob.upload_from_string(data, content_type=content_type, if_generation_match=if_generation_match)
+        return blob.generation
+
+    @traced("gcs")
+    def generation(self, name):
+        # Metadata-only request; 0 when the object does not exist
+        blob = self.bucket.get_blob(name)
+        return 0 if blob is None else blob.generation
+
+    @traced("gcs")
+    def list_names(self, prefix):
+        return [blob.name for blob in self.client.list_blobs(self.bucket, prefix=prefix)]
+
+    def read_many(self, names):
+        names = list(names)
+        return dict(zip(names, self._executor.map(self.read_bytes, names)))
+
+    def write_many(self, items):
+        # items: iterable of (name, data, content_type); returns the new generations in order
+        return list(self._executor.map(lambda item: self.write(*item), items))
+
+    @traced("gcs")
+    def delete_many(self, names):
+        with self.client.batch():
+            for name in names:
+                self.bucket.blob(name).delete()
+
+
+class MemoryStore:
+    """In-process stand-in for GCSStore, used with STORAGE_BACKEND=memory and in tests."""
+    def __init__(self):
+        self.objects = {}  # name -> (bytes, content_type, generation)
+        self._lock = threading.Lock()
+        self._generation = 0
+
+    def read_bytes(self, name):
+        return self.read_with_generation(name)[0]
+
+    def read_text(self, name):
+        data = self.read_bytes(name)
+        return None if data is None else data.decode("utf-8")
+
+    def read_with_generation(self, name):
+        with self._lock:
+            entry = self.objects.get(name)
+        return (None, 0) if entry is None else (entry[0], entry[2])
+
+    def write(self, name, data, content_type=None, if_generation_match=None):
+        if isinstance(data, str):
+            data = data.encode("utf-8")
+        with self._lock:
+            current = self.objects.get(name)
+            if if_generation_match is not None and (current[2] if current else 0) != if_generation_match:
+                raise PreconditionFailed(f"{name}: generation does not match {if_generation_match}")
+            self._generation += 1
+            self.objects[name] = (data, content_type, self._generation)
+            return self._generation
+
+    def generation(self, name):
+        return self.read_with_generation(name)[1]
+
+    def list_names(self, prefix):
+        with self._lock:
+            return sorted(name for name in self.objects if name.startswith(prefix))
+
+    def read_many(self, names):
+        return {name: self.read_bytes(name) for name in names}
+
+    def write_many(self, items):
+        return [self.write(*item) for item in items]
+
+    def delete_many(self, names):
+        with self._lock:
+            for name in names:
+                self.objects.pop(name, None)
+
+
+def build_store():
+    if os.getenv("STORAGE_BACKEND", "gcs") == "memory":
+        with timed_component("storage"):
+            return MemoryStore()
+    return GCSStore(gcs_bucket)
+
+
+store = build_store()
+
 
 def write_to_gcs(filename, content):
-    client = storage.Client()
-    bucket = client.bucket(gcs_bucket)
-    blob = bucket.blob(filename)
     if isinstance(content, str):
-        blob.upload_from_string(content)
+        store.write(filename, content)
     else:
-        blob.upload_from_string(json.dumps(content))
+        store.write(filename, json.dumps(content))
 
 def get_gcs_blob_text(filename):
-    client = storage.Client()
-    bucket = client.bucket(gcs_bucket)
-    blob = bucket.blob(filename)
-    if not blob.exists():
-        return None
-    return blob.download_as_text()
+    return store.read_text(filename)
+
+# === User Store ===
+class UserStore:
+    """One object per user under users/, fronted by an in-memory username index.
+
+    Registration is a single create-only write (if_generation_match=0), so it
+    never rewrites a shared file and concurrent registrations cannot drop each
+    other. The legacy users.csv is imported once on first use and left in place.
+    """
+    PREFIX = "users/"
+    LEGACY_CSV = "users.csv"
+    MIGRATION_MARKER = "users.csv.migrated"
+
+    def __init__(self, store):
+        self.store = store
+        self._index = {}  # username -> record
+        self._lock = threading.Lock()
+        self._migrated = False
+
+    def _path(self, username):
+        return f"{self.PREFIX}{quote_plus(username)}.json"
+
+    def _ensure_migrated(self):
+        if self._migrated:
+            return
+        with self._lock:
+            if not self._migrated:
+                if self.store.read_bytes(self.MIGRATION_MARKER) is None:
+                    self.migrate_legacy_csv()
+                self._migrated = True
+
+    def migrate_legacy_csv(self):
+        content = self.store.read_text(self.LEGACY_CSV)
+        if content is None:
+            return 0
+        # The old /register appended duplicates and /login accepted any of them; keep the newest row
+        latest = {}
+        for row in csv.reader(content.splitlines()):
+            if len(row) == 2:
+                latest[row[0]] = row[1]
+        imported = 0
+        for username, password in latest.items():
+            if self._create(username, {"username": username, "password": password, "migrated": True}):
+                imported += 1
+        try:
+            self.store.write(self.MIGRATION_MARKER, json.dumps({"imported": imported, "at": datetime.utcnow().isoformat()}),
+                             content_type="application/json", if_generation_match=0)
+        except PreconditionFailed:
+            pass  # another worker finished the migration first
+        return imported
+
+    def _create(self, username, record):
+        try:
+            self.store.write(self._path(username), json.dumps(record), content_type="application/json", if_generation_match=0)
+        except PreconditionFailed:
+            return False
+        self._index[username] = record
+        return True
+
+    def get(self, username):
+        self._ensure_migrated()
+        record = self._index.get(username)
+        if record is None:
+            text = self.store.read_text(self._path(username))
+            if text is None:
+                return None
+            record = self._index[username] = json.loads(text)
+        return record
+
+    def add(self, username, password):
+        self._ensure_migrated()
+        record = {"username": username, "password": password, "created_at": datetime.utcnow().isoformat()}
+        return self._create(username, record)
+
+
+users = UserStore(store)
+
+# === Session History ===
+# Shared by every worker on the host; point it at a persistent volume to keep history across redeploys
+HISTORY_DB_PATH = os.getenv("HISTORY_DB_PATH", os.path.join(tempfile.gettempdir(), "smartinvest_history.sqlite3"))
+HISTORY_PER_USER = int(os.getenv("HISTORY_PER_USER", "50"))
+HISTORY_MAX_USERS = int(os.getenv("HISTORY_MAX_USERS", "1000"))
+HISTORY_MEMORY_BUDGET = int(os.getenv("HISTORY_MEMORY_BUDGET", str(32 * 1024 * 1024)))  # approx. bytes of text
+HISTORY_FLUSH_INTERVAL = float(os.getenv("HISTORY_FLUSH_INTERVAL", "1.0"))
+HISTORY_FLUSH_BATCH = 256
+HISTORY_TURN_OVERHEAD = 200  # rough per-turn cost of the dict and deque slot
+# With several uvicorn workers on one SQLite file no worker's memory holds a user's whole history
+HISTORY_SHARED = os.getenv("HISTORY_SHARED", "1" if int(os.getenv("WEB_CONCURRENCY", "1")) > 1 else "0") == "1"
+
+
+class SessionHistory:
+    """Chat turns per user: a capped in-memory ring buffer in front of SQLite.
+
+    Each user keeps at most per_user recent turns in memory. Idle users are evicted LRU
+    once max_users or memory_budget is exceeded; their turns stay in SQLite. Writes are
+    queued and committed in batches by a background thread, so /smartchat never waits on
+    disk; each turn's id is its SQLite rowid, unique across processes. Pages not covered by
+    memory (older turns) read SQLite. With shared=True (several workers on one database)
+    memory is skipped and every page is read from SQLite.
+    """
+
+    def __init__(self, db_path=HISTORY_DB_PATH, per_user=HISTORY_PER_USER, max_users=HISTORY_MAX_USERS,
+                 memory_budget=HISTORY_MEMORY_BUDGET, flush_interval=HISTORY_FLUSH_INTERVAL, shared=HISTORY_SHARED):
+        self.db_path = db_path
+        self.per_user = per_user
+        self.max_users = max_users
+        self.memory_budget = memory_budget
+        self.flush_interval = flush_interval
+        self.shared = shared
+        self._users = OrderedDict()  # username -> {"turns": deque, "complete": bool}, idle users first
+        self._bytes = 0
+        self._unsaved = 0  # appended turns not yet committed (they have no id yet)
+        self._lock = threading.Lock()
+        self._pending = queue.Queue()  # turn rows, or Events marking a flush point
+        self._db = None
+        self._db_lock = threading.Lock()
+        self._writer = None
+        self.evictions = 0
+        self.written = 0
+
+    def _connect(self):
+        if self._db is None:
+            if os.path.dirname(self.db_path):
+                os.makedirs(os.path.dirname(self.db_path), exist_ok=True)
+            db = sqlite3.connect(self.db_path, check_same_thread=False)
+            db.execute("PRAGMA journal_mode=WAL")
+            db.execute("CREATE TABLE IF NOT EXISTS history_turns (id INTEGER PRIMARY KEY AUTOINCREMENT, "
+                       "username TEXT NOT NULL, query TEXT, reply TEXT, created_at REAL)")
+            db.execute("CREATE INDEX IF NOT EXISTS history_turns_user ON history_turns (username, id)")
+            self._db = db
+        return self._db
+
+    def _start_writer(self):
+        if self._writer is None:
+            with self._lock:
+                if self._writer is None:
+                    self._writer = threading.Thread(target=self._write_loop, name="history-writer", daemon=True)
+                    self._writer.start()
+
+    def _write_loop(self):
+        while True:
+            batch, markers = [], []
+            item = self._pending.get()
+            deadline = time.monotonic() + self.flush_interval
+            while True:
+                (markers if isinstance(item, threading.Event) else batch).append(item)
+                if markers or len(batch) >= HISTORY_FLUSH_BATCH:
+                    break
+                try:
+                    item = self._pending.get(timeout=max(0.0, deadline - time.monotonic()))
+                except queue.Empty:
+                    break
+            if batch:
+                try:
+                    with self._db_lock:
+                        db = self._connect()
+                        with db:
+                            ids = [db.execute("INSERT INTO history_turns (username, query, reply, created_at) "
+                                              "VALUES (?, ?, ?, ?)", row).lastrowid for _, row in batch]
+                    for (turn, _), id_ in zip(batch, ids):
+                        turn["id"] = id_
+                    self.written += len(batch)
+                except Exception as e:
+                    print(f"⚠️ History write of {len(batch)} turns failed: {e}")
+                with self._lock:
+                    self._unsaved -= len(batch)
+            for marker in markers:
+                marker.set()
+
+    @staticmethod
+    def _size(turn):
+        return len(turn["userQuery"]) + len(turn["botReply"]) + HISTORY_TURN_OVERHEAD
+
+    def _evict(self):
+        while len(self._users) > 1 and (len(self._users) > self.max_users or self._bytes > self.memory_budget):
+            _, entry = self._users.popitem(last=False)
+            self._bytes -= sum(self._size(turn) for turn in entry["turns"])
+            self.evictions += 1
+
+    def _remember(self, username, turns, complete):
+        entry = self._users.get(username)
+        if entry is None:
+            entry = self._users[username] = {"turns": deque(maxlen=self.per_user), "complete": complete}
+        self._users.move_to_end(username)
+        for turn in turns:
+            if len(entry["turns"]) == entry["turns"].maxlen:
+                self._bytes -= self._size(entry["turns"][0])
+            entry["turns"].append(turn)
+            self._bytes += self._size(turn)
+        return entry
+
+    def append(self, username, query, reply):
+        turn = {"id": None, "userQuery": query, "botReply": reply}  # the writer fills in the rowid
+        with self._lock:
+            self._unsaved += 1
+            if not self.shared:
+                # A user first seen here may have older turns in SQLite, so memory is not complete for them
+                self._remember(username, [turn], complete=False)
+                self._evict()
+        self._start_writer()
+        self._pending.put((turn, (username, query, reply, time.time())))
+        return turn
+
+    def flush(self, timeout=10.0):
+        self._start_writer()
+        marker = threading.Event()
+        self._pending.put(marker)
+        return marker.wait(timeout)
+
+    def _read_db(self, username, limit, before=None):
+        with self._db_lock:
+            rows = self._connect().execute(
+                "SELECT id, query, reply FROM history_turns WHERE username = ? AND id < ? ORDER BY id DESC LIMIT ?",
+                (username, before if before is not None else 2 ** 62, limit),
+            ).fetchall()
+        return [{"id": id_, "userQuery": query, "botReply": reply} for id_, query, reply in reversed(rows)]
+
+    def page(self, username, limit=50, before=None):
+        """Up to limit turns older than the id `before` (newest page when None), oldest first."""
+        # Pending turns get their ids on commit, and SQLite must have them before it is read
+        if self._unsaved:
+            self.flush()
+        if self.shared:
+            return self._read_db(username, limit, before)
+        with self._lock:
+            entry = self._users.get(username)
+            if entry is not None:
+                self._users.move_to_end(username)
+                # Turns whose write failed never got an id and are left out
+                turns = [turn for turn in entry["turns"]
+                         if turn["id"] is not None and (before is None or turn["id"] < before)]
+                # Memory answers when it holds the whole page, or holds everything the user has
+                if len(turns) >= limit or (entry["complete"] and len(entry["turns"]) < self.per_user):
+                    return turns[-limit:]
+
+        if before is not None:
+            return self._read_db(username, limit, before)
+
+        # Newest page: re-hydrate memory with the newest turns so the next reads stay in memory
+        recent = self._read_db(username, max(limit, self.per_user))
+        with self._lock:
+            old = self._users.pop(username, None)
+            merged = {turn["id"]: turn for turn in recent}
+            unsaved = []  # appended meanwhile; the writer still fills in their ids
+            if old is not None:
+                self._bytes -= sum(self._size(turn) for turn in old["turns"])
+                for turn in old["turns"]:
+                    if turn["id"] is None:
+                        unsaved.append(turn)
+                    else:
+                        merged[turn["id"]] = turn
+            turns = [merged[id_] for id_ in sorted(merged)] + unsaved
+            self._remember(username, turns[-self.per_user:], complete=True)
+            self._evict()
+        return turns[-limit:]
+
+    def stats(self):
+        with self._lock:
+            return {"users": len(self._users), "bytes": self._bytes, "memory_budget": self.memory_budget,
+                    "evictions": self.evictions, "pending": self._pending.qsize(), "written": self.written}
+
+
+session_history = SessionHistory()
+
+@app.on_event("shutdown")
+def flush_session_history():
+    session_history.flush()
+
+@app.get("/history/{username}")
+def get_history(username: str, limit: int = Query(50, ge=1, le=500), before: Optional[int] = None):
+    # Oldest first; pass the first turn's id as `before` to page further back
+    return session_history.page(username, limit=limit, before=before)
 
 # === Auth ===
 @app.post("/register")
 def register(username: str = Form(...), password: str = Form(...)):
-    append_to_gcs_csv("users.csv", [username, password])
+    if not users.add(username, password):
+        return JSONResponse(status_code=409, content={"error": "Username already exists"})
     return {"status": "Registered successfully"}
 
 @app.post("/login")
 def login(username: str = Form(...), password: str = Form(...)):
-    client = storage.Client()
-    bucket = client.bucket(gcs_bucket)
-    blob = bucket.blob("users.csv")
-    if not blob.exists():
-        return JSONResponse(status_code=401, content={"error": "User not found"})
-    content = blob.download_as_text()
-    reader = csv.reader(content.splitlines())
-    for row in reader:
-        if len(row) != 2:
-            continue
-        user, pwd = row
-        if user == username and pwd == password:
-            session_histories[username] = []
-            return {"status": "Login successful"}
+    record = users.get(username)
+    if record is not None and record["password"] == password:
+        return {"status": "Login successful"}
     return JSONResponse(status_code=401, content={"error": "Invalid credentials"})
 
+# === Precomputed Tables ===
+PREDICTIONS_CHECK_INTERVAL = int(os.getenv("PREDICTIONS_CHECK_INTERVAL", "300"))
+INDICATORS_CHECK_INTERVAL = int(os.getenv("INDICATORS_CHECK_INTERVAL", "900"))
+INDICATORS_MAX_AGE_DAYS = int(os.getenv("INDICATORS_MAX_AGE_DAYS", "4"))  # older rows fall back to live prices
+# Indicator risk buckets (volatility terciles) acceptable for each portfolio risk level
+RISK_LEVELS = {"low": ("low",), "medium": ("low", "medium"), "high": ("low", "medium", "high")}
+DEFAULT_RISK = "medium"  # used when a portfolio's risk is missing or unrecognised
+# Trading sessions back for each change column; the batch job's compute_indicators uses the same
+CHANGE_SESSIONS = {"change_1d": 1, "change_7d": 5, "change_30d": 21}
+VOLATILITY_SESSIONS = 21
+
+
+class BlobTable:
+    """A CSV blob held in memory in indexed form.
+
+    The blob generation is checked at most every check_interval seconds; the CSV is
+    only downloaded and re-indexed when the generation changes.
+    """
+    BLOB = None
+
+    def __init__(self, store, check_interval):
+        self.store = store
+        self.check_interval = check_interval
+        self.generation = None
+        self._data = None
+        self._checked_at = 0.0
+        self._lock = threading.Lock()
+
+    def _index(self, data):
+        # data is the blob bytes, or None when the blob does not exist
+        raise NotImplementedError
+
+    def _changed(self):
+        return self.store.generation(self.BLOB) != self.generation
+
+    def refresh(self, force=False):
+        if not force and self.generation is not None and time.monotonic() - self._checked_at < self.check_interval:
+            return
+        with self._lock:
+            if not force and self.generation is not None and time.monotonic() - self._checked_at < self.check_interval:
+                return
+            if self._changed():
+                data, generation = self.store.read_with_generation(self.BLOB)
+                self._data = self._index(data)
+                self.generation = generation
+            self._checked_at = time.monotonic()
+
+    @property
+    def data(self):
+        self.refresh()
+        return self._data
+
+
+class IndicatorsTable(BlobTable):
+    """indicators/latest.csv from the batch job: returns, volatility, SMAs, drawdown and risk per ticker."""
+    BLOB = "indicators/latest.csv"
+
+    def __init__(self, store, check_interval=INDICATORS_CHECK_INTERVAL):
+        super().__init__(store, check_interval)
+
+    def _index(self, data):
+        if data is None:
+            return pd.DataFrame()
+        return pd.read_csv(io.BytesIO(data)).set_index("Ticker")
+
+    def get(self, ticker, max_age_days=INDICATORS_MAX_AGE_DAYS):
+        # None when the ticker is missing or its row is older than max_age_days (the batch job stalled)
+        frame = self.data
+        if ticker not in frame.index:
+            return None
+        row = frame.loc[ticker].to_dict()
+        as_of = datetime.strptime(str(row.get("as_of")), "%Y-%m-%d").date()
+        if (datetime.utcnow().date() - as_of).days > max_age_days:
+            return None
+        return row
+
+
+class IndicatorSeries(BlobTable):
+    """indicators/series.csv: recent closes and 7-day SMA, split by ticker once."""
+    BLOB = "indicators/series.csv"
+
+    def __init__(self, store, check_interval=INDICATORS_CHECK_INTERVAL):
+        super().__init__(store, check_interval)
+
+    def _index(self, data):
+        if data is None:
+            return {}
+        df = pd.read_csv(io.BytesIO(data), parse_dates=["Date"])
+        return {ticker: group.set_index("Date")[["Close", "SMA_7"]] for ticker, group in df.groupby("Ticker")}
+
+    def get(self, ticker):
+        return self.data.get(ticker)
+
+
+class PredictionsTable(BlobTable):
+    """enriched_predictions.csv pre-ranked per (lowercased GICS Sector, portfolio risk).
+
+    With indicators available, stocks are ranked by expected return (Predicted_Close vs the
+    last close), per unit of volatility for low and medium risk, among the risk buckets that
+    risk level accepts. Without them every risk level falls back to ranking by Predicted_Close.
+    The ranking is rebuilt when either blob changes.
+    """
+    BLOB = "enriched_predictions.csv"
+
+    def __init__(self, store, indicators, top_k=25, check_interval=PREDICTIONS_CHECK_INTERVAL):
+        super().__init__(store, check_interval)
+        self.indicators = indicators
+        self.top_k = top_k
+        self._indicators_generation = None
+
+    def _changed(self):
+        self.indicators.refresh()
+        return super()._changed() or self.indicators.generation != self._indicators_generation
+
+    def _ranked(self, df):
+        by_sector = {}
+        for sector, group in df.groupby("sector"):
+            top = group.nlargest(self.top_k, "score")
+            by_sector[sector] = list(zip(top["score"].tolist(), top["stock"].tolist()))
+        return by_sector
+
+    def _index(self, data):
+        latest = self.indicators.data
+        self._indicators_generation = self.indicators.generation
+        if data is None:
+            return {}
+        df = pd.read_csv(io.BytesIO(data))
+        df.columns = df.columns.str.strip()  # Strip BOMs and whitespace
+        df = df.rename(columns={"Ticker": "stock"})
+        df = df.dropna(subset=["Predicted_Close", "GICS Sector"])
+        df["sector"] = df["GICS Sector"].str.lower()
+
+        if latest.empty:
+            df["score"] = df["Predicted_Close"].astype(float)
+            ranked = self._ranked(df)
+            return {risk: ranked for risk in RISK_LEVELS}
+
+        df = df.join(latest[["Close", "volatility", "risk"]].add_prefix("last_"), on="stock", how="inner")
+        df["expected_return"] = (df["Predicted_Close"].astype(float) / df["last_Close"] - 1) * 100
+        by_risk = {}
+        for risk, accepted in RISK_LEVELS.items():
+            pool = df[df["last_risk"].isin(accepted)].copy()
+            pool["score"] = pool["expected_return"] if risk == "high" else pool["expected_return"] / pool["last_volatility"]
+            by_risk[risk] = self._ranked(pool.dropna(subset=["score"]))
+        return by_risk
+
+    def top(self, sectors, n=5, risk=DEFAULT_RISK):
+        by_risk = self.data
+        risk = str(risk).lower()
+        by_sector = by_risk.get(risk if risk in RISK_LEVELS else DEFAULT_RISK, {})
+        candidates = [by_sector.get(sector, []) for sector in {s.lower() for s in sectors}]
+        best = heapq.nlargest(n, (pair for ranked in candidates for pair in ranked[:n]), key=lambda pair: pair[0])
+        return [{"stock": stock, "score": score} for score, stock in best]
+
+
+indicators = IndicatorsTable(store)
+indicator_series = IndicatorSeries(store)
+predictions = PredictionsTable(store, indicators)
+
+# === Chart Rendering ===
+CHART_CACHE_BYTES = int(os.getenv("CHART_CACHE_BYTES", str(64 * 1024 * 1024)))
+ChartFormat = Literal["base64", "png", "series"]
+
+
+class ChartCache:
+    """Rendered PNGs keyed by (ticker, kind, data version), LRU-evicted beyond max_bytes.
+
+    The data version is a content hash of the plotted data, so a chart is only re-rendered
+    when its numbers change; stale versions age out of the LRU.
+    """
+
+    def __init__(self, max_bytes=CHART_CACHE_BYTES):
+        self.max_bytes = max_bytes
+        self._entries = OrderedDict()
+        self._bytes = 0
+        self._lock = threading.Lock()
+        self.hits = self.misses = self.evictions = 0
+
+    def get_or_render(self, key, render):
+        with self._lock:
+            png = self._entries.get(key)
+            if png is not None:
+                self._entries.move_to_end(key)
+                self.hits += 1
+                return png
+            self.misses += 1
+        png = render()
+        with self._lock:
+            if key not in self._entries:
+                self._entries[key] = png
+                self._bytes += len(png)
+                while self._bytes > self.max_bytes and len(self._entries) > 1:
+                    _, evicted = self._entries.popitem(last=False)
+                    self._bytes -= len(evicted)
+                    self.evictions += 1
+        return png
+
+    def stats(self):
+        with self._lock:
+            lookups = self.hits + self.misses
+            return {"size": len(self._entries), "bytes": self._bytes, "max_bytes": self.max_bytes,
+                    "hits": self.hits, "misses": self.misses, "evictions": self.evictions,
+                    "hit_ratio": round(self.hits / lookups, 3) if lookups else None}
+
+
+chart_cache = ChartCache()
+
+def chart_labels(index):
+    return [d.strftime("%Y-%m-%d") if hasattr(d, "strftime") else str(d) for d in index]
+
+def data_version(data):
+    return hashlib.sha1(pd.util.hash_pandas_object(data).values.tobytes()).hexdigest()[:16]
+
+def figure_png(fig):
+    buffer = BytesIO()
+    fig.savefig(buffer, format="png")
+    return buffer.getvalue()
+
+def series_points(data):
+    # [{"date": ..., <column>: value}] with NaN as null, for charts drawn client-side
+    frame = data.to_frame() if isinstance(data, pd.Series) else data
+    frame = frame.astype(float).round(4)
+    frame = frame.astype(object).where(frame.notna(), None)
+    return [{"date": date, **row} for date, row in zip(chart_labels(frame.index), frame.to_dict("records"))]
+
+def chart_response(request, ticker, kind, data, render, chart_format):
+    """Serve data as a JSON series, a cached raw PNG with ETag/304, or the legacy base64 JSON."""
+    if chart_format == "series":
+        return {"ticker": ticker, "kind": kind, "points": series_points(data)}
+
+    key = (ticker.upper(), kind, data_version(data))
+    etag = f'"{kind}-{key[0]}-{key[2]}"'
+    if chart_format == "png" and etag in request.headers.get("if-none-match", ""):
+        return Response(status_code=304, headers={"ETag": etag})
+
+    def render_traced():
+        with span("matplotlib", kind):
+            return render(ticker, data)
+
+    png = chart_cache.get_or_render(key, render_traced)
+    if chart_format == "png":
+        return Response(png, media_type="image/png", headers={"ETag": etag, "Cache-Control": "no-cache"})
+    return {"image": base64.b64encode(png).decode("utf-8")}
+
+def render_earnings_chart(ticker, net_income):
+    fig = new_figure()
+    ax = fig.subplots()
+    ax.bar(chart_labels(net_income.index), net_income.values)
+    ax.set_title(f"{ticker} Net Income (Last 5 Periods)")
+    ax.set_ylabel("USD")
+    ax.set_xlabel("Date")
+    fig.tight_layout()
+    return figure_png(fig)
+
+def render_forecast_chart(ticker, hist):
+    fig = new_figure()
+    ax = fig.subplots()
+    ax.plot(hist.index, hist["Close"], label="Close Price")
+    ax.plot(hist.index, hist["Forecast"], label="7-day SMA Forecast")
+    ax.set_title(f"{ticker} Forecast (Close vs 7-day SMA)")
+    ax.set_ylabel("Stock Price (USD)")
+    ax.set_xlabel("Date")
+    ax.legend()
+    fig.autofmt_xdate()
+    fig.tight_layout()
+    return figure_png(fig)
+
 # === Core API ===
 class QueryRequest(BaseModel):
     username: str
@@ -115,72 +1521,48 @@ class PortfolioInfo(BaseModel):
     horizon: str  # Expected values: "short-term", "medium-term", "long-term"
     sectors: List[str]  # e.g. ["technology", "healthcare"]
 
-def recommend_stocks_based_on_portfolio(username):
-    # Load user portfolio
-    blob_text = get_gcs_blob_text(f"portfolios/{username}.json")
+def build_recommendation(username, blob_text):
+    # Returns reply parts (prefix, llm_prompt, suffix); llm_prompt is None when no LLM call is needed
     if not blob_text:
-        return "❌ Please complete your portfolio before requesting stock recommendations."
+        return "❌ Please complete your portfolio before requesting stock recommendations.", None, ""
 
     portfolio = json.loads(blob_text)
 
-    # Load enriched_predictions.csv from GCS
-    client = storage.Client()
-    bucket = client.bucket(gcs_bucket)
-    blob = bucket.blob("enriched_predictions.csv")
-    df = pd.read_csv(io.StringIO(blob.download_as_text()))
-    df.columns = df.columns.str.strip()  # Strip BOMs and whitespace
-    print("DEBUG COLUMNS:", df.columns.tolist())
-
-    # Rename 'Ticker' to 'stock' for consistency
-    df.rename(columns={"Ticker": "stock"}, inplace=True)
+    # Top 5 across the selected sectors for the portfolio's risk level, merged from the pre-ranked top-K lists
+    result = predictions.top(portfolio["sectors"], n=5, risk=portfolio.get("risk", DEFAULT_RISK))
 
-    # Add a simple score based on predicted close (this can be improved)
-    df["score"] = df["Predicted_Close"]
-
-    # Filter by portfolio sectors (case insensitive)
-    filtered_df = df[df["GICS Sector"].str.lower().isin([s.lower() for s in portfolio["sectors"]])]
-
-    if filtered_df.empty:
-        return "❌ No matching stocks found for your selected sectors."
-
-    # Sort and pick top 5 stocks
-    top_stocks = filtered_df.sort_values(by="score", ascending=False).head(5)
+    if not result:
+        return "❌ No matching stocks found for your selected sectors.", None, ""
 
     # Prepare reasoning prompt for LLM
-    stock_names = top_stocks["stock"].tolist()
+    stock_names = [r["stock"] for r in result]
     reasoning_prompt = (
         f"User portfolio: {portfolio}. Stocks: {stock_names}. "
         f"Explain briefly why each stock is recommended and provide its current price."
     )
 
-    llm_feedback = get_llm_response(reasoning_prompt)
-
-    # Generate report and save to GCS
-    result = top_stocks[["stock", "score"]].to_dict(orient="records")
+    # Render the report and save it with the recommendations in the background
     generate_pdf_report(username, result)
-    write_to_gcs(f"recommendations/{username}.json", json.dumps(result))
 
-    reply = (
+    prefix = (
         "**Your Portfolio**\n"
         f"{json.dumps(portfolio, indent=2)}\n\n"
         "**Top 5 Recommended Stocks:**\n" +
         "\n".join([f"- {r['stock']} (Score: {r['score']:.2f})" for r in result]) +
-        f"\n\n🧠 LLM Insights:\n{llm_feedback}\n\n📄 Your report is saved in the Reports section."
+        "\n\n🧠 LLM Insights:\n"
     )
-    return reply
-
+    return prefix, reasoning_prompt, "\n\n📄 Your report is being saved to the Reports section."
 
 
 @app.get("/portfolio")
 def get_portfolio(username: str):
-    client = storage.Client()
-    bucket = client.bucket(gcs_bucket)
-    blob = bucket.blob(f"portfolios/{username}.json")
-    if not blob.exists():
+    text = get_gcs_blob_text(f"portfolios/{username}.json")
+    if text is None:
         return JSONResponse(status_code=404, content={"error": "Portfolio not found"})
-    return json.loads(blob.download_as_text())
+    return json.loads(text)
 
-def generate_pdf_report(username, recommended_stocks):
+def render_pdf_report(username, recommended_stocks):
+    from fpdf import FPDF
     pdf = FPDF()
     pdf.add_page()
     pdf.set_font("Arial", size=12)
@@ -188,43 +1570,248 @@ def generate_pdf_report(username, recommended_stocks):
     pdf.ln(10)
     for stock in recommended_stocks:
         pdf.cell(200, 10, txt=f"{stock['stock']}: Score {stock['score']:.2f}", ln=True)
-    client = storage.Client()
-    bucket = client.bucket(gcs_bucket)
-    blob = bucket.blob(f"reports/{username}_report.pdf")
-    blob.upload_from_string(pdf.output(dest='S').encode("latin-1"), content_type="application/pdf")
+    return pdf.output(dest='S').encode("latin-1")
+
+def generate_pdf_report(username, recommended_stocks):
+    # Queued; returns the job status immediately
+    return report_jobs.submit(username, recommended_stocks)
+
+# === Report Jobs ===
+REPORT_WORKERS = int(os.getenv("REPORT_WORKERS", "2"))
+REPORT_BATCH_SIZE = int(os.getenv("REPORT_BATCH_SIZE", "8"))
+REPORT_CACHE_DIR = os.getenv("REPORT_CACHE_DIR", os.path.join(tempfile.gettempdir(), "smartinvest_reports"))
+REPORT_CACHE_MAX_BYTES = int(os.getenv("REPORT_CACHE_MAX_BYTES", str(200 * 1024 * 1024)))
+REPORT_CACHE_MAX_AGE = int(os.getenv("REPORT_CACHE_MAX_AGE", str(7 * 24 * 3600)))
+REPORT_CACHE_GRACE = 60  # seconds a new file is never evicted, so a download about to open it still finds it
+REPORT_JOB_HISTORY = 1000  # finished job statuses kept for polling
+REPORT_WAIT_SECONDS = 5.0  # how long a download waits for a pending report
+
+
+def report_blob(username):
     return f"reports/{username}_report.pdf"
 
+def report_cache_path(username, generation):
+    return os.path.join(REPORT_CACHE_DIR, f"{quote_plus(username)}-{generation}.pdf")
+
+def cache_report(username, generation, data):
+    # Local copies named <user>-<generation>.pdf. The new file is written first, then all but
+    # the two newest generations are removed: a FileResponse may still be about to open the previous one
+    os.makedirs(REPORT_CACHE_DIR, exist_ok=True)
+    path = report_cache_path(username, generation)
+    tmp_path = f"{path}.{threading.get_ident()}.tmp"
+    with open(tmp_path, "wb") as f:
+        f.write(data)
+    os.replace(tmp_path, path)
+    pattern = re.compile(re.escape(quote_plus(username)) + r"-(\d+)\.pdf")
+    matches = (pattern.fullmatch(name) for name in os.listdir(REPORT_CACHE_DIR))
+    cached = sorted((int(match.group(1)), match.group(0)) for match in matches if match)
+    for _, name in cached[:-2]:
+        try:
+            os.remove(os.path.join(REPORT_CACHE_DIR, name))
+        except FileNotFoundError:
+            pass  # removed by a concurrent call
+    prune_report_cache()
+    return path
+
+def prune_report_cache(max_bytes=REPORT_CACHE_MAX_BYTES, max_age=REPORT_CACHE_MAX_AGE):
+    # Oldest files first: evicted while older than max_age or while the directory is over max_bytes
+    files = []
+    for entry in os.scandir(REPORT_CACHE_DIR):
+        try:
+            stat = entry.stat()
+        except FileNotFoundError:
+            continue
+        files.append((stat.st_mtime, stat.st_size, entry.path))
+    files.sort()
+    now, total = time.time(), sum(size for _, size, _ in files)
+    for mtime, size, path in files:
+        age = now - mtime
+        if age < REPORT_CACHE_GRACE or (age <= max_age and total <= max_bytes):
+            break
+        try:
+            os.remove(path)
+        except FileNotFoundError:
+            pass
+        total -= size
+
+def report_file(username):
+    # Local path of the user's current PDF, re-downloaded only when the blob generation changed
+    generation = store.generation(report_blob(username))
+    if not generation:
+        return None
+    path = report_cache_path(username, generation)
+    if os.path.exists(path):
+        return path
+    data, generation = store.read_with_generation(report_blob(username))
+    return None if data is None else cache_report(username, generation, data)
+
+
+class ReportJobs:
+    """Background queue that renders recommendation PDFs and uploads them with the recommendations JSON.
+
+    submit() returns at once. Workers drain up to batch_size jobs and upload all of their
+    files in one write_many. A user's queued job is superseded by a newer one, so a burst
+    of recommendations renders only the latest.
+    """
+
+    def __init__(self, store, workers=REPORT_WORKERS, batch_size=REPORT_BATCH_SIZE):
+        self.store = store
+        self.workers = workers
+        self.batch_size = batch_size
+        self._queue = queue.Queue()
+        self._jobs = OrderedDict()  # job id -> status, oldest first
+        self._done = {}  # job id -> Event, set when the job leaves queued/running
+        self._latest = {}  # username -> newest job id
+        self._lock = threading.Lock()
+        self._threads = []
+
+    def _start(self):
+        with self._lock:
+            while len(self._threads) < self.workers:
+                thread = threading.Thread(target=self._work, name=f"reports-{len(self._threads)}", daemon=True)
+                thread.start()
+                self._threads.append(thread)
+
+    def submit(self, username, recommended_stocks):
+        job = {"id": uuid.uuid4().hex, "username": username, "status": "queued",
+               "created_at": datetime.utcnow().isoformat(), "finished_at": None, "error": None}
+        with self._lock:
+            self._jobs[job["id"]] = job
+            self._done[job["id"]] = threading.Event()
+            self._latest[username] = job["id"]
+            while len(self._jobs) > REPORT_JOB_HISTORY:
+                old_id, _ = self._jobs.popitem(last=False)
+                self._done.pop(old_id, None)
+        self._start()
+        self._queue.put((job["id"], recommended_stocks))
+        return dict(job)
+
+    def _claim(self, job_id):
+        with self._lock:
+            job = self._jobs.get(job_id)
+            if job is None:
+                return None
+            if self._latest.get(job["username"]) != job_id:
+                self._finish_locked(job, "superseded")
+                return None
+            job["status"] = "running"
+            return job
+
+    def _finish_locked(self, job, status, error=None):
+        job.update(status=status, error=error, finished_at=datetime.utcnow().isoformat())
+        event = self._done.get(job["id"])
+        if event is not None:
+            event.set()
+
+    def _finish(self, job, status, error=None):
+        with self._lock:
+            self._finish_locked(job, status, error)
+
+    def _work(self):
+        while True:
+            batch = [self._queue.get()]
+            while len(batch) < self.batch_size:
+                try:
+                    batch.append(self._queue.get_nowait())
+                except queue.Empty:
+                    break
+            try:
+                self._run(batch)
+            except Exception as e:
+                # The worker must outlive any bug in a batch; its unfinished jobs are failed, not left running
+                print(f"⚠️ Report batch of {len(batch)} jobs failed: {e}")
+                with self._lock:
+                    for job_id, _ in batch:
+                        job = self._jobs.get(job_id)
+                        if job is not None and job["status"] in ("queued", "running"):
+                            self._finish_locked(job, "failed", str(e))
+
+    def _run(self, batch):
+        rendered, items = [], []
+        for job_id, stocks in batch:
+            job = self._claim(job_id)
+            if job is None:
+                continue
+            try:
+                pdf = render_pdf_report(job["username"], stocks)
+            except Exception as e:
+                self._finish(job, "failed", str(e))
+                continue
+            rendered.append((job, pdf))
+            items += [(report_blob(job["username"]), pdf, "application/pdf"),
+                      (f"recommendations/{job['username']}.json", json.dumps(stocks), None)]
+        if not rendered:
+            return
+
+        try:
+            generations = self.store.write_many(items)
+        except Exception as e:
+            print(f"⚠️ Report upload failed for {len(rendered)} jobs: {e}")
+            for job, _ in rendered:
+                self._finish(job, "failed", str(e))
+            return
+        for (job, pdf), generation in zip(rendered, generations[::2]):
+            try:
+                cache_report(job["username"], generation, pdf)
+            except OSError as e:
+                # Uploaded; only the local copy is missing and report_file refetches it
+                print(f"⚠️ Could not cache report for {job['username']}: {e}")
+            except Exception as e:
+                print(f"⚠️ Report job for {job['username']} failed after upload: {e}")
+                self._finish(job, "failed", str(e))
+                continue
+            self._finish(job, "done")
+
+    def status(self, job_id):
+        with self._lock:
+            job = self._jobs.get(job_id)
+            return dict(job) if job is not None else None
+
+    def latest(self, username):
+        with self._lock:
+            job_id = self._latest.get(username)
+        return self.status(job_id) if job_id else None
+
+    def wait(self, job_id, timeout):
+        event = self._done.get(job_id)
+        return event is None or event.wait(timeout)
 
 
+report_jobs = ReportJobs(store)
+
+@app.get("/reports/jobs/{job_id}")
+def get_report_job(job_id: str):
+    job = report_jobs.status(job_id)
+    if job is None:
+        return JSONResponse(status_code=404, content={"error": "Unknown report job"})
+    return job
+
 @app.get("/reports/{username}")
 def get_user_report(username: str):
-    client = storage.Client()
-    bucket = client.bucket(gcs_bucket)
-    blob = bucket.blob(f"reports/{username}_report.pdf")
+    # A report still being rendered is worth a short wait; it is usually ready in milliseconds
+    job = report_jobs.latest(username)
+    if job is not None and job["status"] in ("queued", "running") and not report_jobs.wait(job["id"], REPORT_WAIT_SECONDS):
+        return JSONResponse(status_code=503, headers={"Retry-After": "2"},
+                            content={"error": "Report is still being generated", "job": report_jobs.status(job["id"])})
 
-    if blob.exists():
-        # ✅ Create a temporary file in a safe, cross-platform way
-        with tempfile.NamedTemporaryFile(delete=False, suffix=".pdf") as tmp_file:
-            blob.download_to_filename(tmp_file.name)
-            tmp_path = tmp_file.name
+    path = report_file(username)
+    if path is not None:
+        # Served from the local cache; the file is kept and reused until the report changes
+        return FileResponse(path, media_type="application/pdf", filename=f"{username}_report.pdf")
 
-        return FileResponse(tmp_path, media_type="application/pdf", filename=f"{username}_report.pdf")
-    
     return JSONResponse(status_code=404, content={"error": "Report not generated yet"})
 
 @app.get("/recommendations/{username}")
 def get_recommendations(username: str):
-    client = storage.Client()
-    bucket = client.bucket(gcs_bucket)
-    blob = bucket.blob(f"recommendations/{username}.json")
-    if not blob.exists():
+    text = get_gcs_blob_text(f"recommendations/{username}.json")
+    if text is None:
         return JSONResponse(status_code=404, content={"error": "No recommendations yet"})
-    return json.loads(blob.download_as_text())
+    return json.loads(text)
 
 
 @app.get("/company")
 def company_overview(ticker: str):
-    info = yf.Ticker(ticker).info
+    info = market_data.info(ticker)
     return {
         "name": info.get("shortName", ticker),
         "sector": info.get("sector", "N/A"),
@@ -235,10 +1822,9 @@ def company_overview(ticker: str):
     }
 
 @app.get("/earnings")
-def earnings_chart(ticker: str = Query(...)):
+def earnings_chart(request: Request, ticker: str = Query(...), chart_format: ChartFormat = Query("base64", alias="format")):
     try:
-        t = yf.Ticker(ticker)
-        df = t.income_stmt
+        df = market_data.income_stmt(ticker)
 
         if df is None or df.empty:
             return JSONResponse(status_code=404, content={"error": "Earnings data not available"})
@@ -247,40 +1833,31 @@ def earnings_chart(ticker: str = Query(...)):
         net_income = df["Net Income"] if "Net Income" in df.columns else df.iloc[:, 0]
         net_income = net_income[-5:]
 
-        # Plot and convert to base64
-        fig, ax = plt.subplots()
-        net_income.plot(kind='bar', ax=ax)
-        ax.set_title(f"{ticker} Net Income (Last 5 Periods)")
-        ax.set_ylabel("USD")
-        ax.set_xlabel("Date")
-        plt.tight_layout()
-
-        buffer = BytesIO()
-        plt.savefig(buffer, format="png")
-        plt.close(fig)
-        buffer.seek(0)
-        img_str = base64.b64encode(buffer.read()).decode("utf-8")
-
-        return {"image": img_str}
+        return chart_response(request, ticker, "earnings", net_income, render_earnings_chart, chart_format)
     except Exception as e:
         return JSONResponse(status_code=500, content={"error": str(e)})
 
-# === Utility Functions ===
-def detect_intent_with_gpt(query):
-    return detect_intent_with_llama(query)
+@app.get("/cache/stats")
+def cache_stats():
+    return {**market_data.stats(), "sentiment": sentiment_engine.stats(), "charts": chart_cache.stats(),
+            "finnhub": {"alerts": alerts_feed.stats(), "calendar": calendar_feed.stats()},
+            "history": session_history.stats(), "llm": llm_cache.stats()}
 
+# === Utility Functions ===
 def resolve_targets_to_tickers(targets):
     tickers = []
     for target in targets:
         lower_target = target.lower()
-        if lower_target in sp500_lookup:
-            tickers.append(sp500_lookup[lower_target])
-        elif target.upper() in sp500_lookup.values():
+        matched = universe.index.best(target)
+        if lower_target in universe.lookup:
+            tickers.append(universe.lookup[lower_target])
+        elif target.upper() in universe.index.symbols:
             tickers.append(target.upper())
+        elif matched:
+            tickers.append(matched)
         else:
             try:
-                t = yf.Ticker(target)
-                info = t.info
+                info = market_data.info(target)
                 if 'symbol' in info:
                     tickers.append(info['symbol'])
             except:
@@ -291,8 +1868,7 @@ def resolve_targets_to_tickers(targets):
 
 def get_stock_price(ticker):
     try:
-        stock = yf.Ticker(ticker)
-        hist = stock.history(period="1d")
+        hist = market_data.history(ticker, "1d")
 
         if hist is None or hist.empty or "Close" not in hist.columns:
             return f"❌ No price data available for {ticker}."
@@ -306,50 +1882,49 @@ def get_stock_price(ticker):
 
 
 def extract_ticker(query):
-    query_lower = query.lower()
-    words = re.findall(r'\b\w+\b', query_lower)
-    for symbol in sp500_lookup.values():
-        if symbol.lower() in words:
-            return symbol
-    for name, symbol in sp500_lookup.items():
-        if any(word in name for word in words):
-            return symbol
-    return None
-
-def get_news_summary(query):
+    return universe.index.best(query)
+
+def news_search_url(query):
     ticker = extract_ticker(query)
     if not ticker:
-        return "Could not identify target for news summary."
-    company = next((name.title() for name, sym in sp500_lookup.items() if sym == ticker), ticker)
+        return None, None
+    company = universe.index.symbol_to_name.get(ticker, ticker)
     search_query = quote_plus(f"{company} stock")
-    url = f"https://news.google.com/rss/search?q={search_query}&hl=en-US&gl=US&ceid=US:en"
-    feed = feedparser.parse(url)
-    headlines = [entry.title for entry in feed.entries[:5]]
-    prompt = f"Summarize these headlines about {company} stock:\n" + "\n".join(headlines)
-    return get_llama_response(prompt)
+    return company, f"https://news.google.com/rss/search?q={search_query}&hl=en-US&gl=US&ceid=US:en"
 
+def feed_headlines(feed):
+    return [entry.title for entry in feed.entries[:5]] if feed is not None else []
 
-def compare_two_stocks(tickers):
-    t1, t2 = tickers
-    data = {}
-    for t in [t1, t2]:
-        info = yf.Ticker(t)
-        price = info.fast_info.get("lastPrice", "N/A")
-        pe = info.info.get("trailingPE", "N/A")
-        mc = info.info.get("marketCap", "N/A")
-        data[t] = {
-            "price": price,
-            "pe_ratio": pe,
-            "market_cap": f"${round(mc / 1e9, 2)}B" if mc else "N/A"
-        }
-    prompt = (
+def build_news_summary(company, headlines, sentiments):
+    if company is None:
+        return "Could not identify target for news summary.", None, ""
+    # Cached per company and headline set, whatever their order
+    headline_set = hashlib.sha1("\n".join(sorted(normalize_prompt(h) for h in headlines)).encode("utf-8")).hexdigest()
+    prompt = LLMPrompt(f"Summarize these headlines about {company} stock:\n" + "\n".join(headlines),
+                       f"summary:{company.lower()}:{headline_set}")
+    suffix = f"\n\n🧠 Headline sentiment by FinBERT: {summarize_sentiments(sentiments)}" if sentiments else ""
+    return "", prompt, suffix
+
+
+def stock_snapshot(ticker):
+    info = market_data.info(ticker)
+    mc = info.get("marketCap", "N/A")
+    return {
+        "price": market_data.quote(ticker).get("lastPrice", "N/A"),
+        "pe_ratio": info.get("trailingPE", "N/A"),
+        "market_cap": f"${round(mc / 1e9, 2)}B" if mc else "N/A"
+    }
+
+def build_comparison(t1, t2, data):
+    # The outlook is cached per pair in either order; snapshot numbers move too often to key on
+    prompt = LLMPrompt(
         f"Compare {t1} and {t2} stocks:\n\n"
         f"{t1}:\nPrice: {data[t1]['price']}, P/E: {data[t1]['pe_ratio']}, Market Cap: {data[t1]['market_cap']}\n\n"
         f"{t2}:\nPrice: {data[t2]['price']}, P/E: {data[t2]['pe_ratio']}, Market Cap: {data[t2]['market_cap']}\n\n"
-        "Provide a short investment outlook comparison."
+        "Provide a short investment outlook comparison.",
+        "compare:" + "|".join(sorted([t1.upper(), t2.upper()])),
     )
-    gpt_summary = get_llama_response(prompt)
-    response = (
+    prefix = (
         f"📊 STOCK COMPARISON RESULT\n"
         f"\n{t1}:\n"
         f"  • Price: ${data[t1]['price']}\n"
@@ -359,100 +1934,810 @@ def compare_two_stocks(tickers):
         f"  • Price: ${data[t2]['price']}\n"
         f"  • P/E Ratio: {data[t2]['pe_ratio']}\n"
         f"  • Market Cap: {data[t2]['market_cap']}\n"
-        f"\n🧠 INVESTMENT OUTLOOK SUMMARY:\n\n{gpt_summary.strip()}"
+        f"\n🧠 INVESTMENT OUTLOOK SUMMARY:\n\n"
     )
+    return prefix, prompt, ""
 
-    return response
 
-
-def get_sentiment_finbert(text):
-    result = sentiment_model(text)[0]
+def format_sentiment(result):
     return f"\U0001f9e0 Sentiment by FinBERT: **{result['label']}** (Confidence: {result['score']:.2f})"
-def get_llm_response(query):
-    return get_llama_response(query)
 
+def summarize_sentiments(results):
+    counts = Counter(r["label"].lower() for r in results)
+    return ", ".join(f"{counts[label]} {label}" for label in ("positive", "neutral", "negative"))
+
+
+GROQ_URL = "https://api.groq.com/openai/v1/chat/completions"
+GROQ_MODEL = "llama3-70b-8192"  # Groq model name for LLaMA 3 70B
+INTENT_SYSTEM_PROMPT = (
+    "You are a financial assistant that classifies user queries into one of the following types:\n"
+    "- price: if the query asks about current stock prices\n"
+    "- summary: if the query asks for recent stock/company news\n"
+    "- sentiment: if the query asks for market or company sentiment\n"
+    "- compare: if the query compares two companies\n"
+    "- general: anything else\n"
+    "\nReturn a JSON with two keys: 'intent' and 'targets' (list of stock names or symbols).\n"
+    "Example: {\"intent\": \"price\", \"targets\": [\"Tesla\"]}"
+)
 
-def get_llama_response(query):
-    headers = {
+def groq_headers():
+    return {
         "Authorization": f"Bearer {os.getenv('GROQ_API_KEY')}",
         "Content-Type": "application/json"
     }
-    payload = {
-        "model": "llama3-70b-8192",  # Groq model name for LLaMA 3 70B
-        "messages": [
-            {"role": "system", "content": "You are a helpful financial assistant."},
-            {"role": "user", "content": query}
-        ]
-    }
-    response = requests.post("https://api.groq.com/openai/v1/chat/completions", headers=headers, json=payload)
-    if response.status_code == 200:
-        return response.json()["choices"][0]["message"]["content"]
-    else:
-        return f"❌ Error from Groq: {response.status_code} - {response.text}"
-
 
-def detect_intent_with_llama(query):
-    headers = {
-        "Authorization": f"Bearer {os.getenv('GROQ_API_KEY')}",
-        "Content-Type": "application/json"
-    }
-    system_prompt = (
-        "You are a financial assistant that classifies user queries into one of the following types:\n"
-        "- price: if the query asks about current stock prices\n"
-        "- summary: if the query asks for recent stock/company news\n"
-        "- sentiment: if the query asks for market or company sentiment\n"
-        "- compare: if the query compares two companies\n"
-        "- general: anything else\n"
-        "\nReturn a JSON with two keys: 'intent' and 'targets' (list of stock names or symbols).\n"
-        "Example: {\"intent\": \"price\", \"targets\": [\"Tesla\"]}"
-    )
-    payload = {
-        "model": "llama3-70b-8192",
+def groq_payload(system_prompt, query):
+    return {
+        "model": GROQ_MODEL,
         "messages": [
             {"role": "system", "content": system_prompt},
             {"role": "user", "content": query}
         ]
     }
-    response = requests.post("https://api.groq.com/openai/v1/chat/completions", headers=headers, json=payload)
+
+def parse_groq_reply(status_code, text):
+    if status_code == 200:
+        return json.loads(text)["choices"][0]["message"]["content"]
+    return f"❌ Error from Groq: {status_code} - {text}"
+
+def parse_intent(text):
     try:
-        result = response.json()
-        raw = result["choices"][0]["message"]["content"].strip()
+        raw = json.loads(text)["choices"][0]["message"]["content"].strip()
         parsed = json.loads(raw)
         return parsed.get("intent", "general"), parsed.get("targets", [])
     except Exception as e:
         return "general", []
 
 
+# === LLM Response Cache ===
+ASSISTANT_SYSTEM_PROMPT = "You are a helpful financial assistant."
+LLM_CACHE_TTL = int(os.getenv("LLM_CACHE_TTL", "900"))
+LLM_CACHE_SIZE = int(os.getenv("LLM_CACHE_SIZE", "2048"))
+LLM_CACHE_DB = os.getenv("LLM_CACHE_DB", "")  # optional SQLite disk tier, shared by workers; empty disables it
+
+
+class LLMPrompt(str):
+    """A prompt that carries its own normalized cache key (e.g. a sorted ticker pair)."""
+
+    def __new__(cls, text, cache_key):
+        prompt = super().__new__(cls, text)
+        prompt.cache_key = cache_key
+        return prompt
+
+
+def normalize_prompt(text):
+    return " ".join(text.lower().split())
+
+def groq_total_tokens(text):
+    try:
+        return int(json.loads(text).get("usage", {}).get("total_tokens", 0))
+    except (ValueError, AttributeError):
+        return 0
+
+
+class LLMCache:
+    """Successful Groq replies keyed by model, system prompt and normalized prompt, kept for ttl seconds.
+
+    An LRU of maxsize entries sits in front of an optional SQLite tier that survives restarts.
+    tokens_saved sums the usage reported for each reply every time it is served from cache.
+    """
+
+    def __init__(self, ttl=LLM_CACHE_TTL, maxsize=LLM_CACHE_SIZE, db_path=LLM_CACHE_DB):
+        self.ttl = ttl
+        self.maxsize = maxsize
+        self.db_path = db_path
+        self._data = OrderedDict()  # key -> (expires_at, reply, tokens)
+        self._lock = threading.Lock()
+        self._db = None
+        self.hits = self.disk_hits = self.misses = self.tokens_saved = 0
+
+    def key(self, system_prompt, prompt):
+        semantic = getattr(prompt, "cache_key", None) or normalize_prompt(prompt)
+        return hashlib.sha1(f"{GROQ_MODEL}\n{system_prompt}\n{semantic}".encode("utf-8")).hexdigest()
+
+    def _connect(self):
+        if self._db is None:
+            if os.path.dirname(self.db_path):
+                os.makedirs(os.path.dirname(self.db_path), exist_ok=True)
+            db = sqlite3.connect(self.db_path, check_same_thread=False)
+            db.execute("CREATE TABLE IF NOT EXISTS llm_cache (key TEXT PRIMARY KEY, reply TEXT, tokens INTEGER, expires_at REAL)")
+            self._db = db
+        return self._db
+
+    def _remember(self, key, expires_at, reply, tokens):
+        self._data[key] = (expires_at, reply, tokens)
+        self._data.move_to_end(key)
+        while len(self._data) > self.maxsize:
+            self._data.popitem(last=False)
+
+    def get(self, key):
+        now = time.time()
+        with self._lock:
+            entry = self._data.get(key)
+            if entry is not None and entry[0] > now:
+                self._data.move_to_end(key)
+                self.hits += 1
+                self.tokens_saved += entry[2]
+                return entry[1]
+            if self.db_path:
+                try:
+                    row = self._connect().execute(
+                        "SELECT expires_at, reply, tokens FROM llm_cache WHERE key = ? AND expires_at > ?", (key, now)
+                    ).fetchone()
+                except sqlite3.Error as e:
+                    print(f"⚠️ LLM cache read failed: {e}")
+                    row = None
+                if row is not None:
+                    self._remember(key, *row)
+                    self.disk_hits += 1
+                    self.tokens_saved += row[2]
+                    return row[1]
+            self.misses += 1
+            return None
+
+    def put(self, key, reply, tokens):
+        expires_at = time.time() + self.ttl
+        with self._lock:
+            self._remember(key, expires_at, reply, tokens)
+            if self.db_path:
+                try:
+                    with self._connect() as db:
+                        db.execute("INSERT OR REPLACE INTO llm_cache VALUES (?, ?, ?, ?)", (key, reply, tokens, expires_at))
+                        db.execute("DELETE FROM llm_cache WHERE expires_at <= ?", (time.time(),))
+                except sqlite3.Error as e:
+                    print(f"⚠️ LLM cache write failed: {e}")
+
+    def stats(self):
+        with self._lock:
+            lookups = self.hits + self.disk_hits + self.misses
+            return {
+                "size": len(self._data),
+                "maxsize": self.maxsize,
+                "ttl": self.ttl,
+                "disk": bool(self.db_path),
+                "hits": self.hits,
+                "disk_hits": self.disk_hits,
+                "misses": self.misses,
+                "hit_ratio": round((self.hits + self.disk_hits) / lookups, 4) if lookups else 0.0,
+                "tokens_saved": self.tokens_saved,
+            }
+
+
+llm_cache = LLMCache()
+
+
+# === Outbound HTTP ===
+# Groq, Finnhub and news feeds all go through one sync/async client pair, so every call
+# shares keep-alive pools, deadlines, retries, per-key rate limits and circuit breakers
+HTTP_TIMEOUT = float(os.getenv("HTTP_TIMEOUT", "30"))  # default total deadline per call, retries included
+HTTP_CONNECT_TIMEOUT = float(os.getenv("HTTP_CONNECT_TIMEOUT", "5"))
+HTTP_MAX_CONNECTIONS = int(os.getenv("HTTP_MAX_CONNECTIONS", "100"))
+HTTP_MAX_KEEPALIVE = int(os.getenv("HTTP_MAX_KEEPALIVE", "20"))
+HTTP_RETRIES = int(os.getenv("HTTP_RETRIES", "2"))
+HTTP_BACKOFF = float(os.getenv("HTTP_BACKOFF", "0.5"))
+RETRY_STATUSES = {429, 500, 502, 503, 504}
+BREAKER_FAILURES = int(os.getenv("BREAKER_FAILURES", "5"))
+BREAKER_RESET_SECONDS = float(os.getenv("BREAKER_RESET_SECONDS", "30"))
+GROQ_REQUESTS_PER_MINUTE = int(os.getenv("GROQ_REQUESTS_PER_MINUTE", "30"))
+FINNHUB_REQUESTS_PER_MINUTE = int(os.getenv("FINNHUB_REQUESTS_PER_MINUTE", "60"))
+
+
+class CircuitOpenError(httpx.HTTPError):
+    """Raised without contacting the host while its circuit breaker is open."""
+
+
+class RateLimitedError(httpx.HTTPError):
+    """Raised when a key's token bucket cannot supply a request slot before the call deadline."""
+
+
+class TokenBucket:
+    """Thread-safe token bucket refilled at `rate` tokens per second, holding at most `capacity`."""
+
+    def __init__(self, rate, capacity):
+        self.rate = rate
+        self.capacity = capacity
+        self._tokens = capacity
+        self._updated = time.monotonic()
+        self._lock = threading.Lock()
+        self.waited = 0.0
+
+    def reserve(self, max_wait):
+        # Takes a token and returns how long to wait before using it; None (nothing taken) if over max_wait
+        with self._lock:
+            now = time.monotonic()
+            self._tokens = min(self.capacity, self._tokens + (now - self._updated) * self.rate)
+            self._updated = now
+            wait = max(0.0, (1 - self._tokens) / self.rate)
+            if wait > max_wait:
+                return None
+            self._tokens -= 1
+            self.waited += wait
+            return wait
+
+
+class CircuitBreaker:
+    """Opens after `failures` consecutive failures; once reset_after seconds pass, a single
+    trial call is let through (half-open) and its result closes or re-opens it. Other
+    callers are rejected until then; a trial with no result after reset_after is replaced."""
+
+    def __init__(self, failures=BREAKER_FAILURES, reset_after=BREAKER_RESET_SECONDS):
+        self.failures = failures
+        self.reset_after = reset_after
+        self.state = "closed"
+        self._consecutive = 0
+        self._opened_at = 0.0
+        self._probe_at = None  # start of the half-open trial call in flight
+        self._lock = threading.Lock()
+        self.rejected = 0
+
+    def allow(self):
+        with self._lock:
+            now = time.monotonic()
+            if self.state == "open":
+                if now - self._opened_at < self.reset_after:
+                    self.rejected += 1
+                    return False
+                self.state = "half-open"
+            elif self.state == "half-open" and self._probe_at is not None and now - self._probe_at < self.reset_after:
+                self.rejected += 1
+                return False
+            if self.state == "half-open":
+                self._probe_at = now
+            return True
+
+    def release(self):
+        # The admitted call was never made (e.g. no rate-limit slot); let the next caller probe
+        with self._lock:
+            self._probe_at = None
+
+    def record(self, ok):
+        with self._lock:
+            self._probe_at = None
+            if ok:
+                self.state = "closed"
+                self._consecutive = 0
+                return
+            self._consecutive += 1
+            if self.state == "half-open" or self._consecutive >= self.failures:
+                self.state = "open"
+                self._opened_at = time.monotonic()
+
+
+class OutboundClient:
+    """Shared sync and async httpx clients with deadlines, retries, rate limits and circuit breakers.
+
+    httpx keeps a keep-alive pool per host inside each client. A call gets `deadline` seconds
+    in total: 429/5xx responses and transport errors are retried with jittered exponential
+    backoff (or the server's Retry-After) while time remains. Rate limits are token buckets
+    registered per API key with limit(); breakers are per host and see one outcome per call,
+    whatever its retries did. Pass transport/async_transport
+    (e.g. httpx.MockTransport) to run against a mock server.
+    """
+
+    def __init__(self, transport=None, async_transport=None, retries=HTTP_RETRIES, backoff=HTTP_BACKOFF):
+        limits = httpx.Limits(max_connections=HTTP_MAX_CONNECTIONS, max_keepalive_connections=HTTP_MAX_KEEPALIVE)
+        timeout = httpx.Timeout(HTTP_TIMEOUT, connect=HTTP_CONNECT_TIMEOUT)
+        self.client = httpx.Client(limits=limits, timeout=timeout, transport=transport, follow_redirects=True)
+        self.async_client = httpx.AsyncClient(limits=limits, timeout=timeout, transport=async_transport,
+                                              follow_redirects=True)
+        self.retries = retries
+        self.backoff = backoff
+        self._limiters = {}  # key -> TokenBucket
+        self._breakers = {}  # host -> CircuitBreaker
+        self._lock = threading.Lock()
+        self.retried = 0
+
+    def limit(self, key, per_minute, burst=None):
+        self._limiters[key] = TokenBucket(per_minute / 60.0, burst or max(1, per_minute // 6))
+
+    def _breaker(self, url):
+        host = httpx.URL(url).host
+        with self._lock:
+            return self._breakers.setdefault(host, CircuitBreaker())
+
+    def _admit(self, url):
+        # The breaker is consulted once per logical call, not per retry
+        breaker = self._breaker(url)
+        if not breaker.allow():
+            raise CircuitOpenError(f"Circuit open for {httpx.URL(url).host}")
+        return breaker
+
+    def _reserve(self, limiter, deadline_at):
+        # Seconds to wait for a rate-limit slot; keys without a registered limit are unthrottled
+        bucket = self._limiters.get(limiter)
+        if bucket is None:
+            return 0.0
+        wait = bucket.reserve(max(0.0, deadline_at - time.monotonic()))
+        if wait is None:
+            raise RateLimitedError(f"No {limiter} request slot before the deadline")
+        return wait
+
+    @staticmethod
+    def _settle(breaker, ok):
+        # One outcome per logical call, from its last attempt; ok is None when no attempt was made
+        if ok is None:
+            breaker.release()
+        else:
+            breaker.record(ok)
+
+    def _timeout(self, deadline_at):
+        remaining = max(0.01, deadline_at - time.monotonic())
+        return httpx.Timeout(min(HTTP_TIMEOUT, remaining), connect=min(HTTP_CONNECT_TIMEOUT, remaining))
+
+    def _retry_delay(self, attempt, response, deadline_at):
+        # Seconds to sleep before retrying, or None when out of attempts or time
+        if attempt >= self.retries:
+            return None
+        delay = self.backoff * (2 ** attempt) * random.uniform(0.5, 1.5)
+        retry_after = response.headers.get("Retry-After", "") if response is not None else ""
+        if retry_after.isdigit():
+            delay = float(retry_after)
+        if time.monotonic() + delay >= deadline_at:
+            return None
+        with self._lock:
+            self.retried += 1
+        return delay
+
+    def request(self, method, url, limiter=None, deadline=HTTP_TIMEOUT, **kwargs):
+        deadline_at = time.monotonic() + deadline
+        breaker, ok = self._admit(url), None
+        try:
+            for attempt in itertools.count():
+                wait = self._reserve(limiter, deadline_at)
+                if wait:
+                    time.sleep(wait)
+                response, error = None, None
+                try:
+                    response = self.client.request(method, url, timeout=self._timeout(deadline_at), **kwargs)
+                except httpx.TransportError as e:
+                    error = e
+                ok = error is None and response.status_code < 500
+                if error is None and response.status_code not in RETRY_STATUSES:
+                    return response
+                delay = self._retry_delay(attempt, response, deadline_at)
+                if delay is None:
+                    if error is not None:
+                        raise error
+                    return response
+                if response is not None:
+                    response.close()
+                time.sleep(delay)
+        finally:
+            self._settle(breaker, ok)
+
+    async def arequest(self, method, url, limiter=None, deadline=HTTP_TIMEOUT, stream=False, **kwargs):
+        # With stream=True the body is not read and the caller must close the response (see astream)
+        deadline_at = time.monotonic() + deadline
+        breaker, ok = self._admit(url), None
+        try:
+            for attempt in itertools.count():
+                wait = self._reserve(limiter, deadline_at)
+                if wait:
+                    await asyncio.sleep(wait)
+                response, error = None, None
+                try:
+                    request = self.async_client.build_request(method, url, timeout=self._timeout(deadline_at), **kwargs)
+                    response = await self.async_client.send(request, stream=stream)
+                except httpx.TransportError as e:
+                    error = e
+                ok = error is None and response.status_code < 500
+                if error is None and response.status_code not in RETRY_STATUSES:
+                    return response
+                delay = self._retry_delay(attempt, response, deadline_at)
+                if delay is None:
+                    if error is not None:
+                        raise error
+                    return response
+                if response is not None:
+                    await response.aclose()
+                await asyncio.sleep(delay)
+        finally:
+            self._settle(breaker, ok)
+
+    @asynccontextmanager
+    async def astream(self, method, url, **kwargs):
+        # Retries only happen before the body is handed over; a stream is never replayed midway
+        response = await self.arequest(method, url, stream=True, **kwargs)
+        try:
+            yield response
+        finally:
+            await response.aclose()
+
+    def stats(self):
+        with self._lock:
+            breakers = dict(self._breakers)
+        return {
+            "retried": self.retried,
+            "breakers": {host: {"state": b.state, "rejected": b.rejected} for host, b in breakers.items()},
+            "limiters": {key: {"per_minute": round(b.rate * 60), "waited_seconds": round(b.waited, 3)}
+                         for key, b in self._limiters.items()},
+        }
+
+    async def aclose(self):
+        await self.async_client.aclose()
+        self.client.close()
+
+
+outbound = OutboundClient()
+outbound.limit("groq", GROQ_REQUESTS_PER_MINUTE)
+outbound.limit("finnhub", FINNHUB_REQUESTS_PER_MINUTE)
+
+@app.get("/outbound/stats")
+def get_outbound_stats():
+    return outbound.stats()
+
+# === Async Chat Pipeline ===
+# Blocking libraries (yfinance, GCS, FinBERT, FPDF) run on a bounded executor so they
+# cannot exhaust the event loop or starlette's shared threadpool
+BLOCKING_WORKERS = int(os.getenv("BLOCKING_WORKERS", "16"))
+blocking_executor = ThreadPoolExecutor(max_workers=BLOCKING_WORKERS, thread_name_prefix="blocking")
+
+async def run_blocking(fn, *args):
+    loop = asyncio.get_running_loop()
+    return await loop.run_in_executor(blocking_executor, functools.partial(fn, *args))
+
+@app.on_event("shutdown")
+async def close_async_clients():
+    await outbound.aclose()
+    blocking_executor.shutdown(wait=False)
+
+async def get_llama_response_async(query):
+    key = llm_cache.key(ASSISTANT_SYSTEM_PROMPT, query)
+    cached = llm_cache.get(key)
+    if cached is not None:
+        return cached
+    payload = groq_payload(ASSISTANT_SYSTEM_PROMPT, query)
+    try:
+        with span("groq", "completion"):
+            response = await outbound.arequest("POST", GROQ_URL, limiter="groq", headers=groq_headers(), json=payload)
+    except httpx.HTTPError as e:
+        return f"❌ Error from Groq: {e}"
+    reply = parse_groq_reply(response.status_code, response.text)
+    if response.status_code == 200:
+        llm_cache.put(key, reply, groq_total_tokens(response.text))
+    return reply
+
+async def stream_llama_response(query):
+    # Yields content deltas from Groq's OpenAI-compatible SSE stream; a cached reply is one delta
+    key = llm_cache.key(ASSISTANT_SYSTEM_PROMPT, query)
+    cached = llm_cache.get(key)
+    if cached is not None:
+        yield cached
+        return
+    payload = {**groq_payload(ASSISTANT_SYSTEM_PROMPT, query), "stream": True}
+    deltas, tokens = [], 0
+    try:
+        async with outbound.astream("POST", GROQ_URL, limiter="groq", headers=groq_headers(), json=payload) as response:
+            if response.status_code != 200:
+                body = await response.aread()
+                yield f"❌ Error from Groq: {response.status_code} - {body.decode('utf-8', 'replace')}"
+                return
+            async for line in response.aiter_lines():
+                if not line.startswith("data:"):
+                    continue
+                data = line[5:].strip()
+                if data == "[DONE]":
+                    break
+                chunk = json.loads(data)
+                # Groq reports usage on the last chunk under x_groq
+                usage = chunk.get("usage") or chunk.get("x_groq", {}).get("usage")
+                if usage:
+                    tokens = usage.get("total_tokens", tokens)
+                delta = chunk["choices"][0]["delta"].get("content") if chunk.get("choices") else None
+                if delta:
+                    deltas.append(delta)
+                    yield delta
+    except httpx.HTTPError as e:
+        yield f"❌ Error from Groq: {e}"
+        return
+    # Only streams that ran to completion are cached
+    llm_cache.put(key, "".join(deltas), tokens)
+
+async def detect_intent_async(query):
+    try:
+        with span("groq", "intent"):
+            response = await outbound.arequest("POST", GROQ_URL, limiter="groq", headers=groq_headers(),
+                                               json=groq_payload(INTENT_SYSTEM_PROMPT, query))
+    except httpx.HTTPError:
+        return "general", []
+    return parse_intent(response.text)
+
+# === Intent Fast Path ===
+# Obvious queries are classified locally; only low-confidence ones pay the Groq round trip
+FAST_PATH_MIN_CONFIDENCE = float(os.getenv("FAST_PATH_MIN_CONFIDENCE", "0.8"))
+INTENT_PATTERNS = [  # checked in priority order
+    ("recommend", re.compile(r"recommend")),
+    ("compare", re.compile(r"\b(compare|comparison|versus|vs\.?)\b|\bbetter\b.*\bor\b")),
+    ("price", re.compile(r"\b(price|quote|trading at|share value)\b|\bhow much is\b")),
+    ("summary", re.compile(r"\b(news|headlines?|summar(y|ize|ise)|latest on|what happened)\b")),
+    ("sentiment", re.compile(r"\b(sentiment|bullish|bearish|mood|outlook|feel(ing)? about)\b")),
+]
+
+
+def classify_intent_fast(query):
+    # Returns (intent, targets, confidence)
+    query_lower = query.lower()
+    hits = [intent for intent, pattern in INTENT_PATTERNS if pattern.search(query_lower)]
+    if hits and hits[0] == "recommend":
+        return "recommend", [], 1.0
+    tickers = universe.index.tickers(query)
+    if not hits:
+        return "general", tickers, 0.0
+    intent = hits[0]
+    if intent == "compare":
+        confidence = 0.95 if len(tickers) == 2 else 0.3
+    elif intent in ("price", "summary"):
+        confidence = 0.9 if len(tickers) == 1 else 0.3
+    else:
+        # Without a ticker "outlook"/"mood" is a general question (rates, crypto), not one for FinBERT
+        confidence = 0.85 if tickers else 0.3
+    if len(hits) > 1:
+        confidence *= 0.7  # e.g. "price and news for AAPL" - let the LLM decide
+    return intent, tickers, confidence
+
+
+class IntentStats:
+    def __init__(self):
+        self._lock = threading.Lock()
+        self.paths = {path: {"count": 0, "total_ms": 0.0, "max_ms": 0.0} for path in ("fast", "llm")}
+
+    def record(self, path, seconds):
+        ms = seconds * 1000
+        with self._lock:
+            stats = self.paths[path]
+            stats["count"] += 1
+            stats["total_ms"] += ms
+            stats["max_ms"] = max(stats["max_ms"], ms)
+
+    def snapshot(self):
+        with self._lock:
+            return {
+                path: {**stats, "avg_ms": round(stats["total_ms"] / stats["count"], 3) if stats["count"] else 0.0}
+                for path, stats in self.paths.items()
+            }
+
+
+intent_stats = IntentStats()
+
+
+async def classify_intent(query):
+    # Returns (intent, targets, path) where path is "fast" or "llm"
+    start = time.perf_counter()
+    await universe.aload()
+    intent, targets, confidence = classify_intent_fast(query)
+    path = "fast"
+    if confidence < FAST_PATH_MIN_CONFIDENCE:
+        intent, targets = await detect_intent_async(query)
+        path = "llm"
+    intent_stats.record(path, time.perf_counter() - start)
+    return intent, targets, path
+
+
+@app.get("/intent/stats")
+def get_intent_stats():
+    return intent_stats.snapshot()
+
+
+async def complete_reply_async(parts):
+    prefix, prompt, suffix = parts
+    if prompt is None:
+        return prefix
+    return prefix + (await get_llama_response_async(prompt)).strip() + suffix
+
+async def build_comparison_async(tickers):
+    t1, t2 = tickers
+    snapshots = await asyncio.gather(run_blocking(stock_snapshot, t1), run_blocking(stock_snapshot, t2))
+    return build_comparison(t1, t2, dict(zip([t1, t2], snapshots)))
+
+async def build_news_summary_async(query):
+    await universe.aload()
+    company, url = news_search_url(query)
+    feed = None
+    if url:
+        try:
+            with span("google_news", "rss"):
+                response = await outbound.arequest("GET", url)
+            feed = await run_blocking(feedparser.parse, response.text)
+        except httpx.HTTPError:
+            pass  # no headlines; the summary says so
+    headlines = feed_headlines(feed)
+    sentiments = await sentiment_engine.score_many_async(headlines)
+    return build_news_summary(company, headlines, sentiments)
+
+async def plan_reply(username, query, intent, targets, portfolio_task=None):
+    if "recommend" in query.lower():
+        if portfolio_task is None:
+            portfolio_task = run_blocking(get_gcs_blob_text, f"portfolios/{username}.json")
+        return await run_blocking(build_recommendation, username, await portfolio_task)
+    elif intent == "price" and targets:
+        return await run_blocking(get_stock_price, targets[0]), None, ""
+    elif intent == "compare" and len(targets) == 2:
+        return await build_comparison_async(targets)
+    elif intent == "sentiment":
+        return format_sentiment(await sentiment_engine.score_async(query)), None, ""
+    elif intent == "summary":
+        return await build_news_summary_async(query)
+    else:
+        return "", query, ""
+
+
+# === Finnhub Feeds ===
+FINNHUB_TIMEOUT = float(os.getenv("FINNHUB_TIMEOUT", "8"))
+ALERTS_TTL = int(os.getenv("ALERTS_TTL", "300"))
+CALENDAR_TTL = int(os.getenv("CALENDAR_TTL", "3600"))
+CALENDAR_FEEDS = (("earnings", "earningsCalendar"), ("ipo", "ipoCalendar"), ("economic", "economicCalendar"))
+
+
+class StaleWhileRevalidate:
+    """One async-loaded value, fresh for ttl seconds and then served stale while it refreshes.
+
+    All callers share a single in-flight load. Only a cold cache (or one whose loads keep
+    failing before a first success) makes callers wait for it.
+    """
+
+    def __init__(self, name, ttl, load):
+        self.name = name
+        self.ttl = ttl
+        self.load = load
+        self.value = None
+        self.loaded_at = None  # monotonic time of the last successful load
+        self._task = None
+        self.hits = self.stale = self.misses = self.coalesced = self.errors = 0
+
+    async def _run(self):
+        try:
+            self.value = await self.load()
+            self.loaded_at = time.monotonic()
+            return self.value
+        except Exception as e:
+            self.errors += 1
+            print(f"⚠️ {self.name} refresh failed: {e}")
+            raise
+        finally:
+            self._task = None
+
+    def _refresh(self):
+        if self._task is not None:
+            self.coalesced += 1
+            return self._task
+        self._task = asyncio.ensure_future(self._run())
+        # Background failures are already logged; retrieve them so asyncio does not warn
+        self._task.add_done_callback(lambda task: task.cancelled() or task.exception())
+        return self._task
+
+    async def get(self):
+        if self.loaded_at is None:
+            if self._task is None:
+                self.misses += 1
+            return await asyncio.shield(self._refresh())
+        if time.monotonic() - self.loaded_at < self.ttl:
+            self.hits += 1
+        else:
+            self.stale += 1
+            self._refresh()
+        return self.value
+
+    def stats(self):
+        return {
+            "ttl": self.ttl,
+            "age": round(time.monotonic() - self.loaded_at, 1) if self.loaded_at is not None else None,
+            "hits": self.hits,
+            "stale": self.stale,
+            "misses": self.misses,
+            "coalesced": self.coalesced,
+            "errors": self.errors,
+        }
+
+
+async def fetch_finnhub(url, key=None):
+    with span("finnhub", key or "news"):
+        response = await outbound.arequest("GET", url, limiter="finnhub", deadline=FINNHUB_TIMEOUT)
+    response.raise_for_status()
+    data = response.json()
+    return data.get(key, []) if key else data
+
+async def load_alerts():
+    news_items = (await fetch_finnhub(f"https://finnhub.io/api/v1/news?category=general&token={FINNHUB_API_KEY}"))[:5]
+
+    # Score all headlines in one FinBERT batch; if the model is down the headlines still go out, unscored
+    try:
+        sentiments = await sentiment_engine.score_many_async([item["headline"] for item in news_items])
+    except Exception as e:
+        print(f"⚠️ Alert sentiment scoring failed, serving unscored headlines: {e}")
+        sentiments = [None] * len(news_items)
+
+    alerts = []
+    for item, sentiment in zip(news_items, sentiments):
+        alerts.append({
+            "title": item["headline"],
+            "timestamp": datetime.fromtimestamp(item["datetime"]).strftime("%Y-%m-%d %H:%M"),
+            "link": item["url"],
+            "sentiment": sentiment["label"] if sentiment else None
+        })
+    return alerts
+
+def build_calendar_events(earnings, ipos, economic, sp500_symbols):
+    events = []
+
+    # Filter S&P 500 earnings
+    for e in earnings:
+        symbol = e.get("symbol", "")
+        if symbol in sp500_symbols:
+            events.append({
+                "ticker": symbol,
+                "event": "Earnings Call",
+                "date": e.get("date", "N/A"),
+                "type": "earnings"
+            })
+
+    # Add all IPOs regardless of S&P 500 filter
+    for ipo in ipos:
+        events.append({
+            "ticker": ipo.get("symbol", ""),
+            "event": f"IPO - {ipo.get('name', '')}",
+            "date": ipo.get("date", "N/A"),
+            "type": "ipo"
+        })
+
+    # Add all macroeconomic events (no filtering)
+    for econ in economic:
+        events.append({
+            "ticker": econ.get("country", "Macro"),
+            "event": econ.get("event", "Economic Event"),
+            "date": econ.get("date", "N/A"),
+            "type": "economic",
+            "country": econ.get("country", "US")
+        })
+
+    return sorted(events, key=lambda x: x["date"])
+
+_last_calendar_feeds = {}  # feed -> last good event list, reused when only that feed fails
+
+async def load_calendar():
+    from_date = datetime.today().strftime("%Y-%m-%d")
+    to_date = (datetime.today() + timedelta(days=30)).strftime("%Y-%m-%d")
+
+    results = await asyncio.gather(*(
+        fetch_finnhub(f"{BASE_URL}/{feed}?from={from_date}&to={to_date}&token={FINNHUB_API_KEY}", key)
+        for feed, key in CALENDAR_FEEDS
+    ), return_exceptions=True)
+    if all(isinstance(result, Exception) for result in results):
+        raise results[0]
+
+    feeds = {}
+    for (feed, _), result in zip(CALENDAR_FEEDS, results):
+        if isinstance(result, Exception):
+            print(f"⚠️ Finnhub {feed} calendar failed, keeping the previous events: {result}")
+            result = _last_calendar_feeds.get(feed, [])
+        feeds[feed] = _last_calendar_feeds[feed] = result
+        metrics.set("smartinvest_calendar_events", len(result), feed=feed)
+
+    # Sorted once per refresh; requests return the cached list as-is
+    symbols = (await universe.aload()).index.symbols
+    return build_calendar_events(feeds["earnings"], feeds["ipo"], feeds["economic"], symbols)
+
+alerts_feed = StaleWhileRevalidate("alerts", ALERTS_TTL, load_alerts)
+calendar_feed = StaleWhileRevalidate("calendar", CALENDAR_TTL, load_calendar)
+
 # === Add these endpoints at the bottom of your backend ===
 
 @app.get("/forecast")
-def forecast_chart(ticker: str):
+def forecast_chart(request: Request, ticker: str, chart_format: ChartFormat = Query("base64", alias="format")):
     try:
-        t = yf.Ticker(ticker)
-        hist = t.history(period="6mo")
-        if hist.empty:
-            return JSONResponse(status_code=404, content={"error": "No forecast data"})
-
-        # Use simple moving average as dummy forecast
-        hist["Forecast"] = hist["Close"].rolling(window=7).mean()
-
-        fig, ax = plt.subplots()
-        hist["Close"].plot(ax=ax, label="Close Price")
-        hist["Forecast"].plot(ax=ax, label="7-day SMA Forecast")
-        ax.set_title(f"{ticker} Forecast (Close vs 7-day SMA)")
-        ax.set_ylabel("Stock Price (USD)")  # ✅ Add this line
-        ax.set_xlabel("Date")               # ✅ Optional: Add X-axis label too
-        ax.legend()
-        plt.tight_layout()
-
-
-        buffer = BytesIO()
-        plt.savefig(buffer, format="png")
-        plt.close(fig)
-        buffer.seek(0)
-        img_str = base64.b64encode(buffer.read()).decode("utf-8")
-
-        return {"image": img_str}
+        # Precomputed by the indicators job; live history only for tickers outside it
+        series = indicator_series.get(ticker.upper())
+        if series is not None:
+            hist = series.rename(columns={"SMA_7": "Forecast"})
+        else:
+            # Copy so the cached frame is not mutated
+            hist = market_data.history(ticker, "6mo").copy()
+            if hist.empty:
+                return JSONResponse(status_code=404, content={"error": "No forecast data"})
+
+            # Use simple moving average as dummy forecast
+            hist["Forecast"] = hist["Close"].rolling(window=7).mean()
+
+        return chart_response(request, ticker, "forecast", hist[["Close", "Forecast"]], render_forecast_chart, chart_format)
     except Exception as e:
         return JSONResponse(status_code=500, content={"error": str(e)})
 
@@ -460,7 +2745,7 @@ def forecast_chart(ticker: str):
 @app.get("/dashboard")
 def dashboard_data(ticker: str):
     try:
-        info = yf.Ticker(ticker).info
+        info = market_data.info(ticker)
         return {
             "revenue": round(info.get("totalRevenue", 0) / 1e9, 2),
             "profit": round(info.get("grossProfits", 0) / 1e9, 2),
@@ -469,61 +2754,58 @@ def dashboard_data(ticker: str):
     except:
         return JSONResponse(status_code=500, content={"error": "Dashboard data error"})
 
+HEALTH_FIELDS = (*CHANGE_SESSIONS, "volatility")
+
+def live_price_health(ticker):
+    # Fallback for tickers outside (or stale in) the precomputed indicators table.
+    # Same definitions as compute_indicators: N sessions back, clamped to the oldest close
+    hist = market_data.history(ticker, "3mo")
+    if hist.empty:
+        return None
+
+    close = hist["Close"].dropna()
+    changes = {name: (close.iloc[-1] / close.iloc[max(0, len(close) - 1 - sessions)] - 1) * 100
+               for name, sessions in CHANGE_SESSIONS.items()}
+    changes["volatility"] = close.pct_change().iloc[-VOLATILITY_SESSIONS:].std() * 100  # daily stddev in %
+    return changes
+
+def finite_or_none(value, digits=2):
+    # NaN/inf are not valid JSON; they are sent as null
+    return round(float(value), digits) if value is not None and math.isfinite(value) else None
+
 @app.get("/health")
 def stock_health(ticker: str):
     try:
-        stock = yf.Ticker(ticker)
-        hist = stock.history(period="30d")
+        changes = indicators.get(ticker.upper())
+        if changes is None or not all(finite_or_none(changes.get(field)) is not None for field in HEALTH_FIELDS):
+            changes = live_price_health(ticker)
 
-        if hist.empty:
+        if changes is None:
             return JSONResponse(status_code=404, content={"error": "No historical data"})
 
-        close = hist["Close"]
-        change_1d = ((close.iloc[-1] - close.iloc[-2]) / close.iloc[-2]) * 100
-        change_7d = ((close.iloc[-1] - close.iloc[-7]) / close.iloc[-7]) * 100
-        change_30d = ((close.iloc[-1] - close.iloc[0]) / close.iloc[0]) * 100
-        volatility = close.pct_change().std() * 100  # daily stddev in %
-
-        info = stock.info
+        info = market_data.info(ticker)
         return {
             "pe_ratio": info.get("trailingPE", "N/A"),
             "analyst_rating": info.get("recommendationKey", "unknown").capitalize(),
-            "change_1d": round(change_1d, 2),
-            "change_7d": round(change_7d, 2),
-            "change_30d": round(change_30d, 2),
-            "volatility": round(volatility, 2)
+            **{field: finite_or_none(changes[field]) for field in HEALTH_FIELDS},
         }
     except Exception as e:
         return JSONResponse(status_code=500, content={"error": str(e)})
 
 @app.get("/alerts")
-def smart_alerts():
-    url = f"https://finnhub.io/api/v1/news?category=general&token={FINNHUB_API_KEY}"
-    response = requests.get(url)
-
-    if response.status_code != 200:
+async def smart_alerts():
+    try:
+        return await alerts_feed.get()
+    except Exception:
         return []
 
-    news_items = response.json()[:5]
-
-    alerts = []
-    for item in news_items:
-        alerts.append({
-            "title": item["headline"],
-            "timestamp": datetime.fromtimestamp(item["datetime"]).strftime("%Y-%m-%d %H:%M"),
-            "link": item["url"]
-        })
-
-    return alerts
-
 
 
 
 @app.get("/overview")
 def get_stock_overview(ticker: str):
     try:
-        stock = yf.Ticker(ticker.upper())
-        info = stock.info
+        info = market_data.info(ticker)
 
         return {
             "ticker": ticker.upper(),
@@ -551,88 +2833,145 @@ def get_stock_overview(ticker: str):
 
 
 @app.get("/calendar")
-def unified_calendar():
-    from_date = datetime.today().strftime("%Y-%m-%d")
-    to_date = (datetime.today() + timedelta(days=30)).strftime("%Y-%m-%d")
-
-    earnings_url = f"{BASE_URL}/earnings?from={from_date}&to={to_date}&token={FINNHUB_API_KEY}"
-    ipo_url = f"{BASE_URL}/ipo?from={from_date}&to={to_date}&token={FINNHUB_API_KEY}"
-    economic_url = f"{BASE_URL}/economic?from={from_date}&to={to_date}&token={FINNHUB_API_KEY}"
-
+async def unified_calendar():
     try:
-        # Load and clean symbol set for fast lookup
-        sp500_symbols = set(sp500_lookup.values())
-
-        earnings_resp = requests.get(earnings_url).json().get("earningsCalendar", [])
-        ipo_resp = requests.get(ipo_url).json().get("ipoCalendar", [])
-        economic_resp = requests.get(economic_url).json().get("economicCalendar", [])
-
-        print("Earnings Events Count:", len(earnings_resp))
-        print("IPO Events Count:", len(ipo_resp))
-        print("Economic Events Count:", len(economic_resp))
-
-        events = []
-
-        # Filter S&P 500 earnings
-        for e in earnings_resp:
-            symbol = e.get("symbol", "")
-            if symbol in sp500_symbols:
-                events.append({
-                    "ticker": symbol,
-                    "event": "Earnings Call",
-                    "date": e.get("date", "N/A"),
-                    "type": "earnings"
-                })
-
-        # Add all IPOs regardless of S&P 500 filter
-        for ipo in ipo_resp:
-            events.append({
-                "ticker": ipo.get("symbol", ""),
-                "event": f"IPO - {ipo.get('name', '')}",
-                "date": ipo.get("date", "N/A"),
-                "type": "ipo"
-            })
-
-        # Add all macroeconomic events (no filtering)
-        for econ in economic_resp:
-            events.append({
-                "ticker": econ.get("country", "Macro"),
-                "event": econ.get("event", "Economic Event"),
-                "date": econ.get("date", "N/A"),
-                "type": "economic",
-                "country": econ.get("country", "US")
-            })
-
-        return sorted(events, key=lambda x: x["date"])
-    
+        return await calendar_feed.get()
     except Exception as e:
         return JSONResponse(status_code=500, content={"error": str(e)})
     
 @app.post("/smartchat")
-def smart_chat(req: QueryRequest):
+async def smart_chat(req: QueryRequest):
     query = req.query
     username = req.username
 
-    # Detect intent and process accordingly
-    intent, targets = detect_intent_with_gpt(query)
-
+    # Start the portfolio read while intent detection is in flight
+    portfolio_task = None
     if "recommend" in query.lower():
-        reply = recommend_stocks_based_on_portfolio(username)
-    elif intent == "price" and targets:
-        reply = get_stock_price(targets[0])
-    elif intent == "compare" and len(targets) == 2:
-        reply = compare_two_stocks(targets)
-    elif intent == "sentiment":
-        reply = get_sentiment_finbert(query)
-    elif intent == "summary":
-        reply = get_news_summary(query)
-    else:
-        reply = get_llm_response(query)
+        portfolio_task = asyncio.ensure_future(run_blocking(get_gcs_blob_text, f"portfolios/{username}.json"))
 
-    # Save history
-    if username not in session_histories:
-        session_histories[username] = []
-    session_histories[username].append({"query": query, "reply": reply})
+    # Detect intent and process accordingly; each stage is timed separately
+    with stage("/smartchat", "classify"):
+        intent, targets, _ = await classify_intent(query)
+    with stage("/smartchat", "plan"):
+        parts = await plan_reply(username, query, intent, targets, portfolio_task)
+    with stage("/smartchat", "reply"):
+        reply = await complete_reply_async(parts)
 
+    save_history(username, query, reply)
     return {"reply": reply}
 
+
+def save_history(username, query, reply):
+    session_history.append(username, query, reply)
+
+
+def sse_event(event, data):
+    return f"event: {event}\ndata: {json.dumps(data)}\n\n"
+
+
+@app.post("/smartchat/stream")
+async def smart_chat_stream(req: QueryRequest):
+    """Server-sent events variant of /smartchat.
+
+    Emits one "intent" event, then "token" events whose texts concatenate to the reply
+    (structured parts such as the comparison table or top-5 list come first, LLM tokens
+    follow as they arrive), then "done" with the full reply, or "error".
+    """
+    query = req.query
+    username = req.username
+
+    portfolio_task = None
+    if "recommend" in query.lower():
+        portfolio_task = asyncio.ensure_future(run_blocking(get_gcs_blob_text, f"portfolios/{username}.json"))
+
+    async def events():
+        try:
+            intent, targets, path = await classify_intent(query)
+            yield sse_event("intent", {"intent": intent, "targets": targets, "path": path})
+
+            prefix, prompt, suffix = await plan_reply(username, query, intent, targets, portfolio_task)
+            if prefix:
+                yield sse_event("token", {"text": prefix})
+            if prompt is None:
+                reply = prefix
+            else:
+                chunks = []
+                async for chunk in stream_llama_response(prompt):
+                    if not chunks:
+                        chunk = chunk.lstrip()
+                        if not chunk:
+                            continue
+                    chunks.append(chunk)
+                    yield sse_event("token", {"text": chunk})
+                if suffix:
+                    yield sse_event("token", {"text": suffix})
+                reply = prefix + "".join(chunks).strip() + suffix
+
+            save_history(username, query, reply)
+            yield sse_event("done", {"reply": reply})
+        except Exception as e:
+            yield sse_event("error", {"error": str(e)})
+
+    return StreamingResponse(events(), media_type="text/event-stream",
+                             headers={"Cache-Control": "no-cache", "X-Accel-Buffering": "no"})
+
+
+# === Metrics Endpoints ===
+def collect_cache_metrics():
+    # Snapshot every cache's counters into gauges at scrape time
+    caches = {f"market_{kind}": stats for kind, stats in market_data.stats().items()}
+    caches.update({
+        "finbert": sentiment_engine.stats(),
+        "charts": chart_cache.stats(),
+        "llm": llm_cache.stats(),
+        "alerts": alerts_feed.stats(),
+        "calendar": calendar_feed.stats(),
+    })
+    for name, stats in caches.items():
+        hits, misses = stats.get("hits", 0), stats.get("misses", 0)
+        ratio = stats.get("hit_ratio")
+        if ratio is None and hits + misses:
+            ratio = round(hits / (hits + misses), 4)
+        metrics.set("smartinvest_cache_hits", hits, cache=name)
+        metrics.set("smartinvest_cache_misses", misses, cache=name)
+        if ratio is not None:
+            metrics.set("smartinvest_cache_hit_ratio", ratio, cache=name)
+
+    history = session_history.stats()
+    metrics.set("smartinvest_history_users", history["users"])
+    metrics.set("smartinvest_history_bytes", history["bytes"])
+    outbound_stats = outbound.stats()
+    metrics.set("smartinvest_http_retries", outbound_stats["retried"])
+    for host, breaker in outbound_stats["breakers"].items():
+        metrics.set("smartinvest_circuit_open", int(breaker["state"] == "open"), host=host)
+    for name, status in component_status.items():
+        metrics.set("smartinvest_component_ready", int(status.get("ready", False)), component=name)
+
+@app.get("/metrics")
+def prometheus_metrics():
+    collect_cache_metrics()
+    return Response(metrics.render(), media_type="text/plain; version=0.0.4")
+
+def profiles_allowed(request):
+    # Flame graphs show code paths and arguments, so they need profiling on plus PROFILE_TOKEN
+    # (X-Profile-Token header or ?token=); anything else looks like a missing route
+    token = request.headers.get("X-Profile-Token") or request.query_params.get("token", "")
+    return bool(PROFILE_SAMPLE_RATE and PROFILE_TOKEN) and secrets.compare_digest(token.encode(), PROFILE_TOKEN.encode())
+
+@app.get("/debug/profiles")
+def list_profiles(request: Request):
+    # Flame graphs of slow sampled requests (PROFILE_SAMPLE_RATE > 0 and pyinstrument installed)
+    if not profiles_allowed(request):
+        return JSONResponse(status_code=404, content={"detail": "Not Found"})
+    if not os.path.isdir(PROFILE_DIR):
+        return []
+    return sorted((os.path.basename(path) for path in glob.glob(os.path.join(PROFILE_DIR, "*.html"))), reverse=True)
+
+@app.get("/debug/profiles/{name}")
+def get_profile(request: Request, name: str):
+    if not profiles_allowed(request):
+        return JSONResponse(status_code=404, content={"detail": "Not Found"})
+    path = os.path.join(PROFILE_DIR, os.path.basename(name))
+    if not name.endswith(".html") or not os.path.exists(path):
+        return JSONResponse(status_code=404, content={"error": "Profile not found"})
+    return FileResponse(path, media_type="text/html")
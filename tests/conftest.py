@@ -0,0 +1,6 @@
+import os
+import sys
+
+# The API modules live at the repository root; tests run against the in-memory store
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+os.environ.setdefault("STORAGE_BACKEND", "memory")
@@ -0,0 +1,84 @@
+import base64
+
+import pandas as pd
+import pytest
+from fastapi.testclient import TestClient
+
+import smartchat_api
+from smartchat_api import ChartCache, IndicatorSeries, MarketData, MemoryStore
+
+DATES = pd.bdate_range("2024-06-03", periods=10)
+
+
+class ChartProvider:
+    def __init__(self):
+        self.history_calls = 0
+
+    def history(self, ticker, period):
+        self.history_calls += 1
+        return pd.DataFrame({"Close": [100.0 + i for i in range(len(DATES))]}, index=DATES)
+
+    def income_stmt(self, ticker):
+        periods = pd.to_datetime(["2023-12-31", "2022-12-31"])
+        return pd.DataFrame({periods[0]: [5.0e9, 1.0], periods[1]: [4.0e9, 2.0]}, index=["Net Income", "Other"])
+
+
+@pytest.fixture
+def client(monkeypatch):
+    store = MemoryStore()
+    monkeypatch.setattr(smartchat_api, "indicator_series", IndicatorSeries(store, check_interval=0))
+    monkeypatch.setattr(smartchat_api, "market_data", MarketData(ChartProvider()))
+    monkeypatch.setattr(smartchat_api, "chart_cache", ChartCache())
+    client = TestClient(smartchat_api.app)
+    client.store = store
+    return client
+
+
+def test_series_points_send_nan_as_null():
+    data = pd.DataFrame({"Close": [1.23456, 2.0], "Forecast": [float("nan"), 1.5]}, index=DATES[:2])
+    assert smartchat_api.series_points(data) == [
+        {"date": "2024-06-03", "Close": 1.2346, "Forecast": None},
+        {"date": "2024-06-04", "Close": 2.0, "Forecast": 1.5},
+    ]
+    assert smartchat_api.series_points(data["Close"]) == [
+        {"date": "2024-06-03", "Close": 1.2346}, {"date": "2024-06-04", "Close": 2.0},
+    ]
+
+
+def test_forecast_series_from_live_history(client):
+    body = client.get("/forecast", params={"ticker": "acme", "format": "series"}).json()
+    assert (body["ticker"], body["kind"]) == ("acme", "forecast")
+    points = body["points"]
+    assert len(points) == len(DATES)
+    assert points[0] == {"date": "2024-06-03", "Close": 100.0, "Forecast": None}
+    assert points[-1]["Forecast"] == pytest.approx(sum(103.0 + i for i in range(7)) / 7, abs=1e-4)
+    assert smartchat_api.chart_cache.stats()["misses"] == 0  # nothing rendered
+
+
+def test_forecast_series_prefers_the_precomputed_table(client):
+    client.store.write(IndicatorSeries.BLOB, pd.DataFrame({
+        "Date": ["2024-06-03", "2024-06-04"], "Ticker": ["ACME", "ACME"],
+        "Close": [10.0, 11.0], "SMA_7": [None, 10.5],
+    }).to_csv(index=False))
+    points = client.get("/forecast", params={"ticker": "acme", "format": "series"}).json()["points"]
+    assert points == [{"date": "2024-06-03", "Close": 10.0, "Forecast": None},
+                      {"date": "2024-06-04", "Close": 11.0, "Forecast": 10.5}]
+    assert smartchat_api.market_data.provider.history_calls == 0
+
+
+def test_earnings_series(client):
+    points = client.get("/earnings", params={"ticker": "acme", "format": "series"}).json()["points"]
+    assert [(p["date"], p["Net Income"]) for p in points] == [("2023-12-31", 5.0e9), ("2022-12-31", 4.0e9)]
+
+
+def test_png_is_cached_and_revalidated(client):
+    first = client.get("/forecast", params={"ticker": "acme", "format": "png"})
+    assert first.status_code == 200 and first.headers["content-type"] == "image/png"
+    assert first.content.startswith(b"\x89PNG")
+    etag = first.headers["etag"]
+
+    again = client.get("/forecast", params={"ticker": "acme", "format": "png"}, headers={"If-None-Match": etag})
+    assert again.status_code == 304
+    legacy = client.get("/forecast", params={"ticker": "acme"}).json()
+    assert base64.b64decode(legacy["image"]) == first.content
+    assert smartchat_api.chart_cache.stats()["misses"] == 1
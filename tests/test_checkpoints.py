@@ -0,0 +1,62 @@
+import numpy as np
+import pandas as pd
+import pytest
+
+pytest.importorskip("tensorflow")
+import vertex_lstm_predictor as vlp  # noqa: E402
+
+DAYS = pd.bdate_range("2024-01-01", periods=80)
+
+
+def prices(days=DAYS):
+    return pd.DataFrame({"Date": days, "Close": (100 + 0.5 * np.arange(len(days))).astype("float32")})
+
+
+def news(last_sentiment=0.1, days=DAYS):
+    df = pd.DataFrame({"ticker": "ACME", "date": days, "avg_sentiment": 0.1, "article_count": 2.0})
+    df.loc[df.index[-1], "avg_sentiment"] = last_sentiment
+    return vlp.SentimentTable(df.astype({"avg_sentiment": "float32", "article_count": "float32"}))
+
+
+@pytest.fixture
+def update(tmp_path):
+    store = vlp.CheckpointStore(str(tmp_path))
+
+    def run(stock_df, table):
+        return vlp.update_ticker("ACME", stock_df, table.get("ACME"), store, True, table.last_date)["Mode"]
+    return run
+
+
+def test_unchanged_data_reuses_the_prediction(update):
+    assert update(prices(), news()) == "trained"
+    assert update(prices(), news()) == "unchanged"
+
+
+def test_refetched_last_sentiment_day_does_not_retrain(update):
+    update(prices(), news())
+    assert update(prices(), news(last_sentiment=0.9)) == "refreshed"
+
+
+def test_new_bars_are_fine_tuned(update):
+    update(prices(DAYS[:-3]), news(days=DAYS[:-3]))
+    assert update(prices(), news()) == "fine-tuned"
+
+
+def test_revised_history_retrains(update):
+    update(prices(), news())
+    revised = prices()
+    revised.loc[10, "Close"] += 1
+    assert update(revised, news()) == "trained"
+
+
+def test_without_a_store_nothing_is_saved(tmp_path):
+    table = news()
+    result = vlp.update_ticker("ACME", prices(), table.get("ACME"))
+    assert result["Mode"] == "trained"
+    assert list(tmp_path.iterdir()) == []
+
+
+def test_update_and_infer_need_a_checkpoint_dir():
+    with pytest.raises(SystemExit):
+        vlp.parse_args(["--mode", "update", "--checkpoint-dir", ""])
+    assert vlp.parse_args(["--mode", "per-ticker", "--checkpoint-dir", ""]).checkpoint_dir == ""
@@ -0,0 +1,50 @@
+import numpy as np
+import pandas as pd
+import pytest
+
+pytest.importorskip("tensorflow")
+import vertex_lstm_predictor as vlp  # noqa: E402
+
+NO_NEWS = pd.DataFrame(columns=vlp.NEWS_COLUMNS, index=pd.DatetimeIndex([], name="date"), dtype="float32")
+
+
+def job(ticker, closes):
+    dates = pd.bdate_range("2024-01-01", periods=len(closes))
+    return ticker, pd.DataFrame({"Date": dates, "Close": np.asarray(closes, dtype="float32")}), NO_NEWS
+
+
+def test_load_all_windows_reports_failures():
+    broken = ("BAD", pd.DataFrame({"Date": ["not a date"], "Close": [1.0]}), NO_NEWS)
+    datasets, errors = vlp.load_all_windows([job("OK", np.arange(100.0, 180.0)), job("SHORT", range(10)), broken])
+    assert [d[0] for d in datasets] == ["OK"]
+    assert [e["Ticker"] for e in errors] == ["BAD"]
+
+
+def test_run_global_without_usable_tickers():
+    assert vlp.run_global([job("SHORT", range(10))]) == ([], [])
+
+
+def test_train_global_model_needs_data():
+    with pytest.raises(ValueError, match="enough history"):
+        vlp.train_global_model([])
+
+
+def test_window_batches_cover_every_window_once():
+    datasets = []
+    for ticker, rows in (("A", 70), ("B", 75)):
+        df = pd.DataFrame({"date": pd.bdate_range("2024-01-01", periods=rows), "Close": np.arange(1.0, rows + 1)})
+        X, y, _, _ = vlp.build_windows(df)
+        datasets.append((ticker, X, y))
+    batches = vlp.WindowBatches(datasets, batch_size=4)
+    assert len(batches) == -(-(10 + 15) // 4)
+
+    seen = []
+    for b in range(len(batches)):
+        inputs, y = batches[b]
+        assert inputs["window"].shape[1:] == (vlp.LOOKBACK, 1)
+        for i, window, target in zip(inputs["ticker_id"], inputs["window"], y):
+            X, y_t = datasets[i][1], datasets[i][2]
+            position = int(np.flatnonzero((X == window).all(axis=(1, 2)))[0])
+            assert target == y_t[position]
+            seen.append((int(i), position))
+    assert sorted(seen) == [(0, p) for p in range(10)] + [(1, p) for p in range(15)]
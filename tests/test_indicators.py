@@ -0,0 +1,63 @@
+import numpy as np
+import pandas as pd
+import pytest
+
+pytest.importorskip("tensorflow")
+import vertex_lstm_predictor as vlp  # noqa: E402
+
+
+def frame(closes, start="2024-01-01"):
+    dates = pd.bdate_range(start, periods=len(closes))
+    return pd.DataFrame({"Date": dates, "Close": np.asarray(closes, dtype="float32")})
+
+
+def peers(n=3):
+    rng = np.random.default_rng(0)
+    return [(f"P{i}", frame(100 * np.cumprod(1 + rng.normal(0, 0.01 * (i + 1), 60)))) for i in range(n)]
+
+
+def indicators(*frames):
+    return vlp.compute_indicators(vlp.build_close_panel(list(frames) + peers())).set_index("Ticker")
+
+
+def test_changes_count_trading_sessions():
+    row = indicators(("UP", frame(np.arange(100.0, 160.0)))).loc["UP"]
+    assert row["change_1d"] == pytest.approx((159 / 158 - 1) * 100, abs=1e-3)
+    assert row["change_7d"] == pytest.approx((159 / 154 - 1) * 100, abs=1e-3)
+    assert row["change_30d"] == pytest.approx((159 / 138 - 1) * 100, abs=1e-3)
+    assert row["sma_7"] == pytest.approx(156.0)
+    assert row["drawdown"] == 0
+    assert row["as_of"] == frame(range(60))["Date"].iloc[-1].date().isoformat()
+
+
+def test_drawdown_carries_prices_over_gaps():
+    closes = [100.0, 120.0, 90.0, np.nan, 96.0] + [96.0] * 55
+    row = indicators(("DIP", frame(closes))).loc["DIP"]
+    assert row["drawdown"] == pytest.approx(-20.0)
+    assert row["max_drawdown_1y"] == pytest.approx(-25.0)
+
+
+def test_risk_is_the_volatility_tercile():
+    table = vlp.compute_indicators(vlp.build_close_panel(peers(6))).set_index("Ticker")
+    assert table["risk"].value_counts().to_dict() == {"low": 2, "medium": 2, "high": 2}
+    assert table.loc["P5", "risk"] == "high" and table.loc["P0", "risk"] == "low"
+
+
+def test_series_has_sma_per_ticker():
+    series = vlp.indicator_series(vlp.build_close_panel([("UP", frame(np.arange(100.0, 160.0)))]), days=10)
+    assert len(series) == 10
+    assert series["SMA_7"].iloc[-1] == pytest.approx(156.0)
+
+
+def test_short_history_has_no_missing_changes():
+    # 15 sessions: the 21-session change is measured from the first close instead of NaN
+    table = vlp.compute_indicators(vlp.build_close_panel([("IPO", frame(np.arange(100.0, 115.0)))]))
+    row = table.set_index("Ticker").loc["IPO"]
+    assert row[["change_1d", "change_7d", "change_30d", "volatility"]].notna().all()
+    assert row["change_30d"] == pytest.approx((114 / 100 - 1) * 100, abs=1e-3)
+    assert row["risk"] == "low"
+
+
+def test_ticker_listed_after_the_panel_starts():
+    row = indicators(("NEW", frame(np.linspace(50, 55, 10), start="2024-03-11"))).loc["NEW"]
+    assert row["change_30d"] == pytest.approx(10.0, abs=1e-3)
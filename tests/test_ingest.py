@@ -0,0 +1,50 @@
+import os
+
+import pytest
+
+pytest.importorskip("tensorflow")
+import vertex_lstm_predictor as vlp  # noqa: E402
+
+CSV = b"Date,Open,Close,Volume\n2024-01-02 00:00:00-05:00,1,10.5,100\n2024-01-03 00:00:00-05:00,1,11.0,100\n"
+
+
+class FakeBlob:
+    def __init__(self, name, generation=1):
+        self.name, self.generation, self.downloads = name, generation, 0
+
+    def download_as_bytes(self):
+        self.downloads += 1
+        return CSV
+
+
+class FakeBucket:
+    def __init__(self, names):
+        self.blobs = [FakeBlob(name) for name in names]
+        self.list_kwargs = None
+
+    def list_blobs(self, **kwargs):
+        self.list_kwargs = kwargs
+        return self.blobs
+
+
+def test_cache_files_of_one_ticker_do_not_match_another(tmp_path):
+    brk, brk_b = FakeBlob("BRK_Historical_Data.csv"), FakeBlob("BRK-B_Historical_Data.csv")
+    vlp.load_stock_blob(brk_b, str(tmp_path))
+    vlp.load_stock_blob(brk, str(tmp_path))
+    brk.generation = 2
+    df = vlp.load_stock_blob(brk, str(tmp_path))
+    assert sorted(os.listdir(tmp_path)) == ["BRK-B@1.npy", "BRK@2.npy"]
+    assert df["Close"].tolist() == [10.5, 11.0]
+
+    vlp.load_stock_blob(brk_b, str(tmp_path))
+    assert brk_b.downloads == 1  # served from the cache
+
+
+def test_stream_reads_only_the_limited_blobs(tmp_path):
+    bucket = FakeBucket(["A_Historical_Data.csv", "notes.txt", "B_Historical_Data.csv", "C_Historical_Data.csv"])
+    errors = []
+    tickers = sorted(t for t, _ in vlp.stream_stock_frames(bucket, errors, threads=2, cache_dir=str(tmp_path), limit=2))
+    assert tickers == ["A", "B"]
+    assert [b.downloads for b in bucket.blobs] == [1, 0, 1, 0]
+    assert bucket.list_kwargs == {"prefix": vlp.STOCK_DATA_PREFIX, "delimiter": "/"}
+    assert errors == []
@@ -0,0 +1,57 @@
+import pandas as pd
+import pytest
+
+import smartchat_api
+from smartchat_api import FAST_PATH_MIN_CONFIDENCE, classify_intent_fast
+
+SP500 = pd.DataFrame({
+    "Security": ["Apple Inc.", "Microsoft", "Tesla, Inc."],
+    "Symbol": ["AAPL", "MSFT", "TSLA"],
+})
+
+
+@pytest.fixture(autouse=True)
+def sp500(monkeypatch):
+    universe = smartchat_api.Sp500Universe(cache_path="unused.csv")
+    universe._set(SP500)
+    monkeypatch.setattr(smartchat_api, "universe", universe)
+
+
+@pytest.mark.parametrize("query, intent, targets", [
+    ("Can you recommend some stocks?", "recommend", []),
+    ("compare AAPL vs MSFT", "compare", ["AAPL", "MSFT"]),
+    ("Is microsoft better than apple or not", "compare", ["MSFT", "AAPL"]),
+    ("what's the price of $TSLA", "price", ["TSLA"]),
+    ("how much is apple inc. trading at", "price", ["AAPL"]),
+    ("latest news on Tesla", "summary", ["TSLA"]),
+    ("summarize the headlines for MSFT", "summary", ["MSFT"]),
+    ("how bullish is the sentiment on TSLA", "sentiment", ["TSLA"]),
+])
+def test_confident_fast_path(query, intent, targets):
+    got_intent, got_targets, confidence = classify_intent_fast(query)
+    assert (got_intent, got_targets) == (intent, targets)
+    assert confidence >= FAST_PATH_MIN_CONFIDENCE
+
+
+@pytest.mark.parametrize("query", [
+    "compare apple",  # one of two targets missing
+    "what's the price",  # no ticker
+    "price and news for AAPL",  # two intents, let the LLM decide
+    "summarize AAPL and MSFT news",
+])
+def test_ambiguous_queries_go_to_the_llm(query):
+    assert classify_intent_fast(query)[2] < FAST_PATH_MIN_CONFIDENCE
+
+
+def test_no_keyword_is_general():
+    assert classify_intent_fast("hello there, who are you?") == ("general", [], 0.0)
+
+
+@pytest.mark.parametrize("query", [
+    "What's your outlook for interest rates next year?",
+    "what is the mood like in crypto",
+])
+def test_sentiment_words_without_a_ticker_go_to_the_llm(query):
+    intent, targets, confidence = classify_intent_fast(query)
+    assert targets == []
+    assert confidence < FAST_PATH_MIN_CONFIDENCE
@@ -0,0 +1,63 @@
+import smartchat_api
+from smartchat_api import ASSISTANT_SYSTEM_PROMPT, LLMCache, LLMPrompt
+
+SNAPSHOT = {"price": 100, "pe_ratio": 20, "market_cap": "$1B"}
+
+
+def key(prompt, system_prompt=ASSISTANT_SYSTEM_PROMPT):
+    return LLMCache(db_path="").key(system_prompt, prompt)
+
+
+def test_plain_prompts_ignore_case_and_whitespace():
+    assert key("What is  a P/E ratio?") == key("  what is a\np/e RATIO? ")
+    assert key("What is a P/E ratio?") != key("What is an EPS?")
+    assert key("What is a P/E ratio?") != key("What is a P/E ratio?", system_prompt="Be terse.")
+
+
+def test_tagged_prompts_key_on_their_cache_key():
+    assert key(LLMPrompt("one wording", "topic:x")) == key(LLMPrompt("another wording", "topic:x"))
+    assert key(LLMPrompt("one wording", "topic:x")) != key("one wording")
+
+
+def test_comparison_is_shared_by_either_order_and_any_snapshot():
+    _, forward, _ = smartchat_api.build_comparison("AAPL", "MSFT", {"AAPL": SNAPSHOT, "MSFT": SNAPSHOT})
+    moved = {**SNAPSHOT, "price": 101}
+    _, backward, _ = smartchat_api.build_comparison("msft", "aapl", {"msft": moved, "aapl": SNAPSHOT})
+    assert key(forward) == key(backward)
+    _, other, _ = smartchat_api.build_comparison("AAPL", "TSLA", {"AAPL": SNAPSHOT, "TSLA": SNAPSHOT})
+    assert key(other) != key(forward)
+
+
+def test_news_summary_keys_on_company_and_headline_set():
+    headlines = ["Apple beats estimates", "iPhone  sales slow"]
+    _, first, _ = smartchat_api.build_news_summary("Apple", headlines, [])
+    _, reordered, _ = smartchat_api.build_news_summary("apple", ["iphone sales slow", "Apple beats estimates"], [])
+    _, newer, _ = smartchat_api.build_news_summary("Apple", headlines + ["Apple unveils a new Mac"], [])
+    assert key(first) == key(reordered)
+    assert key(first) != key(newer)
+    assert smartchat_api.build_news_summary(None, headlines, [])[1] is None
+
+
+def test_entries_expire_and_lru_evicts():
+    cache = LLMCache(ttl=60, maxsize=2, db_path="")
+    for name in ("a", "b", "c"):
+        cache.put(name, f"reply {name}", 10)
+    assert cache.get("a") is None
+    assert cache.get("c") == "reply c"
+
+    expired = LLMCache(ttl=0, db_path="")
+    expired.put("a", "reply", 10)
+    assert expired.get("a") is None
+
+
+def test_disk_tier_is_shared_and_counts_tokens_saved(tmp_path):
+    db_path = str(tmp_path / "llm.sqlite3")
+    LLMCache(db_path=db_path).put("k", "cached reply", 250)
+
+    other_worker = LLMCache(db_path=db_path)
+    assert other_worker.get("k") == "cached reply"
+    assert other_worker.get("k") == "cached reply"
+    assert other_worker.get("missing") is None
+    stats = other_worker.stats()
+    assert (stats["disk_hits"], stats["hits"], stats["misses"], stats["tokens_saved"]) == (1, 1, 1, 500)
+    assert stats["hit_ratio"] == round(2 / 3, 4)
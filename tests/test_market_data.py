@@ -0,0 +1,103 @@
+import threading
+import time
+
+import pytest
+
+from smartchat_api import MarketData, TTLCache
+
+
+class FakeProvider:
+    def __init__(self):
+        self.calls = []
+
+    def quote(self, ticker):
+        self.calls.append(("quote", ticker))
+        return {"lastPrice": 101.0, "previousClose": 100.0}
+
+    def info(self, ticker):
+        self.calls.append(("info", ticker))
+        return {"symbol": ticker, "sector": "Technology"}
+
+    def history(self, ticker, period):
+        self.calls.append(("history", ticker, period))
+        return {"ticker": ticker, "period": period}
+
+    def income_stmt(self, ticker):
+        self.calls.append(("income_stmt", ticker))
+        return {}
+
+
+def test_market_data_serves_repeat_lookups_from_cache():
+    provider = FakeProvider()
+    market = MarketData(provider)
+
+    assert market.quote("aapl") == market.quote("AAPL")
+    market.history("AAPL", "1d")
+    market.history("AAPL", "1y")
+    market.history("AAPL", "1d")
+
+    assert provider.calls == [("quote", "AAPL"), ("history", "AAPL", "1d"), ("history", "AAPL", "1y")]
+    assert market.stats()["quote"]["hits"] == 1
+
+
+def test_set_provider_invalidates_cached_values():
+    market = MarketData(FakeProvider())
+    market.info("MSFT")
+    replacement = FakeProvider()
+    market.set_provider(replacement)
+    market.info("MSFT")
+    assert replacement.calls == [("info", "MSFT")]
+
+
+def test_entries_expire_after_ttl():
+    cache = TTLCache("test", ttl=0.05, maxsize=10)
+    loads = []
+    cache.get_or_load("k", lambda: loads.append(1) or len(loads))
+    time.sleep(0.1)
+    assert cache.get_or_load("k", lambda: loads.append(1) or len(loads)) == 2
+
+
+def test_lru_eviction_keeps_maxsize():
+    cache = TTLCache("test", ttl=60, maxsize=2)
+    for key in ("a", "b", "c"):
+        cache.get_or_load(key, lambda: key)
+    assert cache.stats()["size"] == 2
+    assert cache.get_or_load("a", lambda: "reloaded") == "reloaded"
+
+
+def test_concurrent_misses_share_one_load():
+    cache = TTLCache("test", ttl=60, maxsize=10)
+    started, release = threading.Event(), threading.Event()
+    loads = []
+
+    def loader():
+        loads.append(1)
+        started.set()
+        release.wait(2)
+        return "value"
+
+    results = []
+    threads = [threading.Thread(target=lambda: results.append(cache.get_or_load("k", loader))) for _ in range(5)]
+    threads[0].start()
+    started.wait(2)
+    for thread in threads[1:]:
+        thread.start()
+    time.sleep(0.05)
+    release.set()
+    for thread in threads:
+        thread.join(2)
+
+    assert results == ["value"] * 5
+    assert len(loads) == 1
+    assert cache.stats()["coalesced"] == 4
+
+
+def test_failed_load_is_not_cached():
+    cache = TTLCache("test", ttl=60, maxsize=10)
+
+    def failing():
+        raise ValueError("provider down")
+
+    with pytest.raises(ValueError):
+        cache.get_or_load("k", failing)
+    assert cache.get_or_load("k", lambda: "ok") == "ok"
@@ -0,0 +1,95 @@
+import pandas as pd
+import pytest
+
+pytest.importorskip("tensorflow")
+import vertex_lstm_predictor as vlp  # noqa: E402
+
+
+def write_table(path, rows):
+    pd.DataFrame(rows, columns=["ticker", "date", "avg_sentiment", "article_count"]).to_csv(path, index=False)
+    return vlp.read_news_table(str(path))
+
+
+def test_read_news_table_filters_by_since(tmp_path):
+    fetch = write_table(tmp_path / "news.csv", [
+        ("AAPL", "2024-01-01", 0.1, 2),
+        ("AAPL", "2024-01-02", 0.2, 3),
+        ("MSFT", "2024-01-03", -0.5, 1),
+    ])
+    assert len(fetch(None)) == 3
+    assert fetch(pd.Timestamp("2024-01-02").date())['date'].dt.strftime("%Y-%m-%d").tolist() == ["2024-01-02", "2024-01-03"]
+
+
+def test_load_news_sentiment_merges_from_the_last_cached_day(tmp_path):
+    table, cache = tmp_path / "news.csv", str(tmp_path / "news.pkl")
+    write_table(table, [
+        ("AAPL", "2024-01-01", 0.1, 2),
+        ("AAPL", "2024-01-02", 0.2, 3),  # partial day, revised below
+    ])
+    first = vlp.load_news_sentiment(vlp.read_news_table(str(table)), cache)
+    assert len(first) == 2
+
+    fetch = write_table(table, [
+        ("AAPL", "2024-01-01", 0.9, 9),  # older days are not re-read
+        ("AAPL", "2024-01-02", 0.4, 5),
+        ("MSFT", "2024-01-03", -0.5, 1),
+    ])
+    seen = []
+
+    def recording_fetch(since):
+        seen.append(since)
+        return fetch(since)
+
+    merged = vlp.load_news_sentiment(recording_fetch, cache)
+    assert seen == [pd.Timestamp("2024-01-02").date()]
+    rows = merged.sort_values(['date', 'ticker'])
+    assert rows['ticker'].astype(str).tolist() == ["AAPL", "AAPL", "MSFT"]
+    assert rows['avg_sentiment'].tolist() == pytest.approx([0.1, 0.4, -0.5])
+    assert rows['article_count'].tolist() == [2, 5, 1]
+    assert str(merged['ticker'].dtype) == "category"
+    pd.testing.assert_frame_equal(pd.read_pickle(cache), merged)
+
+
+def test_load_news_sentiment_without_cache(tmp_path):
+    fetch = write_table(tmp_path / "news.csv", [("AAPL", "2024-01-01", 0.1, 2)])
+    calls = []
+    news = vlp.load_news_sentiment(lambda since: calls.append(since) or fetch(since), cache_path=None)
+    assert calls == [None]
+    assert news['avg_sentiment'].dtype == "float32"
+
+
+def test_sentiment_table_partitions_by_ticker(tmp_path):
+    fetch = write_table(tmp_path / "news.csv", [
+        ("AAPL", "2024-01-02", 0.2, 3),
+        ("MSFT", "2024-01-01", -0.5, 1),
+        ("AAPL", "2024-01-01", 0.1, 2),
+    ])
+    table = vlp.SentimentTable(vlp.load_news_sentiment(fetch, cache_path=None))
+    assert len(table) == 2
+    aapl = table.get("AAPL")
+    assert aapl.index.name == "date"
+    assert list(aapl.columns) == vlp.NEWS_COLUMNS
+    assert aapl.index.strftime("%Y-%m-%d").tolist() == ["2024-01-01", "2024-01-02"]
+    missing = table.get("NVDA")
+    assert missing.empty and list(missing.columns) == vlp.NEWS_COLUMNS
+
+
+def test_load_ticker_frame_joins_sentiment_by_date(tmp_path):
+    dates = pd.bdate_range("2024-01-01", periods=70)
+    fetch = write_table(tmp_path / "news.csv", [
+        ("AAPL", dates[0].strftime("%Y-%m-%d"), 0.3, 4),
+        ("AAPL", dates[5].strftime("%Y-%m-%d"), -0.2, 1),
+        ("MSFT", dates[1].strftime("%Y-%m-%d"), 0.9, 7),
+    ])
+    table = vlp.SentimentTable(vlp.load_news_sentiment(fetch, cache_path=None))
+    stock = pd.DataFrame({"Date": dates.strftime("%Y-%m-%d")[::-1], "Close": range(70)})
+
+    df = vlp.load_ticker_frame(stock, table.get("AAPL"))
+    assert df['date'].is_monotonic_increasing
+    assert len(df) == 70
+    assert df.set_index('date').loc[dates[0], 'avg_sentiment'] == pytest.approx(0.3)
+    assert df.set_index('date').loc[dates[5], 'article_count'] == 1
+    assert df['avg_sentiment'].notna().sum() == 2
+
+    assert vlp.load_ticker_frame(stock.head(64), table.get("AAPL")) is None
+    assert vlp.load_ticker_frame(stock, table.get("NVDA"))['avg_sentiment'].isna().all()
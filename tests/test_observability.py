@@ -0,0 +1,49 @@
+import pytest
+from fastapi.testclient import TestClient
+
+import smartchat_api
+from smartchat_api import Metrics, stage
+
+
+@pytest.fixture
+def metrics(monkeypatch):
+    metrics = Metrics()
+    monkeypatch.setattr(smartchat_api, "metrics", metrics)
+    return metrics
+
+
+def test_stages_are_not_recorded_as_dependencies(metrics):
+    with stage("/smartchat", "classify"):
+        pass
+    with pytest.raises(ValueError):
+        with stage("/smartchat", "reply"):
+            raise ValueError("boom")
+    text = metrics.render()
+    assert 'smartinvest_stage_seconds_count{route="/smartchat",stage="classify"} 1' in text
+    assert 'smartinvest_stage_errors_total{route="/smartchat",stage="reply"} 1' in text
+    assert "smartinvest_dependency" not in text
+
+
+@pytest.fixture
+def profiles(tmp_path, monkeypatch):
+    (tmp_path / "20240101T000000-smartchat-1500ms.html").write_text("<html></html>")
+    monkeypatch.setattr(smartchat_api, "PROFILE_DIR", str(tmp_path))
+    monkeypatch.setattr(smartchat_api, "PROFILE_SAMPLE_RATE", 0.1)
+    monkeypatch.setattr(smartchat_api, "PROFILE_TOKEN", "s3cret")
+    return TestClient(smartchat_api.app)
+
+
+def test_profiles_need_the_token(profiles):
+    assert profiles.get("/debug/profiles").status_code == 404
+    assert profiles.get("/debug/profiles", headers={"X-Profile-Token": "wrong"}).status_code == 404
+    listing = profiles.get("/debug/profiles", headers={"X-Profile-Token": "s3cret"})
+    assert listing.json() == ["20240101T000000-smartchat-1500ms.html"]
+    assert profiles.get(f"/debug/profiles/{listing.json()[0]}?token=s3cret").status_code == 200
+    assert profiles.get(f"/debug/profiles/{listing.json()[0]}").status_code == 404
+
+
+@pytest.mark.parametrize("rate, token", [(0, "s3cret"), (0.1, "")])
+def test_profiles_are_hidden_unless_enabled(profiles, monkeypatch, rate, token):
+    monkeypatch.setattr(smartchat_api, "PROFILE_SAMPLE_RATE", rate)
+    monkeypatch.setattr(smartchat_api, "PROFILE_TOKEN", token)
+    assert profiles.get("/debug/profiles", headers={"X-Profile-Token": token}).status_code == 404
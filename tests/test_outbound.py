@@ -0,0 +1,142 @@
+import asyncio
+import time
+
+import httpx
+import pytest
+
+from smartchat_api import CircuitBreaker, CircuitOpenError, OutboundClient, RateLimitedError, TokenBucket
+
+
+def scripted(statuses, calls, headers=None):
+    # MockTransport handler answering with the given statuses in order, then 200
+    def handler(request):
+        calls.append(request)
+        status = statuses[len(calls) - 1] if len(calls) <= len(statuses) else 200
+        return httpx.Response(status, json={"n": len(calls)}, headers=headers or {})
+    return handler
+
+
+def test_token_bucket_spends_burst_then_waits():
+    bucket = TokenBucket(rate=10.0, capacity=2)
+    assert bucket.reserve(0) == 0.0
+    assert bucket.reserve(0) == 0.0
+    assert bucket.reserve(0) is None
+    assert bucket.reserve(1.0) == pytest.approx(0.1, abs=0.02)
+
+
+def test_breaker_opens_after_consecutive_failures():
+    breaker = CircuitBreaker(failures=2, reset_after=60)
+    breaker.record(False)
+    breaker.record(True)
+    breaker.record(False)
+    assert breaker.allow()
+    breaker.record(False)
+    assert breaker.state == "open"
+    assert not breaker.allow()
+    assert breaker.rejected == 1
+
+
+def test_half_open_admits_a_single_trial_call():
+    breaker = CircuitBreaker(failures=1, reset_after=0.05)
+    breaker.record(False)
+    time.sleep(0.06)
+    assert [breaker.allow() for _ in range(3)] == [True, False, False]
+    breaker.record(False)
+    assert breaker.state == "open" and not breaker.allow()
+    time.sleep(0.06)
+    assert breaker.allow()
+    breaker.record(True)
+    assert breaker.state == "closed"
+    assert breaker.allow() and breaker.allow()
+
+
+def test_released_trial_lets_the_next_caller_probe():
+    breaker = CircuitBreaker(failures=1, reset_after=0.05)
+    breaker.record(False)
+    time.sleep(0.06)
+    assert breaker.allow()
+    breaker.release()
+    assert breaker.allow()
+
+
+def test_retries_transient_statuses():
+    calls = []
+    client = OutboundClient(transport=httpx.MockTransport(scripted([503, 429], calls)), backoff=0.001)
+    response = client.request("GET", "https://api.example.com/x", deadline=5)
+    assert response.status_code == 200
+    assert len(calls) == 3
+    assert client.stats()["retried"] == 2
+
+
+def test_gives_up_when_retries_run_out():
+    calls = []
+    client = OutboundClient(transport=httpx.MockTransport(scripted([502] * 10, calls)), retries=1, backoff=0.001)
+    assert client.request("GET", "https://api.example.com/x").status_code == 502
+    assert len(calls) == 2
+
+
+def test_open_breaker_fails_fast():
+    calls = []
+    client = OutboundClient(transport=httpx.MockTransport(scripted([500] * 10, calls)), retries=0)
+    client._breakers["api.example.com"] = CircuitBreaker(failures=2, reset_after=60)
+    for _ in range(2):
+        client.request("GET", "https://api.example.com/x")
+    with pytest.raises(CircuitOpenError):
+        client.request("GET", "https://api.example.com/x")
+    assert len(calls) == 2
+    assert client.stats()["breakers"]["api.example.com"]["state"] == "open"
+
+
+def test_rate_limit_is_enforced_per_key():
+    calls = []
+    client = OutboundClient(transport=httpx.MockTransport(scripted([], calls)))
+    client.limit("tiny", per_minute=1, burst=1)
+    client.request("GET", "https://api.example.com/x", limiter="tiny")
+    with pytest.raises(RateLimitedError):
+        client.request("GET", "https://api.example.com/x", limiter="tiny", deadline=0.5)
+    for _ in range(3):
+        client.request("GET", "https://api.example.com/x", limiter="unregistered")
+    assert len(calls) == 4
+
+
+def test_async_requests_share_the_retry_policy():
+    calls = []
+    client = OutboundClient(async_transport=httpx.MockTransport(scripted([503], calls)), backoff=0.001)
+
+    async def run():
+        response = await client.arequest("POST", "https://api.example.com/y", json={"q": 1})
+        async with client.astream("GET", "https://api.example.com/z") as streamed:
+            body = await streamed.aread()
+        await client.aclose()
+        return response, body
+
+    response, body = asyncio.run(run())
+    assert response.json() == {"n": 2}
+    assert body == b'{"n":3}'
+
+
+def test_retried_call_counts_once_towards_the_breaker():
+    calls = []
+    client = OutboundClient(transport=httpx.MockTransport(scripted([503] * 10, calls)), retries=2, backoff=0.001)
+    client._breakers["api.example.com"] = breaker = CircuitBreaker(failures=2, reset_after=60)
+    assert client.request("GET", "https://api.example.com/x").status_code == 503
+    assert len(calls) == 3
+    assert breaker.state == "closed"  # three failed attempts, one failed call
+    client.request("GET", "https://api.example.com/x")
+    assert breaker.state == "open"
+
+
+def test_call_that_recovers_on_retry_is_a_success():
+    calls = []
+    client = OutboundClient(async_transport=httpx.MockTransport(scripted([503, 503], calls)), backoff=0.001)
+    client._breakers["api.example.com"] = breaker = CircuitBreaker(failures=2, reset_after=60)
+    breaker.record(False)
+
+    async def run():
+        response = await client.arequest("GET", "https://api.example.com/x")
+        await client.aclose()
+        return response
+
+    assert asyncio.run(run()).status_code == 200
+    assert len(calls) == 3
+    assert breaker.state == "closed" and breaker._consecutive == 0
@@ -0,0 +1,131 @@
+from datetime import datetime, timedelta
+
+import pandas as pd
+import pytest
+from fastapi.testclient import TestClient
+
+import smartchat_api
+from smartchat_api import IndicatorsTable, MarketData, MemoryStore, PredictionsTable
+
+TODAY = datetime.utcnow().date().isoformat()
+
+
+def indicator_rows(as_of=TODAY, **overrides):
+    rows = pd.DataFrame({
+        "Ticker": ["SAFE", "MID", "WILD"],
+        "Close": [100.0, 100.0, 100.0],
+        "change_1d": [0.1, 0.5, 2.0],
+        "change_7d": [0.5, 1.0, 5.0],
+        "change_30d": [1.0, 2.0, 10.0],
+        "volatility": [0.5, 1.0, 4.0],
+        "risk": ["low", "medium", "high"],
+        "as_of": as_of,
+    })
+    for column, values in overrides.items():
+        rows[column] = values
+    return rows.to_csv(index=False)
+
+
+def prediction_rows():
+    return pd.DataFrame({
+        "Ticker": ["SAFE", "MID", "WILD"],
+        "Predicted_Close": [101.0, 103.0, 110.0],
+        "GICS Sector": ["Utilities", "Utilities", "Information Technology"],
+    }).to_csv(index=False)
+
+
+@pytest.fixture
+def tables():
+    store = MemoryStore()
+    store.write(IndicatorsTable.BLOB, indicator_rows())
+    store.write(PredictionsTable.BLOB, prediction_rows())
+    indicators = IndicatorsTable(store, check_interval=0)
+    return store, indicators, PredictionsTable(store, indicators, check_interval=0)
+
+
+def stocks(result):
+    return [row["stock"] for row in result]
+
+
+def test_top_ranks_within_the_accepted_risk_buckets(tables):
+    _, _, predictions = tables
+    sectors = ["utilities", "Information Technology"]
+    assert stocks(predictions.top(sectors, risk="low")) == ["SAFE"]
+    assert stocks(predictions.top(sectors, risk="medium")) == ["MID", "SAFE"]
+    assert stocks(predictions.top(sectors, risk="high")) == ["WILD", "MID", "SAFE"]
+    assert stocks(predictions.top(["Information Technology"], risk="HIGH")) == ["WILD"]
+
+
+def test_rankings_follow_blob_updates(tables):
+    store, _, predictions = tables
+    assert stocks(predictions.top(["utilities"], n=1, risk="high")) == ["MID"]
+    store.write(PredictionsTable.BLOB, prediction_rows().replace("101.0", "150.0"))
+    assert stocks(predictions.top(["utilities"], n=1, risk="high")) == ["SAFE"]
+
+
+def test_indicators_get(tables):
+    _, indicators, _ = tables
+    assert indicators.get("MID")["change_7d"] == 1.0
+    assert indicators.get("NOPE") is None
+
+
+@pytest.mark.parametrize("risk", ["unknown", "", None, "hgih"])
+def test_unrecognised_risk_ranks_as_medium(tables, risk):
+    _, _, predictions = tables
+    assert stocks(predictions.top(["utilities", "information technology"], risk=risk)) == ["MID", "SAFE"]
+
+
+def test_stale_indicator_rows_are_not_served():
+    store = MemoryStore()
+    store.write(IndicatorsTable.BLOB, indicator_rows(as_of=(datetime.utcnow() - timedelta(days=10)).date().isoformat()))
+    indicators = IndicatorsTable(store, check_interval=0)
+    assert indicators.get("MID") is None
+    assert indicators.get("MID", max_age_days=30)["change_7d"] == 1.0
+
+
+class PriceProvider:
+    def __init__(self, closes):
+        self.closes = closes
+
+    def history(self, ticker, period):
+        index = pd.bdate_range(end="2024-06-28", periods=len(self.closes))
+        return pd.DataFrame({"Close": self.closes}, index=index)
+
+    def info(self, ticker):
+        return {"trailingPE": 20.0, "recommendationKey": "buy"}
+
+
+@pytest.fixture
+def health(monkeypatch):
+    store = MemoryStore()
+    monkeypatch.setattr(smartchat_api, "indicators", IndicatorsTable(store, check_interval=0))
+
+    def serve(closes, table=None):
+        if table is not None:
+            store.write(IndicatorsTable.BLOB, table)
+        monkeypatch.setattr(smartchat_api, "market_data", MarketData(PriceProvider(closes)))
+        return TestClient(smartchat_api.app).get("/health", params={"ticker": "mid"})
+    return serve
+
+
+def test_health_serves_precomputed_rows(health):
+    response = health([1.0] * 30, table=indicator_rows())
+    assert response.status_code == 200
+    assert response.json()["change_7d"] == 1.0
+
+
+def test_health_for_a_short_history_ticker(health):
+    # 15 sessions: the batch job left change_30d empty, so the live fallback answers
+    closes = [100.0 + i for i in range(15)]
+    response = health(closes, table=indicator_rows(change_30d=[1.0, float("nan"), 10.0]))
+    assert response.status_code == 200
+    body = response.json()
+    assert body["change_30d"] == pytest.approx((114 / 100 - 1) * 100, abs=0.01)
+    assert body["change_7d"] == pytest.approx((114 / 109 - 1) * 100, abs=0.01)
+
+
+def test_health_sends_undefined_values_as_null(health):
+    response = health([100.0])
+    assert response.status_code == 200
+    assert response.json()["volatility"] is None
+    assert response.json()["change_1d"] == 0.0
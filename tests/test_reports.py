@@ -0,0 +1,66 @@
+import os
+import time
+
+import smartchat_api
+
+
+def test_cache_report_prunes_only_this_users_old_generations(tmp_path, monkeypatch):
+    monkeypatch.setattr(smartchat_api, "REPORT_CACHE_DIR", str(tmp_path))
+    smartchat_api.cache_report("bob-smith", 7, b"other user")
+    for generation in (1, 2, 3):
+        path = smartchat_api.cache_report("bob", generation, b"pdf %d" % generation)
+
+    assert sorted(os.listdir(tmp_path)) == ["bob-2.pdf", "bob-3.pdf", "bob-smith-7.pdf"]
+    with open(path, "rb") as f:
+        assert f.read() == b"pdf 3"
+
+
+def test_report_file_follows_the_blob_generation(tmp_path, monkeypatch):
+    monkeypatch.setattr(smartchat_api, "REPORT_CACHE_DIR", str(tmp_path))
+    store = smartchat_api.MemoryStore()
+    monkeypatch.setattr(smartchat_api, "store", store)
+    assert smartchat_api.report_file("alice") is None
+
+    store.write(smartchat_api.report_blob("alice"), b"v1")
+    first = smartchat_api.report_file("alice")
+    assert smartchat_api.report_file("alice") == first
+    store.write(smartchat_api.report_blob("alice"), b"v2")
+    second = smartchat_api.report_file("alice")
+    assert second != first
+    with open(second, "rb") as f:
+        assert f.read() == b"v2"
+
+
+def test_prune_report_cache_evicts_by_age_then_size(tmp_path, monkeypatch):
+    monkeypatch.setattr(smartchat_api, "REPORT_CACHE_DIR", str(tmp_path))
+    now = time.time()
+    for name, age in (("expired-1.pdf", 8 * 86400), ("old-1.pdf", 3600), ("older-1.pdf", 7200), ("new-1.pdf", 10)):
+        path = tmp_path / name
+        path.write_bytes(b"x" * 100)
+        os.utime(path, (now - age, now - age))
+
+    smartchat_api.prune_report_cache(max_bytes=1000, max_age=7 * 86400)
+    assert sorted(os.listdir(tmp_path)) == ["new-1.pdf", "old-1.pdf", "older-1.pdf"]
+    smartchat_api.prune_report_cache(max_bytes=150, max_age=7 * 86400)
+    assert sorted(os.listdir(tmp_path)) == ["new-1.pdf"]  # inside the grace period, even over budget
+
+
+def test_worker_survives_a_failing_job(tmp_path, monkeypatch):
+    monkeypatch.setattr(smartchat_api, "REPORT_CACHE_DIR", str(tmp_path))
+    monkeypatch.setattr(smartchat_api, "render_pdf_report", lambda username, stocks: b"%PDF")
+    real_cache_report = smartchat_api.cache_report
+
+    def cache_report(username, generation, data):
+        if username == "broken":
+            raise ValueError("unexpected")
+        return real_cache_report(username, generation, data)
+
+    monkeypatch.setattr(smartchat_api, "cache_report", cache_report)
+    jobs = smartchat_api.ReportJobs(smartchat_api.MemoryStore(), workers=1)
+    broken = jobs.submit("broken", [])
+    assert jobs.wait(broken["id"], 5)
+    assert jobs.status(broken["id"])["status"] == "failed"
+
+    ok = jobs.submit("alice", [])
+    assert jobs.wait(ok["id"], 5)
+    assert jobs.status(ok["id"])["status"] == "done"
@@ -0,0 +1,81 @@
+import asyncio
+import threading
+
+import smartchat_api
+from smartchat_api import SentimentEngine
+
+
+class FakeModel:
+    def __init__(self, gate=None):
+        self.batches = []
+        self.gate = gate
+
+    def __call__(self, texts, **kwargs):
+        if self.gate is not None:
+            self.gate.wait(2)
+        self.batches.append(list(texts))
+        return [{"label": "positive", "score": float(len(text))} for text in texts]
+
+
+def test_results_are_memoized():
+    model = FakeModel()
+    engine = SentimentEngine(lambda: model)
+    assert engine.score("rally") == {"label": "positive", "score": 5.0}
+    assert engine.score_many(["rally", "rally"]) == [{"label": "positive", "score": 5.0}] * 2
+    assert model.batches == [["rally"]]
+    assert engine.stats()["hits"] == 2
+
+
+def test_duplicate_texts_in_flight_are_scored_once():
+    gate = threading.Event()
+    model = FakeModel(gate)
+    engine = SentimentEngine(lambda: model, max_wait_ms=50)
+    first = engine.submit("first")
+    futures = [engine.submit(text) for text in ("a", "bb", "a")]
+    gate.set()
+    assert [future.result(2)["score"] for future in futures] == [1.0, 2.0, 1.0]
+    assert first.result(2)["score"] == 5.0
+    assert sorted(text for batch in model.batches for text in batch) == ["a", "bb", "first"]
+
+
+def test_worker_survives_cancelled_callers():
+    gate = threading.Event()
+    engine = SentimentEngine(lambda: FakeModel(gate))
+
+    async def cancel_while_scoring():
+        task = asyncio.ensure_future(engine.score_async("cancelled"))
+        await asyncio.sleep(0.05)
+        task.cancel()
+        await asyncio.gather(task, return_exceptions=True)
+        queued = asyncio.ensure_future(engine.score_async("never scored"))
+        await asyncio.sleep(0)
+        queued.cancel()
+        await asyncio.gather(queued, return_exceptions=True)
+
+    asyncio.run(cancel_while_scoring())
+    gate.set()
+    assert engine.submit("next").result(timeout=2)["score"] == 4.0
+    assert engine._worker.is_alive()
+
+
+def test_model_errors_reach_every_caller():
+    def broken(texts, **kwargs):
+        raise RuntimeError("model failed")
+
+    engine = SentimentEngine(lambda: broken)
+    future = engine.submit("text")
+    assert isinstance(future.exception(timeout=2), RuntimeError)
+    assert engine.submit("again").exception(timeout=2) is not None
+
+
+def test_alerts_are_served_unscored_when_the_model_fails(monkeypatch):
+    async def fetch_finnhub(url):
+        return [{"headline": "Stocks rally", "datetime": 1700000000, "url": "https://example.com/a"}]
+
+    def broken_model():
+        raise OSError("model download failed")
+
+    monkeypatch.setattr(smartchat_api, "fetch_finnhub", fetch_finnhub)
+    monkeypatch.setattr(smartchat_api, "sentiment_engine", SentimentEngine(broken_model))
+    alerts = asyncio.run(smartchat_api.load_alerts())
+    assert [(a["title"], a["sentiment"]) for a in alerts] == [("Stocks rally", None)]
@@ -0,0 +1,81 @@
+import time
+
+from smartchat_api import SessionHistory
+
+
+def queries(turns):
+    return [turn["userQuery"] for turn in turns]
+
+
+def test_page_returns_newest_turns_oldest_first(tmp_path):
+    history = SessionHistory(db_path=str(tmp_path / "h.db"), per_user=5)
+    for i in range(8):
+        history.append("alice", f"q{i}", "r")
+    page = history.page("alice", limit=3)
+    assert queries(page) == ["q5", "q6", "q7"]
+    assert [turn["id"] for turn in page] == sorted(turn["id"] for turn in page)
+
+
+def test_before_pages_back_past_the_ring_buffer(tmp_path):
+    history = SessionHistory(db_path=str(tmp_path / "h.db"), per_user=3)
+    for i in range(8):
+        history.append("alice", f"q{i}", "r")
+    newest = history.page("alice", limit=3)
+    older = history.page("alice", limit=3, before=newest[0]["id"])
+    oldest = history.page("alice", limit=3, before=older[0]["id"])
+    assert queries(older) == ["q2", "q3", "q4"]
+    assert queries(oldest) == ["q0", "q1"]
+
+
+def test_restart_rehydrates_from_sqlite(tmp_path):
+    path = str(tmp_path / "h.db")
+    first = SessionHistory(db_path=path)
+    first.append("alice", "before restart", "r")
+    first.flush()
+    second = SessionHistory(db_path=path)
+    second.append("alice", "after restart", "r")
+    assert queries(second.page("alice")) == ["before restart", "after restart"]
+
+
+def test_evicted_users_are_read_back(tmp_path):
+    history = SessionHistory(db_path=str(tmp_path / "h.db"), max_users=1)
+    history.append("alice", "hello", "r")
+    history.append("bob", "hi", "r")
+    assert history.stats()["users"] == 1
+    assert queries(history.page("alice")) == ["hello"]
+
+
+def test_ids_are_unique_across_processes_sharing_the_database(tmp_path):
+    path = str(tmp_path / "h.db")
+    workers = [SessionHistory(db_path=path), SessionHistory(db_path=path)]
+    for i in range(3):
+        for n, worker in enumerate(workers):
+            worker.append("alice", f"w{n}-{i}", "r")
+    for worker in workers:
+        worker.flush()
+
+    shared = SessionHistory(db_path=path, shared=True)
+    page = shared.page("alice", limit=10)
+    assert sorted(queries(page)) == sorted(f"w{n}-{i}" for n in range(2) for i in range(3))
+    assert len({turn["id"] for turn in page}) == 6
+
+
+def test_shared_mode_sees_other_workers_turns(tmp_path):
+    path = str(tmp_path / "h.db")
+    mine, other = SessionHistory(db_path=path, shared=True), SessionHistory(db_path=path, shared=True)
+    for i in range(3):
+        mine.append("alice", f"mine{i}", "r")
+    other.append("alice", "other", "r")
+    other.flush()
+    # Ids follow commit order, so "other" (flushed first) sorts before this worker's pending turns
+    assert queries(mine.page("alice")) == ["other", "mine0", "mine1", "mine2"]
+
+
+def test_writes_are_batched_in_the_background(tmp_path):
+    history = SessionHistory(db_path=str(tmp_path / "h.db"), flush_interval=0.05)
+    for i in range(5):
+        history.append("alice", f"q{i}", "r")
+    deadline = time.monotonic() + 2
+    while history.written < 5 and time.monotonic() < deadline:
+        time.sleep(0.01)
+    assert history.written == 5
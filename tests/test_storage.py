@@ -0,0 +1,41 @@
+import pytest
+from google.api_core.exceptions import PreconditionFailed
+
+from smartchat_api import GCSStore, MemoryStore
+
+
+def test_write_returns_increasing_generations():
+    store = MemoryStore()
+    first = store.write("a.json", "{}")
+    second = store.write("a.json", "[]")
+    assert second > first
+    assert store.read_with_generation("a.json") == (b"[]", second)
+    assert store.read_text("missing.json") is None
+    assert store.generation("missing.json") == 0
+
+
+def test_generation_preconditions():
+    store = MemoryStore()
+    generation = store.write("users/bob.json", "{}", if_generation_match=0)
+    with pytest.raises(PreconditionFailed):
+        store.write("users/bob.json", "{}", if_generation_match=0)
+    with pytest.raises(PreconditionFailed):
+        store.write("users/bob.json", "{}", if_generation_match=generation + 1)
+    store.write("users/bob.json", '{"v": 2}', if_generation_match=generation)
+    assert store.read_text("users/bob.json") == '{"v": 2}'
+
+
+def test_batch_helpers():
+    store = MemoryStore()
+    generations = store.write_many([("r/a.pdf", b"a", "application/pdf"), ("r/b.pdf", b"b", "application/pdf")])
+    assert len(set(generations)) == 2
+    assert store.list_names("r/") == ["r/a.pdf", "r/b.pdf"]
+    assert store.read_many(["r/a.pdf", "r/x.pdf"]) == {"r/a.pdf": b"a", "r/x.pdf": None}
+    store.delete_many(["r/a.pdf"])
+    assert store.list_names("r/") == ["r/b.pdf"]
+
+
+def test_gcs_store_connects_lazily():
+    # Constructing the store must not need credentials; the client is built on first use
+    store = GCSStore("some-bucket")
+    assert store._handles is None
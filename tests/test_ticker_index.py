@@ -0,0 +1,56 @@
+import pytest
+
+from smartchat_api import TickerIndex
+
+LOOKUP = {
+    "apple inc.": "AAPL",
+    "microsoft": "MSFT",
+    "united parcel service": "UPS",
+    "dow inc.": "DOW",
+    "berkshire hathaway": "BRK.B",
+    "at&t": "T",
+}
+
+
+@pytest.fixture(scope="module")
+def index():
+    return TickerIndex(LOOKUP)
+
+
+def test_scan_returns_positions_and_scores(index):
+    query = "Compare Apple and $msft"
+    matches = index.scan(query)
+    assert [(query[start:end], symbol) for start, end, symbol, _ in matches] == [("Apple", "AAPL"), ("msft", "MSFT")]
+    assert all(score >= 2 for *_, score in matches)
+
+
+def test_matches_need_word_boundaries(index):
+    assert index.tickers("pineapples and microsofts") == []
+
+
+def test_aliases_and_dotted_symbols(index):
+    assert index.tickers("berkshire vs BRK-B vs at&t") == ["BRK.B", "T"]
+
+
+def test_tickers_keep_query_order_without_duplicates(index):
+    assert index.tickers("MSFT or apple, then MSFT again") == ["MSFT", "AAPL"]
+
+
+def test_single_letter_symbols_need_a_dollar_sign(index):
+    assert index.tickers("is T a buy") == []
+    assert index.tickers("is $T a buy") == ["T"]
+
+
+@pytest.mark.parametrize("query", ["ups and downs of the market", "how is the dow doing", "dow"])
+def test_best_ignores_everyday_words(index, query):
+    assert index.best(query) is None
+
+
+@pytest.mark.parametrize("query, expected", [
+    ("UPS earnings", "UPS"),
+    ("$dow outlook", "DOW"),
+    ("news about apple", "AAPL"),
+    ("united parcel service guidance", "UPS"),
+])
+def test_best_picks_the_strongest_match(index, query, expected):
+    assert index.best(query) == expected
@@ -0,0 +1,55 @@
+import pandas as pd
+import pytest
+
+import smartchat_api
+from smartchat_api import Sp500Universe
+
+TABLE = pd.DataFrame({"Security": ["Apple Inc.", "Acme Corp"], "Symbol": ["AAPL", "ACME"]})
+
+
+def offline():
+    raise OSError("network unreachable")
+
+
+@pytest.fixture
+def universe(tmp_path):
+    universe = Sp500Universe(cache_path=str(tmp_path / "sp500.csv"), retry_after=3600)
+    universe._fetch = offline
+    return universe
+
+
+def test_snapshot_is_served_without_fetching(universe):
+    TABLE.to_csv(universe.cache_path, index=False)
+    assert universe.index.best("how is acme corp doing") == "ACME"
+    assert not universe.fallback
+
+
+def test_offline_without_snapshot_serves_the_bundled_list(universe):
+    assert universe.index.best("what's the price of apple") == "AAPL"
+    assert universe.fallback
+    assert len(universe.lookup) == len(smartchat_api.SP500_FALLBACK)
+    assert smartchat_api.component_status["sp500"]["fallback"] is True
+
+
+def test_fallback_is_replaced_once_a_fetch_succeeds(universe, monkeypatch):
+    universe.load()
+    refreshes = []
+    monkeypatch.setattr(universe, "refresh_in_background", lambda: refreshes.append(1))
+    universe.load()
+    assert refreshes == []  # still inside retry_after
+
+    universe.retry_after = 0
+    universe.load()
+    assert refreshes == [1]
+
+    universe._fetch = lambda: TABLE
+    universe.refresh()
+    assert not universe.fallback
+    assert universe.index.best("acme corp") == "ACME"
+
+
+def test_failed_retry_keeps_the_fallback(universe):
+    universe.load()
+    universe.refresh()
+    assert universe.fallback
+    assert universe.index.best("apple") == "AAPL"
@@ -0,0 +1,31 @@
+from smartchat_api import MemoryStore, UserStore
+
+
+def test_register_is_create_only():
+    users = UserStore(MemoryStore())
+    assert users.add("alice", "pw1")
+    assert not users.add("alice", "pw2")
+    assert users.get("alice")["password"] == "pw1"
+
+
+def test_records_are_shared_through_the_store():
+    store = MemoryStore()
+    UserStore(store).add("alice", "pw")
+    assert UserStore(store).get("alice")["password"] == "pw"
+
+
+def test_legacy_csv_migrates_newest_row_per_user():
+    store = MemoryStore()
+    store.write("users.csv", "bob,old\nalice,a\nbob,new\nbroken\n")
+    users = UserStore(store)
+    assert users.get("bob")["password"] == "new"
+    assert users.get("alice")["password"] == "a"
+    assert store.read_bytes(UserStore.MIGRATION_MARKER) is not None
+
+
+def test_migration_runs_once():
+    store = MemoryStore()
+    store.write("users.csv", "bob,pw\n")
+    UserStore(store).get("bob")
+    store.write("users.csv", "carol,pw\n")
+    assert UserStore(store).get("carol") is None
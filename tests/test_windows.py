@@ -0,0 +1,69 @@
+import numpy as np
+import pandas as pd
+import pytest
+from sklearn.preprocessing import MinMaxScaler
+
+pytest.importorskip("tensorflow")
+import vertex_lstm_predictor as vlp  # noqa: E402
+
+LOOKBACK = 10
+
+
+def naive_windows(df, lookback):
+    # The Python loop prepare_lstm_data used before it took strided views
+    df = df[['date', 'Close']].dropna().sort_values('date')
+    scaler = MinMaxScaler()
+    scaled = scaler.fit_transform(df[['Close']])
+    X, y = [], []
+    for i in range(lookback, len(scaled)):
+        X.append(scaled[i - lookback:i])
+        y.append(scaled[i])
+    return np.array(X), np.array(y), scaler
+
+
+def frame(rows=40, seed=0):
+    # Unsorted dates, a missing close and days without news, as after the sentiment join
+    rng = np.random.default_rng(seed)
+    df = pd.DataFrame({
+        "date": pd.bdate_range("2024-01-01", periods=rows),
+        "Close": 100 + rng.normal(0, 1, rows).cumsum(),
+        "avg_sentiment": np.where(rng.random(rows) < 0.3, np.nan, rng.uniform(-1, 1, rows)),
+        "article_count": rng.integers(0, 5, rows).astype(float),
+    })
+    df.loc[7, "Close"] = np.nan
+    return df.sample(frac=1, random_state=seed)
+
+
+def test_close_only_matches_the_loop():
+    df = frame()
+    X, y, scaler = vlp.prepare_lstm_data(df, LOOKBACK)
+    X_ref, y_ref, _ = naive_windows(df, LOOKBACK)
+    assert X.shape == X_ref.shape == (39 - LOOKBACK, LOOKBACK, 1)
+    assert X.dtype == y.dtype == np.float32
+    np.testing.assert_allclose(X, X_ref, atol=1e-6)
+    np.testing.assert_allclose(y, y_ref, atol=1e-6)
+    closes = df.dropna(subset=["Close"]).sort_values("date")["Close"].to_numpy()
+    np.testing.assert_allclose(scaler.inverse_transform(y)[:, 0], closes[LOOKBACK:], rtol=1e-5)
+
+
+def test_windows_are_views_over_one_block():
+    X, y, _ = vlp.prepare_lstm_data(frame(), LOOKBACK)
+    assert np.shares_memory(X, y)
+    np.testing.assert_array_equal(X[1:, -1, 0], y[:-1, 0])  # each target is the next window's last close
+
+
+def test_extra_features_keep_close_first():
+    cols = ("Close", "avg_sentiment", "article_count")
+    X, y, _ = vlp.prepare_lstm_data(frame(), LOOKBACK, feature_cols=cols)
+    X_close, y_close, _ = vlp.prepare_lstm_data(frame(), LOOKBACK)
+    assert X.shape[2] == 3
+    np.testing.assert_array_equal(X[..., :1], X_close)
+    np.testing.assert_array_equal(y, y_close)
+    assert not np.isnan(X).any()
+    assert X.min() >= 0 and X.max() <= 1
+
+
+def test_history_of_exactly_lookback_rows_has_no_windows():
+    df = frame(rows=LOOKBACK + 1)  # one close is missing
+    X, y, _ = vlp.prepare_lstm_data(df, LOOKBACK)
+    assert X.shape == (0, LOOKBACK, 1) and y.shape == (0, 1)
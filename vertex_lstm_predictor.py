@@ -1,35 +1,84 @@
 
 import numpy as np
 import pandas as pd
-from tensorflow.keras.models import Sequential
-from tensorflow.keras.layers import LSTM, Dense, Dropout
+from numpy.lib.stride_tricks import sliding_window_view
+from tensorflow.keras.models import Sequential, Model, load_model
+from tensorflow.keras.layers import LSTM, Dense, Dropout, Input, Embedding, Flatten, Concatenate
+from tensorflow.keras.utils import Sequence
 from sklearn.preprocessing import MinMaxScaler
 from google.cloud import storage, bigquery
 import joblib
-import os, io, glob
+import os, io, glob, sys
+import time
+import json
+import hashlib
+import tempfile
+from datetime import datetime
+import argparse
+import multiprocessing
+from concurrent.futures import ProcessPoolExecutor, ThreadPoolExecutor, as_completed
 
 # === CONFIG ===
 BUCKET_NAME = "financial-advisor-chatbot-stock-data"
 PREDICTION_OUTPUT = "predicted_vs_actual_stock_prices.csv"
 GCS_OUTPUT_BLOB = f"predictions/{PREDICTION_OUTPUT}"
+ERRORS_OUTPUT = "prediction_errors.csv"
+GCS_ERRORS_BLOB = f"predictions/{ERRORS_OUTPUT}"
 PROJECT_ID = "smartinvest-ai"
+LOOKBACK = 60
+# Close must come first; it is the prediction target
+FEATURE_COLUMNS = ['Close', 'avg_sentiment', 'article_count']
+GLOBAL_EPOCHS = 15
+GLOBAL_BATCH_SIZE = 512
+FINE_TUNE_EPOCHS = 3
+INFERENCE_BATCH_SIZE = 4096
+GLOBAL_CHECKPOINT = "_global"  # checkpoint "ticker" holding the shared model
+# Local directory or gs://bucket/prefix (e.g. gs://<BUCKET_NAME>/checkpoints); unset, nothing is checkpointed
+CHECKPOINT_DIR = os.getenv("CHECKPOINT_DIR", "")
+INGEST_THREADS = int(os.getenv("INGEST_THREADS", "16"))
+# Folder holding the *_Historical_Data.csv blobs; listing does not descend into subfolders (checkpoints/, ...)
+STOCK_DATA_PREFIX = os.getenv("STOCK_DATA_PREFIX", "")
+# Parsed price history cached as memory-mappable <ticker>@<generation>.npy files
+INGEST_CACHE_DIR = os.getenv("INGEST_CACHE_DIR", os.path.join(tempfile.gettempdir(), "stock_cache"))
+PRICE_DTYPE = np.dtype([("date", "datetime64[ns]"), ("close", "float32")])
+NEWS_TABLE = "smartinvest-ai.news_data.news_sentiment_scores"
+# Daily sentiment aggregates already fetched from BigQuery; reruns only query newer days
+NEWS_CACHE_PATH = os.getenv("NEWS_CACHE_PATH", os.path.join(tempfile.gettempdir(), "news_sentiment.pkl"))
+NEWS_COLUMNS = ['avg_sentiment', 'article_count']
+INDICATORS_BLOB = "indicators/latest.csv"
+INDICATOR_SERIES_BLOB = "indicators/series.csv"
+SERIES_DAYS = 126  # ~6 months of closes and 7-day SMA kept for /forecast
 
 # === Data Prep ===
-def prepare_lstm_data(df, lookback=60):
-    df = df[['date', 'Close']].dropna().sort_values('date')
-    scaler = MinMaxScaler()
-    scaled = scaler.fit_transform(df[['Close']])
+def scale_features(df, feature_cols=('Close',), scalers=None):
+    # One float32 (rows, features) block plus one scaler per feature (Close first, it inverts
+    # predictions). Pass stored scalers to transform with them instead of refitting.
+    feature_cols = ['Close'] + [c for c in feature_cols if c != 'Close']
+    df = df[['date'] + feature_cols].dropna(subset=['date', 'Close']).sort_values('date')
+    # Days without news have no sentiment rows after the left join
+    values = df[feature_cols].fillna(0)
+    if scalers is None:
+        scalers = [MinMaxScaler().fit(values[[col]]) for col in feature_cols]
+    columns = [scaler.transform(values[[col]]) for col, scaler in zip(feature_cols, scalers)]
+    return np.hstack(columns).astype(np.float32), scalers
 
-    X, y = [], []
-    for i in range(lookback, len(scaled)):
-        X.append(scaled[i-lookback:i])
-        y.append(scaled[i])
-    return np.array(X), np.array(y), scaler
+def build_windows(df, lookback=LOOKBACK, feature_cols=('Close',), scalers=None):
+    # Returns (X, y, latest, scalers); latest is the most recent `lookback` rows, for next-day inference
+    scaled, scalers = scale_features(df, feature_cols, scalers)
+
+    # Strided views over `scaled`: (rows - lookback + 1, features, lookback) -> (windows, lookback, features).
+    # The last window has no next-day target, so it is only used as `latest`.
+    windows = sliding_window_view(scaled, lookback, axis=0).transpose(0, 2, 1)
+    return windows[:-1], scaled[lookback:, :1], windows[-1:], scalers
+
+def prepare_lstm_data(df, lookback=LOOKBACK, feature_cols=('Close',)):
+    X, y, _, scalers = build_windows(df, lookback, feature_cols)
+    return X, y, scalers[0]
 
 # === Model ===
 def train_lstm_model(X, y):
     model = Sequential([
-        LSTM(64, return_sequences=True, input_shape=(X.shape[1], 1)),
+        LSTM(64, return_sequences=True, input_shape=(X.shape[1], X.shape[2])),
         Dropout(0.2),
         LSTM(64),
         Dropout(0.2),
@@ -39,74 +88,686 @@ def train_lstm_model(X, y):
     model.fit(X, y, epochs=15, batch_size=32, verbose=0)
     return model
 
-# === Main Vertex-Compatible Prediction Logic ===
-def main():
-    # GCS setup
-    storage_client = storage.Client()
-    bucket = storage_client.bucket(BUCKET_NAME)
+def build_global_model(lookback, n_features, n_tickers, embedding_dim=8):
+    # Shared LSTM over every ticker's (per-ticker min-max scaled) windows plus a learned ticker embedding
+    window = Input(shape=(lookback, n_features), name="window")
+    ticker_id = Input(shape=(1,), dtype="int32", name="ticker_id")
+    x = LSTM(64, return_sequences=True)(window)
+    x = Dropout(0.2)(x)
+    x = LSTM(64)(x)
+    x = Dropout(0.2)(x)
+    embedding = Flatten()(Embedding(n_tickers, embedding_dim)(ticker_id))
+    x = Concatenate()([x, embedding])
+    x = Dense(32, activation="relu")(x)
+    model = Model([window, ticker_id], Dense(1)(x))
+    model.compile(optimizer='adam', loss='mse')
+    return model
+
+class WindowBatches(Sequence):
+    """Shuffled training batches drawn from every ticker's strided window views.
 
-    # Download all historical stock files
-    os.makedirs("/tmp/stock_data", exist_ok=True)
-    stock_files = []
-    for blob in bucket.list_blobs():
-        if blob.name.endswith("_Historical_Data.csv"):
-            local_path = f"/tmp/stock_data/{os.path.basename(blob.name)}"
-            blob.download_to_filename(local_path)
-            stock_files.append(local_path)
-
-    # Load sentiment from BigQuery
-    bq_client = bigquery.Client(project=PROJECT_ID)
-    query = """
-    SELECT
-      ticker,
-      DATE(published_at) AS date,
-      AVG(sentiment_score) AS avg_sentiment,
-      COUNT(*) AS article_count
-    FROM
-      `smartinvest-ai.news_data.news_sentiment_scores`
-    GROUP BY
-      ticker, date
-    ORDER BY
-      date
+    Only the current batch is copied out of the views, so memory stays at one batch
+    rather than one concatenated array of every ticker's windows.
     """
-    news_df = bq_client.query(query).to_dataframe()
-    news_df['date'] = pd.to_datetime(news_df['date'])
+    def __init__(self, datasets, batch_size=GLOBAL_BATCH_SIZE, shuffle=True):
+        super().__init__()
+        self.datasets = datasets
+        self.batch_size = batch_size
+        self.shuffle = shuffle
+        # (ticker id, window position) for every training window
+        self.index = np.concatenate([
+            np.column_stack([np.full(len(X), i), np.arange(len(X))]) for i, (_, X, _) in enumerate(datasets)
+        ]).astype(np.int32)
+        self.on_epoch_end()
 
-    # Predict
-    results = []
-    for file_path in stock_files:
-        ticker = os.path.basename(file_path).split('_')[0]
-        try:
-            stock_df = pd.read_csv(file_path)
-            stock_df['Date'] = pd.to_datetime(stock_df['Date'])
-            stock_df.rename(columns={"Date": "date"}, inplace=True)
+    def __len__(self):
+        return -(-len(self.index) // self.batch_size)
+
+    def __getitem__(self, batch):
+        ids, positions = self.index[self.order[batch * self.batch_size:(batch + 1) * self.batch_size]].T
+        X = np.stack([self.datasets[i][1][p] for i, p in zip(ids, positions)])
+        y = np.stack([self.datasets[i][2][p] for i, p in zip(ids, positions)])
+        return {"window": X, "ticker_id": ids}, y
+
+    def on_epoch_end(self):
+        self.order = np.random.permutation(len(self.index)) if self.shuffle else np.arange(len(self.index))
+
+def train_global_model(datasets, epochs=GLOBAL_EPOCHS, batch_size=GLOBAL_BATCH_SIZE):
+    # datasets: [(ticker, X, y)]; ticker ids are positions in this list
+    if not datasets:
+        raise ValueError("No ticker has enough history to train the global model")
+    _, X, _ = datasets[0]
+    model = build_global_model(X.shape[1], X.shape[2], len(datasets))
+    model.fit(WindowBatches(datasets, batch_size), epochs=epochs, verbose=0)
+    return model
+
+def predict_global(model, windows, ids, batch_size=4096):
+    # One batched call for the whole universe
+    return model.predict({"window": np.concatenate(windows), "ticker_id": np.asarray(ids, dtype=np.int32)},
+                         batch_size=batch_size, verbose=0)[:, 0]
+
+# === Ingestion ===
+def parse_stock_csv(data):
+    # Only the columns the models use, with compact dtypes; dates normalised to naive midnight
+    df = pd.read_csv(io.BytesIO(data), usecols=['Date', 'Close'], dtype={'Close': 'float32'})
+    df['Date'] = pd.to_datetime(df['Date'], utc=True).dt.tz_localize(None).dt.normalize()
+    return df
+
+def load_stock_blob(blob, cache_dir=INGEST_CACHE_DIR):
+    ticker = os.path.basename(blob.name).split('_')[0]
+    # "@" cannot appear in a ticker, so one ticker's glob never matches another's files (BRK vs BRK-B)
+    cache_path = os.path.join(cache_dir, f"{ticker}@{blob.generation}.npy")
+    if os.path.exists(cache_path):
+        prices = np.load(cache_path, mmap_mode='r')
+    else:
+        df = parse_stock_csv(blob.download_as_bytes())
+        prices = np.empty(len(df), dtype=PRICE_DTYPE)
+        prices["date"] = df['Date'].to_numpy()
+        prices["close"] = df['Close'].to_numpy()
+        os.makedirs(cache_dir, exist_ok=True)
+        for stale in glob.glob(os.path.join(cache_dir, f"{ticker}@*.npy")):
+            os.remove(stale)
+        tmp_path = cache_path + ".tmp"
+        with open(tmp_path, "wb") as f:
+            np.save(f, prices)
+        os.replace(tmp_path, cache_path)
+    return pd.DataFrame({"Date": prices["date"], "Close": prices["close"]})
+
+def stream_stock_frames(bucket, errors, threads=INGEST_THREADS, cache_dir=INGEST_CACHE_DIR, limit=None):
+    """Yield (ticker, stock_df) for every *_Historical_Data.csv blob as soon as it is parsed.
+
+    Downloads run on a bounded thread pool, so training can start on the first tickers
+    while the rest are still streaming in. Only the first `limit` blobs are read when given.
+    Failures are appended to errors.
+    """
+    blobs = [blob for blob in bucket.list_blobs(prefix=STOCK_DATA_PREFIX, delimiter="/")
+             if blob.name.endswith("_Historical_Data.csv")][:limit]
+    with ThreadPoolExecutor(max_workers=threads) as pool:
+        futures = {pool.submit(load_stock_blob, blob, cache_dir): os.path.basename(blob.name).split('_')[0]
+                   for blob in blobs}
+        for future in as_completed(futures):
+            ticker = futures[future]
+            try:
+                yield ticker, future.result()
+            except Exception as e:
+                print(f"⚠️ Error loading {ticker}: {e}")
+                errors.append({"Ticker": ticker, "Error": f"ingest: {e}"})
+
+# === News Sentiment ===
+NEWS_QUERY = f"""
+SELECT
+  ticker,
+  DATE(published_at) AS date,
+  AVG(sentiment_score) AS avg_sentiment,
+  COUNT(*) AS article_count
+FROM
+  `{NEWS_TABLE}`
+WHERE
+  @since IS NULL OR DATE(published_at) >= @since
+GROUP BY
+  ticker, date
+"""
+
+def query_news_sentiment(client, since=None):
+    job_config = bigquery.QueryJobConfig(query_parameters=[
+        bigquery.ScalarQueryParameter("since", "DATE", since),
+    ])
+    return client.query(NEWS_QUERY, job_config=job_config).to_dataframe()
+
+def load_news_sentiment(fetch, cache_path=NEWS_CACHE_PATH):
+    """Daily (ticker, date) sentiment aggregates, cached locally between runs.
+
+    fetch(since) returns the aggregates for days >= since (all days when since is None).
+    The last cached day is fetched again since it may have been partial.
+    """
+    cached = pd.read_pickle(cache_path) if cache_path and os.path.exists(cache_path) else None
+    since = cached['date'].max().date() if cached is not None and len(cached) else None
+
+    fresh = fetch(since)
+    fresh['date'] = pd.to_datetime(fresh['date'])
+    if since is not None:
+        cached = cached[cached['date'] < pd.Timestamp(since)]
+        fresh = pd.concat([cached.astype({'ticker': str}), fresh], ignore_index=True)
+    news_df = fresh.astype({'ticker': 'category', 'avg_sentiment': 'float32', 'article_count': 'float32'})
+    print(f"📰 Sentiment rows: {len(news_df)} ({'all days' if since is None else f'refreshed from {since}'})")
+
+    if cache_path:
+        tmp_path = cache_path + ".tmp"
+        news_df.to_pickle(tmp_path)
+        os.replace(tmp_path, cache_path)
+    return news_df
+
+class SentimentTable:
+    """News sentiment partitioned by ticker once, each partition indexed by date."""
+
+    def __init__(self, news_df):
+        self._by_ticker = {
+            str(ticker): group.set_index('date')[NEWS_COLUMNS].sort_index()
+            for ticker, group in news_df.groupby('ticker', observed=True)
+        }
+        self._empty = pd.DataFrame(columns=NEWS_COLUMNS, index=pd.DatetimeIndex([], name='date'), dtype='float32')
+        # The next load_news_sentiment refetches from this day on, so rows from here may still change
+        self.last_date = news_df['date'].max() if len(news_df) else None
+
+    def __len__(self):
+        return len(self._by_ticker)
+
+    def get(self, ticker):
+        return self._by_ticker.get(ticker, self._empty)
+
+def read_news_table(path):
+    # Local stand-in for the BigQuery table: CSV or Parquet with the NEWS_QUERY columns
+    def fetch(since):
+        df = pd.read_parquet(path) if path.endswith(".parquet") else pd.read_csv(path)
+        df['date'] = pd.to_datetime(df['date'])
+        return df if since is None else df[df['date'] >= pd.Timestamp(since)]
+    return fetch
+
+# === Per-Ticker Training ===
+def load_ticker_frame(stock_df, ticker_news):
+    # ticker_news is one SentimentTable partition, indexed by date
+    stock_df = stock_df.assign(Date=pd.to_datetime(stock_df['Date'])).rename(columns={"Date": "date"})
+
+    df = stock_df.join(ticker_news, on='date')
+    df = df.sort_values('date')
+
+    if df.shape[0] < 65:
+        return None
+    return df
+
+def init_worker(tf_threads):
+    # Runs once per worker process, before any TensorFlow op, so the caps take effect
+    import tensorflow as tf
+    try:
+        tf.config.threading.set_intra_op_parallelism_threads(tf_threads)
+        tf.config.threading.set_inter_op_parallelism_threads(1)
+    except RuntimeError:
+        pass  # runtime already initialised in this process (serial mode)
+
+def train_all(jobs, workers, tf_threads, task=None, task_args=(), errors=None):
+    """Run task(ticker, stock_df, ticker_news, *task_args) for every job on a pool of worker processes.
+
+    jobs may be a generator; each ticker is submitted as soon as it is produced.
+    Returns (results, errors); a failing ticker only adds a row to errors.
+    """
+    task = task or update_ticker
+    results, errors = [], errors if errors is not None else []
+    if workers <= 1:
+        init_worker(tf_threads)
+        for ticker, stock_df, ticker_news in jobs:
+            try:
+                result = task(ticker, stock_df, ticker_news, *task_args)
+                if result:
+                    results.append(result)
+            except Exception as e:
+                print(f"⚠️ Error with {ticker}: {e}")
+                errors.append({"Ticker": ticker, "Error": str(e)})
+        return results, errors
+
+    # spawn: TensorFlow is not fork-safe once initialised in the parent
+    ctx = multiprocessing.get_context("spawn")
+    with ProcessPoolExecutor(max_workers=workers, mp_context=ctx,
+                             initializer=init_worker, initargs=(tf_threads,)) as pool:
+        futures = {pool.submit(task, *job, *task_args): job[0] for job in jobs}
+        for done, future in enumerate(as_completed(futures), 1):
+            ticker = futures[future]
+            try:
+                result = future.result()
+                if result:
+                    results.append(result)
+            except Exception as e:
+                print(f"⚠️ Error with {ticker}: {e}")
+                errors.append({"Ticker": ticker, "Error": str(e)})
+            if done % 25 == 0:
+                print(f"… {done}/{len(futures)} tickers finished ({len(errors)} errors)")
+    return results, errors
+
+def upload_results(bucket, results, errors):
+    # Partial results are still written when some tickers failed; none at all keeps the previous file
+    if results:
+        results_df = pd.DataFrame(results, columns=["Ticker", "Predicted_Close"])
+        results_df.to_csv("/tmp/" + PREDICTION_OUTPUT, index=False)
+
+        # Upload result to GCS
+        blob = bucket.blob(GCS_OUTPUT_BLOB)
+        blob.upload_from_filename("/tmp/" + PREDICTION_OUTPUT)
+        print(f"✅ Uploaded predictions to GCS: {GCS_OUTPUT_BLOB}")
+    else:
+        print(f"⚠️ No predictions produced, leaving {GCS_OUTPUT_BLOB} unchanged")
+
+    if errors:
+        pd.DataFrame(errors).to_csv("/tmp/" + ERRORS_OUTPUT, index=False)
+        bucket.blob(GCS_ERRORS_BLOB).upload_from_filename("/tmp/" + ERRORS_OUTPUT)
+        print(f"⚠️ {len(errors)} tickers failed, see {GCS_ERRORS_BLOB}")
+
+# === Checkpoints and Daily Update ===
+class CheckpointStore:
+    """Per-ticker model.keras, scalers.joblib and meta.json under a local directory or gs:// prefix.
+
+    GCS checkpoints are staged through a local directory; the storage client is created
+    lazily so the store can be handed to worker processes.
+    """
+    FILES = ("model.keras", "scalers.joblib", "meta.json")
+
+    def __init__(self, root=CHECKPOINT_DIR):
+        self.root = root
+        self.is_gcs = root.startswith("gs://")
+        if self.is_gcs:
+            self.bucket_name, _, self.prefix = root[len("gs://"):].partition("/")
+            self.local_root = os.path.join(tempfile.gettempdir(), "lstm_checkpoints")
+        else:
+            self.local_root = root
+        self._bucket = None
+
+    def __getstate__(self):
+        return {**self.__dict__, "_bucket": None}
+
+    @property
+    def bucket(self):
+        if self._bucket is None:
+            self._bucket = storage.Client().bucket(self.bucket_name)
+        return self._bucket
+
+    def _local(self, ticker, name):
+        return os.path.join(self.local_root, ticker, name)
+
+    def _blob(self, ticker, name):
+        return self.bucket.blob(f"{self.prefix.rstrip('/')}/{ticker}/{name}")
 
-            df = pd.merge(stock_df, news_df[news_df['ticker'] == ticker], on='date', how='left')
-            df = df.sort_values('date')
+    def _fetch(self, ticker, name):
+        path = self._local(ticker, name)
+        if self.is_gcs:
+            blob = self._blob(ticker, name)
+            if not blob.exists():
+                return None
+            os.makedirs(os.path.dirname(path), exist_ok=True)
+            blob.download_to_filename(path)
+        return path if os.path.exists(path) else None
 
-            if df.shape[0] < 65:
-                continue
+    def load_meta(self, ticker):
+        path = self._fetch(ticker, "meta.json")
+        if path is None:
+            return None
+        with open(path) as f:
+            return json.load(f)
+
+    def load(self, ticker):
+        # (model, scalers); call after load_meta so meta.json is known to exist
+        model_path, scalers_path = self._fetch(ticker, "model.keras"), self._fetch(ticker, "scalers.joblib")
+        if model_path is None or scalers_path is None:
+            return None
+        return load_model(model_path), joblib.load(scalers_path)
+
+    def save(self, ticker, model, scalers, meta):
+        os.makedirs(os.path.join(self.local_root, ticker), exist_ok=True)
+        model.save(self._local(ticker, "model.keras"))
+        joblib.dump(scalers, self._local(ticker, "scalers.joblib"))
+        # meta.json last: a checkpoint only counts once its meta exists
+        with open(self._local(ticker, "meta.json"), "w") as f:
+            json.dump(meta, f)
+        if self.is_gcs:
+            for name in self.FILES:
+                self._blob(ticker, name).upload_from_filename(self._local(ticker, name))
+
+def frame_hash(df):
+    cols = ['date'] + FEATURE_COLUMNS
+    return hashlib.sha1(pd.util.hash_pandas_object(df[cols], index=False).values.tobytes()).hexdigest()
+
+def update_ticker(ticker, stock_df, ticker_news, checkpoints=None, incremental=True, news_last_date=None):
+    """Train or fine-tune one ticker, from and to its checkpoint when a store is given.
+
+    Unchanged data (same content hash) reuses the stored prediction. Otherwise, provided the
+    settled rows (before the checkpoint's last date and before the sentiment days that get
+    refetched) still hash to history_hash, the stored model is fine-tuned on the bars added
+    since, with the stored scalers; anything else (no checkpoint, revised history, different
+    features) is a full retrain.
+    """
+    df = load_ticker_frame(stock_df, ticker_news)
+    if df is None:
+        return None
+    data_hash = frame_hash(df)
+    meta = checkpoints.load_meta(ticker) if checkpoints is not None and incremental else None
+    compatible = meta is not None and meta.get("features") == FEATURE_COLUMNS and meta.get("lookback") == LOOKBACK
 
-            X, y, scaler = prepare_lstm_data(df)
-            X = X.reshape((X.shape[0], X.shape[1], 1))
+    if compatible and meta["data_hash"] == data_hash:
+        return {"Ticker": ticker, "Predicted_Close": meta["predicted_close"], "Mode": "unchanged"}
 
-            model = train_lstm_model(X, y)
+    checkpoint, n_new = None, 0
+    if compatible and "history_hash" in meta:
+        # A mismatch in the settled rows means history was revised
+        if frame_hash(df[df['date'] < pd.Timestamp(meta["settled_before"])]) == meta["history_hash"]:
+            checkpoint = checkpoints.load(ticker)
+            n_new = int((df.dropna(subset=['Close'])['date'] > pd.Timestamp(meta["last_date"])).sum())
 
-            last_input = X[-1].reshape((1, 60, 1))
-            predicted_scaled = model.predict(last_input)[0][0]
-            predicted_close = scaler.inverse_transform([[predicted_scaled]])[0][0]
+    if checkpoint is not None:
+        model, scalers = checkpoint
+        X, y, latest, scalers = build_windows(df, feature_cols=FEATURE_COLUMNS, scalers=scalers)
+        if n_new:
+            model.fit(X[-n_new:], y[-n_new:], epochs=FINE_TUNE_EPOCHS, batch_size=32, verbose=0)
+        mode = "fine-tuned" if n_new else "refreshed"  # refreshed: only recent sentiment changed
+    else:
+        X, y, latest, scalers = build_windows(df, feature_cols=FEATURE_COLUMNS)
+        model = train_lstm_model(X, y)
+        mode = "trained"
 
-            results.append({"Ticker": ticker, "Predicted_Close": predicted_close})
+    predicted_scaled = model.predict(latest, verbose=0)[0][0]
+    predicted_close = float(scalers[0].inverse_transform([[predicted_scaled]])[0][0])
+    if checkpoints is not None:
+        last_date = df['date'].max()
+        settled_before = min(last_date, news_last_date) if news_last_date is not None else last_date
+        checkpoints.save(ticker, model, scalers, {
+            "last_date": last_date.isoformat(),
+            "data_hash": data_hash,
+            "settled_before": settled_before.isoformat(),
+            "history_hash": frame_hash(df[df['date'] < settled_before]),
+            "rows": int(df.shape[0]),
+            "features": FEATURE_COLUMNS,
+            "lookback": LOOKBACK,
+            "predicted_close": predicted_close,
+            "mode": mode,
+            "updated_at": datetime.utcnow().isoformat(),
+        })
+    return {"Ticker": ticker, "Predicted_Close": predicted_close, "Mode": mode}
+
+# === Global Model Mode and Benchmark ===
+def load_all_windows(jobs, errors=None):
+    # Returns ([(ticker, X, y, latest, scalers)] for every ticker with enough history, errors)
+    datasets, errors = [], errors if errors is not None else []
+    for ticker, stock_df, ticker_news in jobs:
+        try:
+            df = load_ticker_frame(stock_df, ticker_news)
+            if df is not None:
+                datasets.append((ticker, *build_windows(df, feature_cols=FEATURE_COLUMNS)))
         except Exception as e:
             print(f"⚠️ Error with {ticker}: {e}")
+            errors.append({"Ticker": ticker, "Error": str(e)})
+    return datasets, errors
+
+def run_global(jobs, checkpoints=None):
+    datasets, errors = load_all_windows(jobs)
+    if not datasets:
+        print("⚠️ No ticker has enough history for the global model")
+        return [], errors
+    model = train_global_model([(ticker, X, y) for ticker, X, y, _, _ in datasets])
+    predicted = predict_global(model, [latest for _, _, _, latest, _ in datasets], range(len(datasets)))
+    results = [
+        {"Ticker": ticker, "Predicted_Close": float(scalers[0].inverse_transform([[p]])[0][0])}
+        for (ticker, _, _, _, scalers), p in zip(datasets, predicted)
+    ]
+    if checkpoints is not None:
+        # Ticker ids are positions in meta["tickers"]; scalers are keyed by ticker
+        checkpoints.save(GLOBAL_CHECKPOINT, model, {ticker: scalers for ticker, _, _, _, scalers in datasets}, {
+            "tickers": [ticker for ticker, *_ in datasets],
+            "features": FEATURE_COLUMNS,
+            "lookback": LOOKBACK,
+            "updated_at": datetime.utcnow().isoformat(),
+        })
+    return results, errors
+
+def rmse_mape(actual, predicted):
+    actual, predicted = np.asarray(actual), np.asarray(predicted)
+    return float(np.sqrt(np.mean((actual - predicted) ** 2))), float(np.mean(np.abs(actual - predicted) / actual) * 100)
+
+def benchmark(jobs, holdout=20):
+    """Wall time and held-out error of per-ticker LSTMs vs the single global model.
+
+    The last `holdout` targets of every ticker are held out; errors are in price units.
+    """
+    # Tickers need enough windows left to train on after the holdout
+    datasets, errors = load_all_windows(jobs)
+    datasets = [d for d in datasets if len(d[1]) > 2 * holdout]
+    if not datasets:
+        print(f"⚠️ No ticker has more than {2 * holdout} windows to benchmark on ({len(errors)} errors)")
+        return None
+    train, test = [], []
+    for ticker, X, y, _, scalers in datasets:
+        scaler = scalers[0]
+        train.append((ticker, X[:-holdout], y[:-holdout]))
+        test.append((X[-holdout:], scaler.inverse_transform(y[-holdout:])[:, 0], scaler))
+
+    start = time.perf_counter()
+    per_ticker_pred = []
+    for (ticker, X_train, y_train), (X_test, _, scaler) in zip(train, test):
+        model = train_lstm_model(X_train, y_train)
+        per_ticker_pred.append(scaler.inverse_transform(model.predict(X_test, verbose=0))[:, 0])
+    per_ticker_seconds = time.perf_counter() - start
+
+    start = time.perf_counter()
+    model = train_global_model(train)
+    ids = np.concatenate([np.full(len(X_test), i, dtype=np.int32) for i, (X_test, _, _) in enumerate(test)])
+    scaled = predict_global(model, [X_test for X_test, _, _ in test], ids)
+    global_seconds = time.perf_counter() - start
+    offsets = np.cumsum([0] + [len(X_test) for X_test, _, _ in test])
+    global_pred = [scaler.inverse_transform(scaled[a:b, None])[:, 0]
+                   for (a, b), (_, _, scaler) in zip(zip(offsets[:-1], offsets[1:]), test)]
+
+    actual = np.concatenate([a for _, a, _ in test])
+    report = pd.DataFrame([
+        ("per-ticker", per_ticker_seconds, *rmse_mape(actual, np.concatenate(per_ticker_pred))),
+        ("global", global_seconds, *rmse_mape(actual, np.concatenate(global_pred))),
+    ], columns=["mode", "wall_seconds", "rmse", "mape_pct"])
+    print(f"Benchmark over {len(datasets)} tickers, last {holdout} days held out:")
+    print(report.to_string(index=False))
+    return report
+
+# === Inference Only ===
+def latest_window(df, scalers):
+    # Scalers are fitted per column and transform each row on its own, so only the last LOOKBACK rows are needed
+    df = df.dropna(subset=['Close']).sort_values('date').tail(LOOKBACK)
+    if df.shape[0] < LOOKBACK:
+        return None
+    scaled, _ = scale_features(df, FEATURE_COLUMNS, scalers)
+    return scaled[None, :, :]
+
+def infer_global(jobs, checkpoints):
+    meta = checkpoints.load_meta(GLOBAL_CHECKPOINT)
+    checkpoint = checkpoints.load(GLOBAL_CHECKPOINT) if meta else None
+    if checkpoint is None:
+        raise RuntimeError(f"No global model checkpoint under {checkpoints.root}; run --mode global first")
+    model, scalers_by_ticker = checkpoint
+    ids = {ticker: i for i, ticker in enumerate(meta["tickers"])}
+
+    tickers, windows, errors = [], [], []
+    for ticker, stock_df, ticker_news in jobs:
+        if ticker not in ids:
+            errors.append({"Ticker": ticker, "Error": "not in the global model"})
+            continue
+        df = load_ticker_frame(stock_df, ticker_news)
+        window = latest_window(df, scalers_by_ticker[ticker]) if df is not None else None
+        if window is not None:
+            tickers.append(ticker)
+            windows.append(window)
+        else:
+            errors.append({"Ticker": ticker, "Error": f"fewer than {LOOKBACK} days of history"})
+    if not windows:
+        return [], errors
+
+    # The whole universe in one batched predict call
+    predicted = predict_global(model, windows, [ids[t] for t in tickers], batch_size=INFERENCE_BATCH_SIZE)
+    results = [
+        {"Ticker": ticker, "Predicted_Close": float(scalers_by_ticker[ticker][0].inverse_transform([[p]])[0][0])}
+        for ticker, p in zip(tickers, predicted)
+    ]
+    return results, errors
+
+def infer_ticker(ticker, stock_df, ticker_news, checkpoints):
+    meta = checkpoints.load_meta(ticker)
+    checkpoint = checkpoints.load(ticker) if meta else None
+    if checkpoint is None:
+        raise RuntimeError("no checkpoint")
+    model, scalers = checkpoint
+    df = load_ticker_frame(stock_df, ticker_news)
+    window = latest_window(df, scalers) if df is not None else None
+    if window is None:
+        return None
+    # Direct call instead of model.predict: no per-call dataset/adapter setup for a single sample
+    predicted_scaled = float(model(window, training=False).numpy()[0][0])
+    return {"Ticker": ticker, "Predicted_Close": float(scalers[0].inverse_transform([[predicted_scaled]])[0][0])}
+
+def infer_per_ticker(jobs, checkpoints, threads=8):
+    # Checkpoint loading is I/O bound; threads overlap the downloads
+    results, errors = [], []
+    with ThreadPoolExecutor(max_workers=threads) as pool:
+        futures = {pool.submit(infer_ticker, *job, checkpoints): job[0] for job in jobs}
+        for future in as_completed(futures):
+            ticker = futures[future]
+            try:
+                result = future.result()
+                if result:
+                    results.append(result)
+            except Exception as e:
+                errors.append({"Ticker": ticker, "Error": str(e)})
+    return results, errors
+
+# === Technical Indicators ===
+def build_close_panel(frames):
+    # (dates x tickers) float32 panel; tickers missing a day are NaN
+    closes = {ticker: stock_df.drop_duplicates('Date', keep='last').set_index('Date')['Close']
+              for ticker, stock_df in frames}
+    return pd.DataFrame(closes).sort_index().astype('float32')
+
+def compute_indicators(closes):
+    """One row per ticker from a (dates x tickers) close panel, every column computed panel-wide.
+
+    Changes and volatility are in percent over trading days (1, 5 and 21 days back for the
+    1d/7d/30d columns, or the oldest close for a shorter history, as the API's live fallback
+    does); drawdown is from the running peak. risk is the volatility tercile.
+    """
+    closes = closes.ffill().astype('float64')
+    returns = closes.pct_change(fill_method=None)
+    last = closes.iloc[-1]
+    first = closes.bfill().iloc[0]
+    back = lambda sessions: closes.shift(sessions).iloc[-1].fillna(first)
+    peak = closes.cummax()
+    drawdown = closes / peak - 1
+    table = pd.DataFrame({
+        "Close": last,
+        "change_1d": (last / back(1) - 1) * 100,
+        "change_7d": (last / back(5) - 1) * 100,
+        "change_30d": (last / back(21) - 1) * 100,
+        "volatility": returns.iloc[-21:].std() * 100,
+        "sma_7": closes.iloc[-7:].mean(),
+        "sma_50": closes.iloc[-50:].mean(),
+        "sma_200": closes.iloc[-200:].mean(),
+        "drawdown": drawdown.iloc[-1] * 100,
+        "max_drawdown_1y": drawdown.iloc[-252:].min() * 100,
+    })
+    table = table.dropna(subset=["Close", "volatility"])
+    # Terciles by rank; unlike qcut this also works for fewer than three tickers
+    ranks = table["volatility"].rank(method="first").to_numpy()
+    table["risk"] = np.array(["low", "medium", "high"])[(3 * (ranks - 1) // max(len(table), 1)).astype(int)]
+    table["as_of"] = closes.index[-1].date().isoformat()
+    return table.rename_axis("Ticker").reset_index().round(4)
+
+def indicator_series(closes, days=SERIES_DAYS):
+    # Long (Date, Ticker, Close, SMA_7) rows for the last `days` sessions
+    closes = closes.astype('float64')
+    sma = closes.ffill().rolling(7).mean()
+    recent = pd.concat({"Close": closes.iloc[-days:], "SMA_7": sma.iloc[-days:]}, axis=1)
+    series = recent.stack(level=1, future_stack=True).rename_axis(["Date", "Ticker"]).reset_index()
+    series = series.dropna(subset=["Close"])
+    series["Date"] = series["Date"].dt.strftime("%Y-%m-%d")
+    return series.round(4)
+
+def run_indicators(bucket, frames):
+    start = time.perf_counter()
+    closes = build_close_panel(frames)
+    table, series = compute_indicators(closes), indicator_series(closes)
+    print(f"📐 Indicators for {len(table)} tickers over {len(closes)} sessions in {time.perf_counter() - start:.1f}s")
+
+    for blob_name, df in ((INDICATORS_BLOB, table), (INDICATOR_SERIES_BLOB, series)):
+        bucket.blob(blob_name).upload_from_string(df.to_csv(index=False), content_type="text/csv")
+        print(f"✅ Uploaded to gs://{BUCKET_NAME}/{blob_name}")
+    return table
+
+# === Main Vertex-Compatible Prediction Logic ===
+def parse_args(argv=None):
+    parser = argparse.ArgumentParser(description="Train LSTM models and predict next-day closes")
+    parser.add_argument("--mode", choices=["per-ticker", "update", "global", "benchmark", "infer", "indicators"],
+                        default="per-ticker",
+                        help="retrain one LSTM per ticker, fine-tune per-ticker checkpoints on new bars, "
+                             "one shared model for all tickers, compare per-ticker and global, "
+                             "predict from stored checkpoints without training, "
+                             "or precompute technical indicators for the API")
+    parser.add_argument("--model", choices=["per-ticker", "global"], default="per-ticker",
+                        help="checkpoints used by --mode infer (the ones --mode per-ticker/update or global saved)")
+    parser.add_argument("--checkpoint-dir", default=CHECKPOINT_DIR,
+                        help="local directory or gs://bucket/prefix for model checkpoints; required by "
+                             "--mode update and infer, other training modes only save checkpoints when set")
+    parser.add_argument("--workers", type=int, default=int(os.getenv("TRAIN_WORKERS", "0")),
+                        help="worker processes (default: cpu count / tf threads)")
+    parser.add_argument("--tf-threads", type=int, default=int(os.getenv("TF_THREADS", "2")),
+                        help="TensorFlow intra-op threads per worker")
+    parser.add_argument("--bench-tickers", type=int, default=50,
+                        help="tickers used by --mode benchmark (0 = all)")
+    parser.add_argument("--news-source", default=os.getenv("NEWS_SOURCE", ""),
+                        help="local CSV/Parquet table used instead of BigQuery for sentiment")
+    parser.add_argument("--news-cache", default=NEWS_CACHE_PATH,
+                        help="local cache of fetched sentiment aggregates ('' disables it)")
+    args = parser.parse_args(argv)
+    if args.mode in ("update", "infer") and not args.checkpoint_dir:
+        parser.error(f"--mode {args.mode} needs --checkpoint-dir (or CHECKPOINT_DIR)")
+    return args
+
+def main(argv=None):
+    args = parse_args(argv)
+    workers = args.workers or max(1, (os.cpu_count() or 1) // args.tf_threads)
+
+    # GCS setup
+    storage_client = storage.Client()
+    bucket = storage_client.bucket(BUCKET_NAME)
+
+    ingest_errors = []
+    if args.mode == "indicators":
+        run_indicators(bucket, stream_stock_frames(bucket, ingest_errors))
+        return
+
+    # Load sentiment from BigQuery (or a local table), partitioned by ticker once
+    if args.news_source:
+        fetch = read_news_table(args.news_source)
+    else:
+        bq_client = bigquery.Client(project=PROJECT_ID)
+        fetch = lambda since: query_news_sentiment(bq_client, since)
+    news = SentimentTable(load_news_sentiment(fetch, args.news_cache))
+
+    # Stream historical prices; each ticker becomes a job as soon as its blob is parsed
+    limit = (args.bench_tickers or None) if args.mode == "benchmark" else None
+    jobs = (
+        (ticker, stock_df, news.get(ticker))
+        for ticker, stock_df in stream_stock_frames(bucket, ingest_errors, limit=limit)
+    )
+
+    if args.mode == "benchmark":
+        benchmark(list(jobs))
+        return
+    checkpoints = CheckpointStore(args.checkpoint_dir) if args.checkpoint_dir else None
+    if args.mode == "infer":
+        print(f"Predicting from {args.model} checkpoints")
+        if args.model == "global":
+            results, errors = infer_global(jobs, checkpoints)
+        else:
+            results, errors = infer_per_ticker(jobs, checkpoints)
+    elif args.mode == "global":
+        print("Training one global model over all tickers")
+        results, errors = run_global(jobs, checkpoints)
+    else:
+        # per-ticker retrains everything from scratch; update starts from the checkpoints. Both save checkpoints if set.
+        incremental = args.mode == "update"
+        print(f"{'Updating' if incremental else 'Training'} tickers on {workers} workers x {args.tf_threads} TF threads")
+        results, errors = train_all(jobs, workers, args.tf_threads, task=update_ticker,
+                                    task_args=(checkpoints, incremental, news.last_date))
+        modes = pd.Series([r.get("Mode") for r in results]).value_counts().to_dict()
+        print(f"Per-ticker modes: {modes}")
 
-    results_df = pd.DataFrame(results)
-    results_df.to_csv("/tmp/" + PREDICTION_OUTPUT, index=False)
+    upload_results(bucket, results, errors + ingest_errors)
 
-    # Upload result to GCS
-    blob = bucket.blob(GCS_OUTPUT_BLOB)
-    blob.upload_from_filename("/tmp/" + PREDICTION_OUTPUT)
-    print(f"✅ Uploaded predictions to GCS: {GCS_OUTPUT_BLOB}")
+def infer_main(argv=None):
+    # Inference-only entry point: refresh Predicted_Close from stored models, no training
+    main(["--mode", "infer", *(argv or [])])
 
 if __name__ == '__main__':
-    main()
+    # `python vertex_lstm_predictor.py infer [--model global ...]` runs inference only
+    if sys.argv[1:2] == ["infer"]:
+        infer_main(sys.argv[2:])
+    else:
+        main()